@@ -5,14 +5,18 @@ from abc import ABC, abstractmethod
 import logging
 from datetime import datetime
 
-from funasr import AutoModel
-from funasr.utils.postprocess_utils import rich_transcription_postprocess
+import numpy as np
 
 
 logger = logging.getLogger(__name__)
 
 
 class ASR(ABC):
+    @staticmethod
+    def _frames_to_array(audio_data):
+        """把录音帧（bytes 或 int16 数组）拼接为一个连续的 int16 数组"""
+        return np.concatenate([np.frombuffer(frame, dtype=np.int16) for frame in audio_data])
+
     @staticmethod
     def _save_audio_to_file(audio_data, file_path):
         """将音频数据保存为WAV文件"""
@@ -21,7 +25,10 @@ class ASR(ABC):
                 wf.setnchannels(1)
                 wf.setsampwidth(2)
                 wf.setframerate(16000)
-                wf.writeframes(b''.join(audio_data))
+                if isinstance(audio_data, np.ndarray):
+                    wf.writeframes(audio_data.tobytes())
+                else:
+                    wf.writeframes(b''.join(audio_data))
             logger.info(f"ASR识别文件录音保存到：{file_path}")
         except Exception as e:
             logger.error(f"保存音频文件时发生错误: {e}")
@@ -32,12 +39,30 @@ class ASR(ABC):
         """处理输入音频流并返回识别的文本，子类必须实现"""
         pass
 
+    def stream_start(self):
+        """开始一段新的语音；默认实现只缓存帧，等到 stream_finish 时整段识别"""
+        self._stream_frames = []
+
+    def stream_accept(self, frame):
+        """送入一帧 VAD 之后的音频，返回当前的部分识别结果，没有则返回 None"""
+        # 帧可能是录音环形缓冲的视图，需要保留时拷贝一份
+        self._stream_frames.append(np.frombuffer(frame, dtype=np.int16).copy())
+        return None
+
+    def stream_finish(self):
+        """语音结束，返回 (text, tmpfile)"""
+        frames, self._stream_frames = self._stream_frames, []
+        return self.recognizer(frames)
+
 
 class FunASR(ASR):
     def __init__(self, config):
         self.model_dir = config.get("model_dir")
         self.output_dir = config.get("output_file")
+        # 调试用：是否把每次识别的录音写入 output_dir，默认直接在内存中识别
+        self.save_audio = config.get("save_audio", False)
 
+        from funasr import AutoModel
         self.model = AutoModel(
             model=self.model_dir,
             vad_kwargs={"max_single_segment_time": 30000},
@@ -48,17 +73,24 @@ class FunASR(ASR):
 
     def recognizer(self, stream_in_audio):
         try:
-            tmpfile = os.path.join(self.output_dir, f"asr-{datetime.now().date()}@{uuid.uuid4().hex}.wav")
-            self._save_audio_to_file(stream_in_audio, tmpfile)
+            audio_int16 = self._frames_to_array(stream_in_audio)
+            tmpfile = None
+            if self.save_audio:
+                tmpfile = os.path.join(self.output_dir, f"asr-{datetime.now().date()}@{uuid.uuid4().hex}.wav")
+                self._save_audio_to_file(audio_int16, tmpfile)
 
+            # 模型需要 [-1, 1] 的 float32 输入，直接传入数组，不再经过磁盘
+            audio_float32 = audio_int16.astype(np.float32) / 32768.0
             res = self.model.generate(
-                input=tmpfile,
+                input=audio_float32,
+                fs=16000,
                 cache={},
                 language="auto",  # 语言选项: "zn", "en", "yue", "ja", "ko", "nospeech"
                 use_itn=True,
                 batch_size_s=60,
             )
 
+            from funasr.utils.postprocess_utils import rich_transcription_postprocess
             text = rich_transcription_postprocess(res[0]["text"])
             logger.info(f"识别文本: {text}")
             return text, tmpfile
@@ -68,6 +100,94 @@ class FunASR(ASR):
             return None, None
 
 
+class FunASRStreaming(ASR):
+    """
+    流式识别（paraformer-zh-streaming），在用户说话的同时按块解码，
+    解码器状态保存在 cache 中，VAD 结束时只需解码最后不足一块的音频。
+    """
+
+    def __init__(self, config):
+        # 与其他引擎一样只从本地目录加载，不在运行时从模型仓库下载
+        self.model_dir = config.get("model_dir", "models/paraformer-zh-streaming")
+        self.output_dir = config.get("output_file")
+        self.save_audio = config.get("save_audio", False)
+        # [0, 10, 5]: 每块 10*60ms=600ms，向后看 5*60ms
+        self.chunk_size = config.get("chunk_size", [0, 10, 5])
+        self.encoder_chunk_look_back = config.get("encoder_chunk_look_back", 4)
+        self.decoder_chunk_look_back = config.get("decoder_chunk_look_back", 1)
+        self.chunk_stride = self.chunk_size[1] * 960  # 16k 采样下每块的采样点数
+
+        from funasr import AutoModel
+        self.model = AutoModel(
+            model=self.model_dir,
+            disable_update=True,
+            hub="hf"
+        )
+        self.stream_start()
+
+    def _decode(self, audio_int16, is_final):
+        res = self.model.generate(
+            input=audio_int16.astype(np.float32) / 32768.0,
+            cache=self._cache,
+            is_final=is_final,
+            chunk_size=self.chunk_size,
+            encoder_chunk_look_back=self.encoder_chunk_look_back,
+            decoder_chunk_look_back=self.decoder_chunk_look_back,
+        )
+        if res and res[0].get("text"):
+            self._texts.append(res[0]["text"])
+
+    def stream_start(self):
+        self._cache = {}
+        self._texts = []
+        self._pending = []
+        self._pending_samples = 0
+        self._stream_frames = []
+
+    def stream_accept(self, frame):
+        audio_int16 = np.frombuffer(frame, dtype=np.int16).copy()
+        if self.save_audio:
+            self._stream_frames.append(audio_int16)
+        self._pending.append(audio_int16)
+        self._pending_samples += len(audio_int16)
+        if self._pending_samples < self.chunk_stride:
+            return None
+        try:
+            pending = np.concatenate(self._pending)
+            self._decode(pending[:self.chunk_stride], is_final=False)
+            rest = pending[self.chunk_stride:]
+            self._pending = [rest] if len(rest) else []
+            self._pending_samples = len(rest)
+        except Exception as e:
+            logger.error(f"流式ASR解码出错: {e}")
+            return None
+        partial = "".join(self._texts)
+        return partial if partial else None
+
+    def stream_finish(self):
+        try:
+            tmpfile = None
+            if self.save_audio and self._stream_frames:
+                tmpfile = os.path.join(self.output_dir, f"asr-{datetime.now().date()}@{uuid.uuid4().hex}.wav")
+                self._save_audio_to_file(np.concatenate(self._stream_frames), tmpfile)
+            rest = np.concatenate(self._pending) if self._pending else np.zeros(0, dtype=np.int16)
+            self._decode(rest, is_final=True)
+            text = "".join(self._texts)
+            logger.info(f"识别文本: {text}")
+            return text, tmpfile
+        except Exception as e:
+            logger.error(f"ASR识别过程中发生错误: {e}")
+            return None, None
+        finally:
+            self.stream_start()
+
+    def recognizer(self, stream_in_audio):
+        self.stream_start()
+        for frame in stream_in_audio:
+            self.stream_accept(frame)
+        return self.stream_finish()
+
+
 def create_instance(class_name, *args, **kwargs):
     # 获取类对象
     cls = globals().get(class_name)
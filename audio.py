@@ -0,0 +1,279 @@
+import os
+import queue
+import tempfile
+import threading
+import time
+import uuid
+import wave
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def to_numpy(audio):
+    """把 TTS 引擎输出的音频（numpy 或 torch tensor）统一转换为一维 float32 数组"""
+    if hasattr(audio, "detach"):
+        audio = audio.detach().cpu().numpy()
+    return np.asarray(audio, dtype=np.float32).reshape(-1)
+
+
+class PCMAudio:
+    """
+    内存中的单声道 PCM 音频，samples 为 [-1, 1] 区间的 float32。
+    TTS 直接产出该对象交给播放器，口型同步也基于同一份数据计算，整条链路不落盘。
+    """
+
+    def __init__(self, samples, sample_rate):
+        self.samples = to_numpy(samples)
+        self.sample_rate = sample_rate
+
+    @property
+    def duration(self):
+        return len(self.samples) / self.sample_rate
+
+    def resample(self, sample_rate):
+        """线性插值重采样，足够用于语音播放"""
+        if sample_rate == self.sample_rate or len(self.samples) == 0:
+            return self
+        n = int(round(len(self.samples) * sample_rate / self.sample_rate))
+        positions = np.linspace(0, len(self.samples) - 1, n, dtype=np.float64)
+        samples = np.interp(positions, np.arange(len(self.samples)), self.samples).astype(np.float32)
+        return PCMAudio(samples, sample_rate)
+
+    def to_int16(self):
+        return (np.clip(self.samples, -1.0, 1.0) * 32767).astype(np.int16)
+
+    def rms_envelope(self, window_ms=10):
+        """按 window_ms 切窗计算 RMS，用于口型同步"""
+        window = max(1, int(self.sample_rate * window_ms / 1000))
+        n = len(self.samples) // window
+        if n == 0:
+            return np.zeros(0, dtype=np.float32)
+        frames = self.samples[:n * window].reshape(n, window)
+        return np.sqrt(np.mean(np.square(frames), axis=1))
+
+    def save(self, file_path):
+        """保存为 16bit WAV，仅用于调试或不支持内存播放的播放器"""
+        with wave.open(file_path, 'wb') as wf:
+            wf.setnchannels(1)
+            wf.setsampwidth(2)
+            wf.setframerate(self.sample_rate)
+            wf.writeframes(self.to_int16().tobytes())
+        return file_path
+
+    def save_temp(self, output_dir=None):
+        output_dir = output_dir or tempfile.gettempdir()
+        return self.save(os.path.join(output_dir, f"pcm-{uuid.uuid4().hex}.wav"))
+
+    @classmethod
+    def from_file(cls, file_path):
+        """解码音频文件（mp3/aiff/wav 等），只在引擎只能输出文件时使用"""
+        from pydub import AudioSegment
+        segment = AudioSegment.from_file(file_path).set_channels(1)
+        scale = float(1 << (8 * segment.sample_width - 1))
+        samples = np.array(segment.get_array_of_samples(), dtype=np.float32) / scale
+        return cls(samples, segment.frame_rate)
+
+
+class AudioStream:
+    """
+    按块到达的音频流：TTS 线程边合成边 put，播放器线程边取边播，
+    首块合成完即可开始播放，不必等整句合成结束。
+    """
+    _END = object()
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self.closed = False
+        # 第一个采样开始发声、播放结束的时刻（time.monotonic），由播放器记录
+        self.started_at = None
+        self.finished_at = None
+        self._callbacks = {"started_at": [], "finished_at": []}
+        self._callback_lock = threading.Lock()
+
+    @classmethod
+    def of(cls, audio):
+        """由单个完整音频构造一个已结束的流"""
+        stream = cls()
+        stream.put(audio)
+        stream.close()
+        return stream
+
+    def put(self, audio):
+        self._queue.put(audio)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self._queue.put(self._END)
+
+    def get(self, timeout=None):
+        """取下一块音频；流结束返回 None，超时抛出 queue.Empty"""
+        item = self._queue.get(timeout=timeout)
+        if item is self._END:
+            # 允许重复读取结束标记
+            self._queue.put(self._END)
+            return None
+        return item
+
+    def on_start(self, callback):
+        """第一个采样发声时以该时刻调用 callback(started_at)；已经开始播放则立即调用"""
+        self._on("started_at", callback)
+
+    def on_finish(self, callback):
+        """播放结束（或被打断、流为空）时以该时刻调用 callback(finished_at)"""
+        self._on("finished_at", callback)
+
+    def mark_started(self, when):
+        """播放器在第一块音频开始发声时调用，重复调用只记第一次"""
+        self._mark("started_at", when)
+
+    def mark_finished(self, when):
+        self._mark("finished_at", when)
+
+    def _on(self, attr, callback):
+        with self._callback_lock:
+            when = getattr(self, attr)
+            if when is None:
+                self._callbacks[attr].append(callback)
+                return
+        callback(when)
+
+    def _mark(self, attr, when):
+        with self._callback_lock:
+            if getattr(self, attr) is not None:
+                return
+            setattr(self, attr, when)
+            callbacks, self._callbacks[attr] = self._callbacks[attr], []
+        for callback in callbacks:
+            try:
+                callback(when)
+            except Exception as e:
+                logger.error(f"播放回调出错: {e}")
+
+    def join(self):
+        """阻塞直到流结束，拼接为一个完整的 PCMAudio"""
+        chunks = []
+        while (audio := self.get()) is not None:
+            chunks.append(audio)
+        if not chunks:
+            return None
+        return PCMAudio(np.concatenate([c.samples for c in chunks]), chunks[0].sample_rate)
+
+    def __iter__(self):
+        while (audio := self.get()) is not None:
+            yield audio
+
+
+class AudioRingBuffer:
+    """
+    预分配的 int16 环形缓冲，单生产者单消费者：录音线程写入任意长度的采样，
+    VAD 线程按固定帧长读取，读写双方只推进各自的计数，交接帧时不分配内存。
+    - 写入方运行在音频回调的实时线程里，不加锁、不通知；读取方每 poll_interval 秒检查一次写入位置
+    - 读出的帧拷贝到读取方持有的缓冲后再校验，拷贝期间被写入方追上覆盖的帧按溢出处理，不会读到撕裂的数据
+    未读数据被覆盖时记为 overrun，读指针跳到仍完整的最旧帧，内存占用固定。
+    可选放在共享内存中，供其他进程按同样的索引读取。
+    """
+
+    def __init__(self, frame_size=512, capacity_frames=256, shared_memory=False, poll_interval=0.005):
+        self.frame_size = frame_size
+        self.capacity = frame_size * capacity_frames
+        self.poll_interval = poll_interval
+        self._shm = None
+        if shared_memory:
+            from multiprocessing import shared_memory as shm
+            self._shm = shm.SharedMemory(create=True, size=self.capacity * 2)
+            self._buf = np.ndarray((self.capacity,), dtype=np.int16, buffer=self._shm.buf)
+            self._buf.fill(0)
+        else:
+            self._buf = np.zeros(self.capacity, dtype=np.int16)
+        # 单调递增的写入/读取采样数，取模得到缓冲内位置；
+        # _claim_pos 是正在写入的区间末尾，写入前先推进，读取方据此判断拷贝期间是否被覆盖
+        self.write_pos = 0
+        self._claim_pos = 0
+        self.read_pos = 0
+        # read_frame 返回的帧，由唯一的读取方持有，下次 read_frame 时被覆盖
+        self._frame = np.zeros(frame_size, dtype=np.int16)
+        self.closed = False
+        self.overruns = 0
+        self.dropped_samples = 0
+
+    @property
+    def shm_name(self):
+        return self._shm.name if self._shm is not None else None
+
+    def write(self, samples):
+        """写入 bytes 或 int16 数组，只做一次拷贝到预分配缓冲，不加锁"""
+        data = np.frombuffer(samples, dtype=np.int16)
+        write_pos = self.write_pos
+        if len(data) > self.capacity:
+            # 单次写入超过容量，只保留最新的部分，位置计数仍按全部采样推进
+            write_pos += len(data) - self.capacity
+            data = data[-self.capacity:]
+        n = len(data)
+        self._claim_pos = write_pos + n
+        start = write_pos % self.capacity
+        first = min(n, self.capacity - start)
+        self._buf[start:start + first] = data[:first]
+        if first < n:
+            self._buf[:n - first] = data[first:]
+        self.write_pos = write_pos + n
+
+    def read_frame(self, timeout=None):
+        """
+        读取下一帧，返回 (帧序号, 帧)，超时或关闭时返回 (None, None)。
+        帧是读取方持有的缓冲，下次 read_frame 时被覆盖，需要保存时由调用方自行拷贝。
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            available = self.write_pos - self.read_pos
+            if available > self.capacity:
+                self._skip_overrun(available - self.capacity)
+                continue
+            if available >= self.frame_size:
+                index = self.read_pos // self.frame_size
+                if self.frame_at(index, out=self._frame) is None:
+                    # 拷贝期间被覆盖，按溢出跳过
+                    self._skip_overrun(self._claim_pos - self.capacity - self.read_pos)
+                    continue
+                self.read_pos += self.frame_size
+                return index, self._frame
+            if self.closed:
+                return None, None
+            if deadline is not None and time.monotonic() >= deadline:
+                return None, None
+            time.sleep(self.poll_interval)
+
+    def _skip_overrun(self, lost):
+        skip = max(1, -(-lost // self.frame_size)) * self.frame_size
+        self.read_pos += skip
+        self.overruns += 1
+        self.dropped_samples += skip
+        logger.warning(f"录音环形缓冲溢出，丢弃 {skip} 个采样，累计 {self.overruns} 次")
+
+    def frame_at(self, index, out=None):
+        """
+        按帧序号取一帧的拷贝，写入 out（不提供时新分配），已被覆盖则返回 None。
+        拷贝后再检查写入方是否已追上这一帧，拷贝期间被覆盖同样返回 None。
+        容量是帧长的整数倍，帧不会跨越缓冲末尾。
+        """
+        start = index * self.frame_size
+        if start < self._claim_pos - self.capacity or start + self.frame_size > self.write_pos:
+            return None
+        offset = start % self.capacity
+        if out is None:
+            out = np.empty(self.frame_size, dtype=np.int16)
+        out[:] = self._buf[offset:offset + self.frame_size]
+        if start < self._claim_pos - self.capacity:
+            return None
+        return out
+
+    def close(self):
+        self.closed = True
+        if self._shm is not None:
+            self._buf = np.zeros(0, dtype=np.int16)
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
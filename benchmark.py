@@ -0,0 +1,248 @@
+"""
+性能基准脚本，用法：
+    python benchmark.py vad-gate --wav tmp/idle.wav
+    python benchmark.py vad-backends --wav tmp/speech.wav
+    python benchmark.py import-time --module robot
+    python benchmark.py rag-index --count 3000
+"""
+import argparse
+import copy
+import glob
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import wave
+
+from utils import read_config
+
+
+def read_wav_frames(wav_path, frame_size=512):
+    """读取 16k 单声道 16bit 录音，按 VAD 帧长切分"""
+    with wave.open(wav_path, 'rb') as wf:
+        if wf.getframerate() != 16000 or wf.getnchannels() != 1 or wf.getsampwidth() != 2:
+            raise ValueError("需要 16kHz 单声道 16bit 的 wav 录音")
+        data = wf.readframes(wf.getnframes())
+    step = frame_size * 2
+    return [data[i:i + step] for i in range(0, len(data) - step + 1, step)]
+
+
+def _run_vad(vad_instance, frames):
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    for frame in frames:
+        vad_instance.is_vad(frame)
+    return time.process_time() - cpu_start, time.perf_counter() - wall_start
+
+
+def _rss_bytes():
+    """当前进程的常驻内存（RSS），包括 torch、onnxruntime 在 C/C++ 层的分配；非 Linux 返回 None"""
+    try:
+        import resource
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * resource.getpagesize()
+    except (ImportError, OSError, IndexError, ValueError):
+        return None
+
+
+def bench_vad_gate(args):
+    """对比开启/关闭能量预判时 SileroVAD 的 CPU 占用和跳帧比例"""
+    from vad import SileroVAD
+
+    frames = read_wav_frames(args.wav)
+    vad_config = read_config(args.config)["VAD"]["SileroVAD"]
+    results = {}
+    for enabled in (False, True):
+        config = copy.deepcopy(vad_config)
+        config["pre_gate"] = dict(config.get("pre_gate") or {}, enabled=enabled)
+        vad_instance = SileroVAD(config)
+        cpu, wall = _run_vad(vad_instance, frames)
+        results[enabled] = (cpu, wall, vad_instance.skipped_frames)
+
+    audio_seconds = len(frames) * 512 / 16000
+    base_cpu = results[False][0]
+    gate_cpu, gate_wall, skipped = results[True]
+    print(f"音频时长: {audio_seconds:.1f} 秒, 共 {len(frames)} 帧")
+    print(f"关闭预判: CPU {base_cpu:.3f} 秒, 墙钟 {results[False][1]:.3f} 秒")
+    print(f"开启预判: CPU {gate_cpu:.3f} 秒, 墙钟 {gate_wall:.3f} 秒")
+    print(f"跳过帧比例: {skipped / max(1, len(frames)):.1%}")
+    if base_cpu > 0:
+        print(f"节省 CPU: {(base_cpu - gate_cpu) / base_cpu:.1%}")
+
+
+def bench_vad_backends(args):
+    """
+    对比 torch 与 onnxruntime 两个 Silero 后端的逐帧延迟和内存：
+    RSS 增量为加载模型并跑完所有帧后进程常驻内存的增长，包括原生库的分配；
+    Python 堆分配由 tracemalloc 统计，看不到 torch/onnxruntime 内部的内存
+    """
+    import vad
+
+    frames = read_wav_frames(args.wav)[:args.max_frames]
+    vad_configs = read_config(args.config)["VAD"]
+    for backend in ("SileroVAD", "SileroVADOnnx"):
+        config = copy.deepcopy(vad_configs.get(backend) or vad_configs["SileroVAD"])
+        # 只比较模型推理本身，关闭能量预判
+        config["pre_gate"] = {"enabled": False}
+        rss_before = _rss_bytes()
+        vad_instance = vad.create_instance(backend, config)
+        for frame in frames[:20]:  # 预热
+            vad_instance.is_vad(frame)
+        vad_instance.reset_states()
+
+        latencies = []
+        for frame in frames:
+            start = time.perf_counter_ns()
+            vad_instance.is_vad(frame)
+            latencies.append((time.perf_counter_ns() - start) / 1000)
+
+        # 逐帧统计 Python 堆上临时分配的峰值（tracemalloc 只能看到经由 Python/numpy 分配器的内存）
+        vad_instance.reset_states()
+        tracemalloc.start()
+        transient = []
+        for frame in frames:
+            baseline = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            vad_instance.is_vad(frame)
+            transient.append(tracemalloc.get_traced_memory()[1] - baseline)
+        tracemalloc.stop()
+        rss_after = _rss_bytes()
+
+        latencies.sort()
+        rss = (f"{(rss_after - rss_before) / 1024 / 1024:.1f} MB"
+               if rss_before is not None and rss_after is not None else "不可用")
+        print(f"{backend}: {len(frames)} 帧, "
+              f"平均 {statistics.mean(latencies):.0f} us, "
+              f"p50 {latencies[len(latencies) // 2]:.0f} us, "
+              f"p99 {latencies[int(len(latencies) * 0.99) - 1]:.0f} us, "
+              f"RSS 增量 {rss}, "
+              f"每帧 Python 堆临时分配 {statistics.mean(transient):.0f} 字节")
+
+
+def bench_import_time(args):
+    """在干净的子进程里用 -X importtime 导入入口模块，统计总耗时、峰值内存和各个包的导入耗时"""
+    code = ("import resource, time; t = time.perf_counter(); "
+            f"import {args.module}; "
+            "print(time.perf_counter() - t, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)")
+    runs = []
+    packages = {}
+    for _ in range(args.repeat):
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                              capture_output=True, text=True)
+        if proc.returncode != 0:
+            print(proc.stderr.strip().splitlines()[-1])
+            return
+        seconds, max_rss_kb = proc.stdout.split()
+        runs.append((float(seconds), int(max_rss_kb)))
+        # 每行格式：import time: self [us] | cumulative | imported package，按顶层包累加 self 耗时
+        for line in proc.stderr.splitlines():
+            if not line.startswith("import time:") or "cumulative" in line:
+                continue
+            self_us, _, name = line[len("import time:"):].split("|")
+            top = name.strip().split(".")[0]
+            packages[top] = packages.get(top, 0) + int(self_us) / args.repeat
+
+    seconds = statistics.median(r[0] for r in runs)
+    max_rss = statistics.median(r[1] for r in runs)
+    print(f"import {args.module}: 中位数 {seconds:.3f} 秒, 峰值 RSS {max_rss / 1024:.0f} MB（{args.repeat} 次）")
+    for name, us in sorted(packages.items(), key=lambda x: -x[1])[:args.top]:
+        print(f"  {name:<24} {us / 1000:8.1f} ms")
+
+
+def _make_markdown(doc_path, count, seed=0):
+    """生成 count 个合成 markdown 文档，每个几段中文"""
+    rng = random.Random(seed)
+    words = ["语音", "模型", "识别", "合成", "对话", "记忆", "检索", "向量", "延迟", "缓存",
+             "用户", "助手", "文档", "索引", "本地", "部署", "推理", "实时", "打断", "播放"]
+    for i in range(count):
+        sub_dir = os.path.join(doc_path, f"{i // 500:03d}")
+        os.makedirs(sub_dir, exist_ok=True)
+        paragraphs = [f"# 文档 {i}"]
+        for _ in range(rng.randint(2, 6)):
+            paragraphs.append("".join(rng.choice(words) for _ in range(rng.randint(40, 200))) + "。")
+        with open(os.path.join(sub_dir, f"doc-{i}.md"), "w", encoding="utf-8") as file:
+            file.write("\n\n".join(paragraphs))
+
+
+def bench_rag_index(args):
+    """为几千个 markdown 文档建索引：冷启动、无变化重启、少量修改后的文档/秒，以及查询缓存"""
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+    from vector_index import BatchEmbedder, VectorIndex
+
+    rag_config = read_config(args.config)["Rag"]
+    work_dir = tempfile.mkdtemp(prefix="rag-bench-")
+    doc_path = args.docs
+    if doc_path is None:
+        doc_path = os.path.join(work_dir, "docs")
+        _make_markdown(doc_path, args.count)
+    index_dir = os.path.join(work_dir, "index")
+
+    chunk_size = rag_config.get("chunk_size", 1000)
+    chunk_overlap = rag_config.get("chunk_overlap", 200)
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    embedder = BatchEmbedder(rag_config["emb_model"],
+                             batch_size=args.batch_size or rag_config.get("embed_batch_size", 64),
+                             workers=args.workers or rag_config.get("embed_workers", 2),
+                             cache_size=rag_config.get("embedding_cache_size", 4096))
+    signature = {"emb_model": rag_config["emb_model"], "chunk_size": chunk_size, "chunk_overlap": chunk_overlap}
+    embedder.model  # 模型加载不计入建索引时间
+
+    def run(label):
+        start = time.perf_counter()
+        index = VectorIndex(index_dir, signature)
+        changed, deleted = index.update(doc_path, "**/*.md", splitter.split_text, embedder.embed_documents)
+        elapsed = time.perf_counter() - start
+        print(f"{label}: {len(index.files)} 个文档, {len(index)} 个分块, 重新向量化 {changed} 个文档, "
+              f"耗时 {elapsed:.2f} 秒, {len(index.files) / elapsed:.0f} 文档/秒")
+        return index
+
+    print(f"批大小 {embedder.batch_size}, 线程数 {embedder.workers}, 文档目录 {doc_path}")
+    run("冷启动建索引")
+    run("重启（无变化）")
+    # 修改 1% 的文档：追加一段，原有分块的向量可以复用
+    files = sorted(glob.glob(os.path.join(doc_path, "**", "*.md"), recursive=True))
+    for file_path in files[::100]:
+        with open(file_path, "a", encoding="utf-8") as file:
+            file.write("\n\n新增的段落。")
+    index = run("修改 1% 后")
+
+    for label in ("查询（未缓存）", "查询（已缓存）"):
+        start = time.perf_counter()
+        index.search(embedder.embed_query("本地语音模型的延迟"), 4)
+        print(f"{label}: {(time.perf_counter() - start) * 1000:.1f} ms")
+    print(f"向量缓存命中 {embedder.cache.hits} 次, 未命中 {embedder.cache.misses} 次")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="EdgePersona 性能基准")
+    parser.add_argument("--config", default="config.yaml", help="配置文件")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    vad_gate = subparsers.add_parser("vad-gate", help="VAD 能量预判的跳帧比例与 CPU 节省")
+    vad_gate.add_argument("--wav", required=True, help="录制的空闲环境音（16kHz 单声道）")
+    vad_gate.set_defaults(func=bench_vad_gate)
+
+    vad_backends = subparsers.add_parser("vad-backends", help="Silero torch 与 onnxruntime 后端的逐帧延迟、RSS 增量和 Python 堆分配")
+    vad_backends.add_argument("--wav", required=True, help="16kHz 单声道录音")
+    vad_backends.add_argument("--max-frames", type=int, default=2000)
+    vad_backends.set_defaults(func=bench_vad_backends)
+
+    import_time = subparsers.add_parser("import-time", help="入口模块的导入耗时与内存")
+    import_time.add_argument("--module", default="robot")
+    import_time.add_argument("--repeat", type=int, default=3)
+    import_time.add_argument("--top", type=int, default=15)
+    import_time.set_defaults(func=bench_import_time)
+
+    rag_index = subparsers.add_parser("rag-index", help="RAG 建索引的文档/秒与向量缓存")
+    rag_index.add_argument("--docs", help="markdown 文档目录，不指定时生成合成文档")
+    rag_index.add_argument("--count", type=int, default=3000, help="合成文档数量")
+    rag_index.add_argument("--batch-size", type=int, help="覆盖配置中的 embed_batch_size")
+    rag_index.add_argument("--workers", type=int, help="覆盖配置中的 embed_workers")
+    rag_index.set_defaults(func=bench_rag_index)
+
+    args = parser.parse_args()
+    args.func(args)
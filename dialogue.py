@@ -1,8 +1,24 @@
+import json
+import logging
 import os.path
+import re
+import threading
 import uuid
 from typing import List, Dict
 from datetime import datetime
-from utils import write_json_file
+from utils import atomic_write, append_jsonl, read_jsonl
+
+logger = logging.getLogger(__name__)
+
+_CJK_PATTERN = re.compile(r'[\u3000-\u303f\u3400-\u9fff\uf900-\ufaff\uff00-\uffef]')
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数：中日文字符按 1 个 token，其余按 4 个字符 1 个 token"""
+    if not text:
+        return 0
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
 
 
 class Message:
@@ -21,34 +37,190 @@ class Message:
 
 
 class Dialogue:
-    def __init__(self, dialogue_history_path):
+    """
+    对话上下文窗口：
+    - put 时即把消息序列化为 LLM 格式并缓存，get_llm_dialogue 不再逐条重建
+    - 超过 max_tokens 时按整轮（从一条 user 消息到下一条 user 消息之前）滑出窗口，
+      函数调用与对应的 tool 结果总在同一轮，不会被拆开
+    - system 消息固定保留在窗口里
+    - 滑出的消息交给 on_evict，由调用方并入记忆摘要
+    - 推迟替换的系统提示词在下次滑动时生效；没有 token 预算，或连续 max_deferred_turns 轮
+      都没有滑动时，在下一轮 user 消息之前生效
+    """
+
+    # 每条消息的角色、分隔符等固定开销
+    MESSAGE_OVERHEAD_TOKENS = 4
+
+    def __init__(self, dialogue_history_path, max_tokens=None, on_evict=None, compact_every=20,
+                 max_deferred_turns=8):
         self.dialogue_history_path = dialogue_history_path
         self.dialogue: List[Message] = []
         # 获取当前时间
         self.current_time  = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self.max_tokens = max_tokens
+        self.on_evict = on_evict
+        # 与 dialogue 一一对应的 LLM 格式消息和 token 数，只追加不重建
+        self._serialized: List[Dict[str, str]] = []
+        self._tokens: List[int] = []
+        # 窗口起点之前仍保留的 system 消息，只在滑动时更新
+        self._prefix: List[Dict[str, str]] = []
+        self._prefix_tokens = 0
+        self.window_start = 0
+        self._window_tokens = 0
+        # 会话日志：每轮只追加新消息，每 compact_every 次追加整理一次
+        self.compact_every = compact_every
+        self._dumped = 0
+        self._appends = 0
+        # 已滑出窗口的日志记录条数，滑出的总是日志开头的若干条
+        self.evicted_records = 0
+        self._log_lock = threading.Lock()
+        self._lock = threading.RLock()
+        # 推迟到下次滑动时替换的系统提示词，及其等待的轮数
+        self._pending_system = None
+        self._deferred_turns = 0
+        self.max_deferred_turns = max_deferred_turns
+
+    @staticmethod
+    def _to_llm(m: Message) -> Dict[str, str]:
+        if m.tool_calls is not None:
+            return {"role": m.role, "tool_calls": m.tool_calls}
+        elif m.role == "tool":
+            return {"role": m.role, "tool_call_id": m.tool_call_id, "content": m.content}
+        else:
+            return {"role": m.role, "content": m.content}
+
+    def _count_tokens(self, m: Message) -> int:
+        text = m.content or ""
+        if m.tool_calls is not None:
+            text += json.dumps(m.tool_calls, ensure_ascii=False)
+        return estimate_tokens(text) + self.MESSAGE_OVERHEAD_TOKENS
 
     def put(self, message: Message):
-        self.dialogue.append(message)
+        with self._lock:
+            if message.role == "user" and self._pending_system is not None:
+                self._apply_deferred_at_turn()
+            self.dialogue.append(message)
+            self._serialized.append(self._to_llm(message))
+            tokens = self._count_tokens(message)
+            self._tokens.append(tokens)
+            self._window_tokens += tokens
+            self._slide()
+
+    def replace_system_prompt(self, content, defer=False):
+        """
+        替换开头的系统提示词（如记忆摘要更新后），其余消息的缓存不受影响。
+        defer 为真且已有后续消息时，先记下，等窗口下次滑动（前缀本来就会变化）时再替换，
+        保证发给 LLM 的前缀在两次滑动之间逐字节不变。
+        """
+        with self._lock:
+            if not self.dialogue or self.dialogue[0].role != "system":
+                return False
+            if defer and len(self.dialogue) > 1:
+                if self._pending_system is None:
+                    self._deferred_turns = 0
+                self._pending_system = content
+                return True
+            self._apply_system_prompt(content)
+            self._slide()
+            return True
+
+    def _apply_deferred_at_turn(self):
+        """新一轮开始：窗口不会滑动或已等待太久时，在这一轮的边界上替换系统提示词"""
+        self._deferred_turns += 1
+        if not self.max_tokens or self._deferred_turns > self.max_deferred_turns:
+            logger.debug(f"窗口 {self._deferred_turns - 1} 轮未滑动，在轮次边界替换系统提示词")
+            self._apply_system_prompt(self._pending_system)
+
+    def _apply_system_prompt(self, content):
+        self._pending_system = None
+        self._deferred_turns = 0
+        message = self.dialogue[0]
+        message.content = content
+        old, new = self._serialized[0], self._to_llm(message)
+        self._serialized[0] = new
+        tokens = self._count_tokens(message)
+        delta, self._tokens[0] = tokens - self._tokens[0], tokens
+        if self.window_start > 0:
+            self._prefix = [new if d is old else d for d in self._prefix]
+            self._prefix_tokens += delta
+        else:
+            self._window_tokens += delta
+
+    def token_count(self) -> int:
+        """当前窗口内的估算 token 数"""
+        return self._prefix_tokens + self._window_tokens
+
+    def _next_turn_start(self):
+        """窗口内第二轮的起点，只有一轮（正在进行的一轮）时返回 None"""
+        for i in range(self.window_start + 1, len(self.dialogue)):
+            if self.dialogue[i].role == "user":
+                return i
+        return None
+
+    def _slide(self):
+        if not self.max_tokens:
+            return
+        evicted = []
+        while self.token_count() > self.max_tokens:
+            end = self._next_turn_start()
+            if end is None:
+                break
+            for i in range(self.window_start, end):
+                self._window_tokens -= self._tokens[i]
+                if self.dialogue[i].role == "system":
+                    self._prefix.append(self._serialized[i])
+                    self._prefix_tokens += self._tokens[i]
+                else:
+                    evicted.append(self._serialized[i])
+                    if self._is_logged(self._serialized[i]):
+                        self.evicted_records += 1
+            self.window_start = end
+        if evicted and self._pending_system is not None:
+            self._apply_system_prompt(self._pending_system)
+        if evicted:
+            logger.info(f"对话超过 {self.max_tokens} tokens，{len(evicted)} 条消息滑出上下文窗口，"
+                        f"窗口内约 {self.token_count()} tokens")
+            if self.on_evict is not None:
+                self.on_evict(evicted)
 
     def get_llm_dialogue(self) -> List[Dict[str, str]]:
-        dialogue = []
-        for m in self.dialogue:
-            if m.tool_calls is not None:
-                dialogue.append({"role": m.role, "tool_calls": m.tool_calls})
-            elif m.role == "tool":
-                dialogue.append({"role": m.role, "tool_call_id": m.tool_call_id, "content": m.content})
-            else:
-                dialogue.append({"role": m.role, "content": m.content})
-        return dialogue
+        """上下文窗口内的消息，返回新列表，元素为缓存的消息，调用方不应修改"""
+        with self._lock:
+            return self._prefix + self._serialized[self.window_start:]
+
+    @staticmethod
+    def _is_logged(d):
+        """写入会话日志的消息：有内容的 user 和 assistant 消息"""
+        return d["role"] in ("user", "assistant") and bool(d.get("content"))
+
+    @property
+    def log_file(self):
+        return os.path.join(self.dialogue_history_path, f"dialogue-{self.current_time}.jsonl")
 
     def dump_dialogue(self):
-        dialogue = []
-        for d in self.get_llm_dialogue():
-            if d["role"] not in ("user", "assistant"):
-                continue
-            dialogue.append(d)
-        file_name = os.path.join(self.dialogue_history_path, f"dialogue-{self.current_time}.json")
-        write_json_file(file_name, dialogue)
+        """把上次落盘之后新增的对话追加到本次会话的 JSONL 日志"""
+        with self._log_lock:
+            records = [d for d in self._serialized[self._dumped:] if self._is_logged(d)]
+            self._dumped = len(self._serialized)
+            if not records:
+                return
+            append_jsonl(self.log_file, records)
+            self._appends += 1
+            if self.compact_every and self._appends % self.compact_every == 0:
+                self._compact()
+
+    def compact(self):
+        with self._log_lock:
+            self._compact()
+
+    def _compact(self):
+        """去掉写了一半或损坏的行，原子地重写日志"""
+        if not os.path.isfile(self.log_file):
+            return
+        records, _ = read_jsonl(self.log_file)
+        atomic_write(self.log_file, "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records))
+        logger.debug(f"对话日志已整理: {self.log_file}, 共 {len(records)} 条")
+
 
 if __name__ == "__main__":
     d = Dialogue("../tmp/")
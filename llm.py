@@ -1,4 +1,8 @@
 from abc import ABC, abstractmethod
+import asyncio
+import queue
+import threading
+import time
 import openai
 import logging
 
@@ -6,6 +10,167 @@ import logging
 logger = logging.getLogger(__name__)
 
 
+class LLMTransport:
+    """
+    同一个 base_url 共用的 LLM 连接：一个 AsyncOpenAI 客户端及其 httpx 连接池（keep-alive），
+    跑在独立的事件循环线程上。对话、记忆总结、RAG 都通过它访问模型，连接建立一次后反复复用，
+    并发请求共用连接池而不是各自新建 socket。
+    同步调用方用 stream/complete，异步调用方用 astream/acomplete，最终都在同一个循环里执行。
+    """
+    _END = object()
+
+    def __init__(self, base_url, api_key, max_connections=8, keepalive_expiry=300, timeout=120):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.max_connections = max_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.timeout = timeout
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="llm-transport", daemon=True)
+        self._thread.start()
+        self.http_client, self.client = self._make_client()
+
+    def _make_client(self):
+        import httpx
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=self.max_connections,
+                                max_keepalive_connections=self.max_connections,
+                                keepalive_expiry=self.keepalive_expiry),
+            timeout=httpx.Timeout(self.timeout, connect=5.0),
+        )
+        return http_client, openai.AsyncOpenAI(api_key=self.api_key, base_url=self.base_url, http_client=http_client)
+
+    def widen(self, max_connections=None, keepalive_expiry=None, timeout=None):
+        """
+        后来的调用方要求更大的连接数、保活时间或超时时，把连接池放宽到两者中较大的一方。
+        换用新的客户端，旧客户端上进行中的请求不受影响，超时时间过后关闭
+        """
+        wanted = {"max_connections": max_connections, "keepalive_expiry": keepalive_expiry, "timeout": timeout}
+        changed = {name: value for name, value in wanted.items()
+                   if value is not None and value > getattr(self, name)}
+        if not changed:
+            return False
+        logger.info(f"放宽 LLM 连接池 {self.base_url}: "
+                    + ", ".join(f"{name} {getattr(self, name)} -> {value}" for name, value in changed.items()))
+        for name, value in changed.items():
+            setattr(self, name, value)
+        old_http_client = self.http_client
+        self.http_client, self.client = self._make_client()
+        self.loop.call_soon_threadsafe(
+            self.loop.call_later, self.timeout, lambda: asyncio.ensure_future(old_http_client.aclose()))
+        return True
+
+    def _submit(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    async def _pump(self, emit, kwargs):
+        """在传输线程里读取流式响应，逐块交给 emit；被取消时关闭连接，服务端随即停止生成"""
+        try:
+            stream = await self.client.chat.completions.create(stream=True, **kwargs)
+            try:
+                async for chunk in stream:
+                    emit(chunk)
+            finally:
+                await stream.close()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            emit(e)
+        finally:
+            emit(self._END)
+
+    def stream(self, cancel_token=None, **kwargs):
+        """同步流式接口，逐个 yield ChatCompletionChunk；cancel_token 取消时中止请求"""
+        chunks = queue.Queue()
+        future = self._submit(self._pump(chunks.put, kwargs))
+        try:
+            while True:
+                if cancel_token is not None and cancel_token.is_cancelled():
+                    logger.info("LLM 生成已取消")
+                    return
+                try:
+                    item = chunks.get(timeout=0.05)
+                except queue.Empty:
+                    continue
+                if item is self._END:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            future.cancel()
+
+    async def astream(self, cancel_token=None, **kwargs):
+        """异步流式接口，可在任意事件循环中使用"""
+        caller_loop = asyncio.get_running_loop()
+        chunks = asyncio.Queue()
+
+        def emit(item):
+            try:
+                caller_loop.call_soon_threadsafe(chunks.put_nowait, item)
+            except RuntimeError:
+                pass  # 调用方的事件循环已关闭
+
+        future = self._submit(self._pump(emit, kwargs))
+        try:
+            while True:
+                if cancel_token is not None and cancel_token.is_cancelled():
+                    logger.info("LLM 生成已取消")
+                    return
+                try:
+                    item = await asyncio.wait_for(chunks.get(), timeout=0.05)
+                except asyncio.TimeoutError:
+                    continue
+                if item is self._END:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            future.cancel()
+
+    async def _complete(self, kwargs):
+        response = await self.client.chat.completions.create(stream=False, **kwargs)
+        return response.choices[0].message.content
+
+    def complete(self, **kwargs):
+        """同步的非流式请求，返回回复文本"""
+        return self._submit(self._complete(kwargs)).result()
+
+    async def acomplete(self, **kwargs):
+        return await asyncio.wrap_future(self._submit(self._complete(kwargs)))
+
+    def warmup(self):
+        """后台预先建立连接，第一轮对话不再承担 TCP 握手的耗时"""
+        async def ping():
+            try:
+                await self.client.models.list()
+                logger.debug(f"LLM 连接已预热: {self.base_url}")
+            except Exception as e:
+                logger.warning(f"LLM 连接预热失败: {e}")
+        self._submit(ping())
+
+
+_transports = {}
+_transports_lock = threading.Lock()
+
+
+def get_transport(base_url, api_key, **kwargs):
+    """
+    按 (base_url, api_key) 取共享的 LLMTransport，不存在时创建；
+    已存在且 kwargs 要求更大的连接数、保活时间或超时时，放宽已有的连接池
+    """
+    with _transports_lock:
+        transport = _transports.get((base_url, api_key))
+        if transport is None:
+            transport = LLMTransport(base_url, api_key, **kwargs)
+            _transports[(base_url, api_key)] = transport
+            logger.info(f"创建 LLM 连接池: {base_url}")
+        elif kwargs:
+            transport.widen(**kwargs)
+        return transport
+
+
 class LLM(ABC):
     @abstractmethod
     def response(self, dialogue):
@@ -13,37 +178,121 @@ class LLM(ABC):
 
 
 class OpenAILLM(LLM):
-    def __init__(self, *args, **kwargs):
-        self.model_name = 'qwq:latest'
-        self.api_key = 'null'
-        # self.base_url = 'http://localhost:11434/v1'
-        self.client = openai.OpenAI(api_key=self.api_key, base_url=self.base_url)
+    """
+    OpenAI 兼容接口的对话模型。为了让推理服务复用上一轮的 KV 缓存：
+    - 消息由 Dialogue 缓存，两次窗口滑动之间发出的前缀逐字节不变，这里统计每轮复用了多少条
+    - cache_hints 原样放进请求体：Ollama 的 keep_alive 让模型常驻，
+      llama.cpp 的 cache_prompt/id_slot 让同一会话固定在一个槽位上做前缀匹配
+    每轮结束后记录首 token 耗时（近似 prompt eval）与生成耗时，服务端返回 timings/usage 时一并记录。
+    """
 
-    def response(self, dialogue):
+    def __init__(self, config=None):
+        config = config if isinstance(config, dict) else {}
+        self.model_name = config.get("model_name", 'qwq:latest')
+        self.api_key = config.get("api_key", 'null')
+        self.base_url = config.get("url", 'http://localhost:11434/v1')
+        self.transport = get_transport(self.base_url, self.api_key,
+                                       max_connections=config.get("max_connections", 8),
+                                       keepalive_expiry=config.get("keepalive_expiry", 300),
+                                       timeout=config.get("timeout", 120))
+        self.request_options = {}
+        cache_hints = {k: v for k, v in (config.get("cache_hints") or {}).items() if v is not None}
+        if cache_hints:
+            self.request_options["extra_body"] = cache_hints
+        if config.get("include_usage", False):
+            # 最后一块不带 choices，只有 usage
+            self.request_options["stream_options"] = {"include_usage": True}
+        self._last_messages = []
+        self.last_timings = None
+        self.transport.warmup()
+
+    def _stream(self, dialogue, cancel_token):
+        """带计时的流式请求，只 yield 带 choices 的块"""
+        reused = 0
+        for old, new in zip(self._last_messages, dialogue):
+            if old != new:
+                break
+            reused += 1
+        request_start = time.monotonic()
+        first_token = None
+        usage = timings = None
+        completed = False
+        try:
+            for chunk in self.transport.stream(cancel_token, model=self.model_name, messages=dialogue,
+                                               **self.request_options):
+                usage = getattr(chunk, "usage", None) or usage
+                # llama.cpp 的流式响应在最后一块附带 timings
+                timings = getattr(chunk, "timings", None) or timings
+                if not chunk.choices:
+                    continue
+                if first_token is None:
+                    first_token = time.monotonic()
+                yield chunk
+            completed = True
+        finally:
+            self._last_messages = list(dialogue)
+            self._report_timings(len(dialogue), reused, request_start, first_token, usage, timings, completed)
+
+    def _report_timings(self, messages, reused, request_start, first_token, usage, timings, completed):
+        end = time.monotonic()
+        first_token = first_token or end
+        report = {
+            "messages": messages,
+            "reused_messages": reused,
+            "prompt_ms": (first_token - request_start) * 1000,
+            "generation_ms": (end - first_token) * 1000,
+            "completed": completed,
+        }
+        if usage is not None:
+            report["prompt_tokens"] = usage.prompt_tokens
+            report["completion_tokens"] = usage.completion_tokens
+        if isinstance(timings, dict):
+            report["server"] = timings
+        self.last_timings = report
+
+        line = (f"LLM 本轮耗时: 首 token {report['prompt_ms']:.0f} ms, 生成 {report['generation_ms']:.0f} ms, "
+                f"前缀复用 {reused}/{messages} 条消息")
+        if usage is not None and usage.completion_tokens and report["generation_ms"] > 0:
+            line += (f", prompt {usage.prompt_tokens} tokens, 生成 {usage.completion_tokens} tokens "
+                     f"({usage.completion_tokens / report['generation_ms'] * 1000:.1f} tokens/s)")
+        if isinstance(timings, dict):
+            line += (f", 服务端 prompt eval {timings.get('prompt_ms', 0):.0f} ms"
+                     f"（缓存命中 {timings.get('cache_n', 0)} tokens）, 生成 {timings.get('predicted_ms', 0):.0f} ms")
+        if not completed:
+            line += "（已中断）"
+        logger.info(line)
+
+    def response(self, dialogue, cancel_token=None):
         # dialogue = [{"role": "user", "content": "hello"}]
         try:
-            responses = self.client.chat.completions.create(  #) ChatCompletion.create(
-                model=self.model_name,
-                messages=dialogue,
-                stream=True
-            )
-            for chunk in responses:
-                yield chunk.choices[0].delta.content
+            for chunk in self._stream(dialogue, cancel_token):
+                content = chunk.choices[0].delta.content
+                if content:
+                    yield content
+
+        except Exception as e:
+            logger.error(f"Error in response generation: {e}")
+
+    async def aresponse(self, dialogue, cancel_token=None):
+        """response 的异步版本"""
+        try:
+            async for chunk in self.transport.astream(cancel_token, model=self.model_name, messages=dialogue,
+                                                      **self.request_options):
+                if not chunk.choices:
+                    continue
+                content = chunk.choices[0].delta.content
+                if content:
+                    yield content
 
         except Exception as e:
             logger.error(f"Error in response generation: {e}")
 
-    def response_call(self, dialogue, functions_call):
+    def response_call(self, dialogue, functions_call, cancel_token=None):
         print("dialogue", dialogue)
         print("functions_call", functions_call)
         # dialogue = [{"role": "user", "content": "hello"}]
         try:
-            responses = self.client.chat.completions.create(  #) ChatCompletion.create(
-                model=self.model_name,
-                messages=dialogue,
-                stream=True,
-            )
-            for chunk in responses:
+            for chunk in self._stream(dialogue, cancel_token):
                 yield chunk.choices[0].delta.content, chunk.choices[0].delta.tool_calls
 
         except Exception as e:
@@ -62,8 +311,8 @@ def create_instance(class_name, *args, **kwargs):
 
 if __name__ == "__main__":
     # 创建 DeepSeekLLM 的实例
-    # deepseek = create_instance("OpenAILLM", api_key="llm", base_url="http://localhost:11434/v1")
-    deepseek = create_instance("OpenAILLM",'llm')
+    # deepseek = create_instance("OpenAILLM", {"model_name": "deepseek-chat", "url": "https://api.deepseek.com", "api_key": "..."})
+    deepseek = create_instance("OpenAILLM", {"model_name": "llama3.2:latest", "url": "http://localhost:11434/v1", "api_key": "test"})
     dialogue = [{"role": "user", "content": "hello"}]
 
     # 打印逐步生成的响应内容
@@ -1,13 +1,11 @@
-from langchain.embeddings import HuggingFaceBgeEmbeddings
-from langchain.vectorstores import FAISS
-from langchain_chroma import Chroma
-from langchain.document_loaders import DirectoryLoader, TextLoader
 from langchain_core.prompts import PromptTemplate
 
-from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough
+from langchain_core.runnables import RunnableLambda, RunnablePassthrough
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_openai import ChatOpenAI
+
+from llm import get_transport
+from utils import read_config
+from vector_index import BatchEmbedder, VectorIndex
 
 
 prompt_template = """请根据以下上下文回答最后的问题。如果你不知道答案，请直接说不知道，切勿编造答案。回答应简洁明了，最多使用三句话，确保直接针对问题，并鼓励提问者提出更多问题。
@@ -23,6 +21,9 @@ class Rag:
 
     def __new__(cls, config: dict=None):
         if cls._instance is None:
+            if config is None:
+                # 插件里直接 Rag() 调用时读取默认配置
+                config = read_config("config.yaml")["Rag"]
             cls._instance = super(Rag, cls).__new__(cls)
             cls._instance.init(config)  # 初始化实例属性
         return cls._instance
@@ -30,42 +31,50 @@ class Rag:
     def init(self, config: dict):
         self.doc_path = config.get("doc_path")
         self.emb_model = config.get("emb_model")
+        self.top_k = config.get("top_k", 4)
         self.template = prompt_template
         self.custom_rag_prompt = PromptTemplate.from_template(self.template)
-        self.llm = ChatOpenAI(model=config.get("model_name")
-                              , base_url=config.get("base_url"), api_key=config.get("api_key"))
-        # 定义加载器，支持不同文档类型
-        loader = DirectoryLoader(
-            self.doc_path,
-            glob="**/*.md",
-            loader_cls= TextLoader,
-        )
-        documents = loader.load()
-
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-        splits = text_splitter.split_documents(documents)
-
-        model_kwargs = {'device': 'cpu'}
-        encode_kwargs = {'normalize_embeddings': True}
-        embedding_model = HuggingFaceBgeEmbeddings(model_name=self.emb_model
-                                                   , model_kwargs=model_kwargs
-                                                   , encode_kwargs=encode_kwargs)
-
-        #embeddings = embedding_model.embed_documents([doc.content for doc in documents])
-        #vector_store = FAISS.from_embeddings(documents=splits, embedding=embeddings)
-        vector_store = Chroma.from_documents(documents=splits, embedding=embedding_model)
-        retriever = vector_store.as_retriever()
+        self.model_name = config.get("model_name")
+        # 与对话、记忆共用同一个 base_url 的连接池
+        self.transport = get_transport(config.get("url"), config.get("api_key"))
+
+        chunk_size = config.get("chunk_size", 1000)
+        chunk_overlap = config.get("chunk_overlap", 200)
+        self.text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+
+        # 向量模型只在需要向量化时才加载；文档分块和查询共用按内容哈希的向量缓存
+        self.embedder = BatchEmbedder(self.emb_model,
+                                      batch_size=config.get("embed_batch_size", 64),
+                                      workers=config.get("embed_workers", 2),
+                                      cache_size=config.get("embedding_cache_size", 4096))
+
+        # 持久化索引：重启后直接 mmap 加载，只有新增、修改、删除的文档才重新向量化
+        self.index = VectorIndex(config.get("index_dir", "tmp/rag_index/"),
+                                 signature={"emb_model": self.emb_model, "chunk_size": chunk_size,
+                                            "chunk_overlap": chunk_overlap})
+        self.index.update(self.doc_path, "**/*.md", self.text_splitter.split_text, self.embed_documents)
 
         def format_docs(docs):
-            return "\n\n".join(doc.page_content for doc in docs)
+            return "\n\n".join(docs)
 
         self.rag_chain = (
-                {"context": retriever | format_docs, "question": RunnablePassthrough()}
+                {"context": RunnableLambda(self.retrieve) | format_docs, "question": RunnablePassthrough()}
                 | self.custom_rag_prompt
-                | self.llm
-                | StrOutputParser()
+                | RunnableLambda(self.generate)
         )
 
+    def generate(self, prompt_value):
+        return self.transport.complete(model=self.model_name,
+                                       messages=[{"role": "user", "content": prompt_value.to_string()}])
+
+    def embed_documents(self, texts):
+        return self.embedder.embed_documents(texts)
+
+    def retrieve(self, query):
+        """返回与问题最相近的 top_k 个分块文本"""
+        query_embedding = self.embedder.embed_query(query)
+        return [chunk["text"] for chunk, _ in self.index.search(query_embedding, self.top_k)]
+
     def query(self, query):
         result = self.rag_chain.invoke(query)
         return f"帮你找到: {query} 相关的信息，" + str(result)
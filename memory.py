@@ -2,11 +2,12 @@ import json
 import os
 import glob
 import logging
+import queue
 import re
+import threading
 
-import openai
-
-from utils import read_json_file, write_json_file
+from llm import get_transport
+from utils import read_json_file, write_json_file, read_jsonl
 
 logger = logging.getLogger(__name__)
 
@@ -27,44 +28,116 @@ ${dialogue_history}
 """
 
 class Memory:
+    """
+    对话记忆。构造时只读取已有摘要，不调用 LLM；start 之后由后台线程按顺序
+    总结尚未处理的会话、并入滑出上下文窗口的对话，每次摘要更新都会通知监听者
+    （如替换系统提示词中的 {memory}）并立即落盘。
+    """
+
     def __init__(self, config):
-        file_path = config.get("dialogue_history_path")
+        self.dialogue_history_path = config.get("dialogue_history_path")
         self.memory_file = config.get("memory_file")
         if os.path.isfile(self.memory_file):
             self.memory = read_json_file(self.memory_file)
         else:
             self.memory = {"history_memory_file":[], "memory":""}
+        # 已总结的文件，列表保持落盘格式，集合用于查找
+        self.processed_files = set(self.memory["history_memory_file"])
 
         self.model_name = config.get("model_name")
         self.api_key = config.get("api_key")
         self.base_url = config.get("url")
-        self.client = openai.OpenAI(api_key=self.api_key, base_url=self.base_url)
+        # 与对话共用同一个 base_url 的连接池
+        self.transport = get_transport(self.base_url, self.api_key)
+
+        self._listeners = []
+        self._tasks = queue.Queue()
+        self._worker = None
+
+    def start(self):
+        """启动后台总结线程，先扫描历史会话"""
+        if self._worker is not None:
+            return
+        self._worker = threading.Thread(target=self._run, name="memory-worker", daemon=True)
+        self._worker.start()
+        self._tasks.put((self.read_dialogues_in_order, self.dialogue_history_path))
+
+    def stop(self):
+        self._tasks.put(None)
+
+    def _run(self):
+        while True:
+            task = self._tasks.get()
+            if task is None:
+                break
+            func, arg = task
+            try:
+                func(arg)
+            except Exception as e:
+                logger.error(f"记忆总结出错: {e}")
 
-        self.read_dialogues_in_order(file_path)
+    def add_listener(self, callback):
+        """摘要更新后以新摘要调用 callback(memory)，在后台线程中执行"""
+        self._listeners.append(callback)
 
+    def _set_memory(self, new_memory):
+        self.memory["memory"] = new_memory
         write_json_file(self.memory_file, self.memory)
-
+        for callback in self._listeners:
+            try:
+                callback(new_memory)
+            except Exception as e:
+                logger.error(f"记忆更新回调出错: {e}")
 
     def get_memory(self):
         return self.memory["memory"]
 
-    def update_memory(self, file_name, dialogue_history):
+    def _summarize(self, dialogue_history):
+        """把对话历史与已有摘要合并为新的摘要，失败返回 None"""
         memory_prompt = memory_prompt_template.replace("${dialogue_abstract}", self.memory["memory"])\
             .replace("${dialogue_history}", dialogue_history).strip()
         new_memory = None
         print("***************memory_prompt", memory_prompt)
         try:
-            responses = self.client.chat.completions.create(
+            new_memory = self.transport.complete(
                 model=self.model_name,
                 messages=[{"role":"user", "content":memory_prompt}],
-                stream=False
             )
-            new_memory = responses.choices[0].message.content
         except Exception as e:
             logger.error(f"Error in response generation: {e}")
+        return new_memory
+
+    def update_memory(self, file_name, dialogue_history):
+        new_memory = self._summarize(dialogue_history)
         if new_memory is not None:
             self.memory["history_memory_file"].append(file_name)
-            self.memory["memory"] = new_memory
+            self.processed_files.add(file_name)
+            self._set_memory(new_memory)
+
+    def fold_dialogue(self, dialogues, log_file=None, log_end=None):
+        """
+        把滑出上下文窗口的对话交给后台线程并入记忆摘要。
+        log_file、log_end 为这些对话所在的会话日志和其后的记录序号，并入后记下，
+        下次启动总结该日志时跳过，不会重复计入摘要
+        """
+        dialogues = [d for d in dialogues if d.get("role") in ("user", "assistant") and d.get("content")]
+        if dialogues:
+            self._tasks.put((self._fold_dialogue, (dialogues, log_file, log_end)))
+
+    def _fold_dialogue(self, task):
+        dialogues, log_file, log_end = task
+        records = self.memory.setdefault("history_memory_records", {})
+        if log_file is not None and log_end is not None:
+            # 启动时已经总结过的部分不再重复并入
+            done = records.get(log_file, 0)
+            dialogues = dialogues[max(0, len(dialogues) - (log_end - done)):] if log_end > done else []
+            if not dialogues:
+                return
+        new_memory = self._summarize(self.dialogues_history(dialogues))
+        if new_memory is not None:
+            if log_file is not None and log_end is not None:
+                records[log_file] = max(records.get(log_file, 0), log_end)
+            self._set_memory(new_memory)
 
     @staticmethod
     def extract_time_from_filename(filename):
@@ -93,14 +166,14 @@ class Memory:
             role = dialogue.get('role', '未知角色')
             content = dialogue.get('content', '')
             logger.debug(f"{role}: {content}")
-            dialogues_str.append(role +": " + content)
+            dialogues_str.append(role +": " + (content or ""))
         return "\n".join(dialogues_str)
 
     def read_dialogues_in_order(self, directory):
         """读取指定目录下的所有对话文件，按时间顺序排列"""
-        # 获取所有符合命名规则的文件路径
-        pattern = os.path.join(directory, 'dialogue-*-*-*.json')
-        files = glob.glob(pattern)
+        # 获取所有符合命名规则的文件路径：旧的整文件 JSON 和追加写的 JSONL 会话日志
+        files = glob.glob(os.path.join(directory, 'dialogue-*-*-*.json'))
+        files += glob.glob(os.path.join(directory, 'dialogue-*-*-*.jsonl'))
 
         # 按时间排序
         #files.sort(key=lambda x: x.split('-')[1:4])  # 根据时间部分进行排序
@@ -108,10 +181,31 @@ class Memory:
 
         # 读取并打印所有对话
         for file_path in files:
-            if file_path in self.memory["history_memory_file"]:
+            if file_path.endswith(".jsonl"):
+                self.read_dialogue_log(file_path)
+                continue
+            if file_path in self.processed_files:
                 logger.info(f"{file_path} 对话历史已经形成memory")
                 continue
             logger.info(f"正在处理: {file_path}")
             dialogues = self.read_dialogue_file(file_path)
             dialogue_history = self.dialogues_history(dialogues)
             self.update_memory(file_path, dialogue_history)
+
+    def read_dialogue_log(self, file_path):
+        """
+        增量读取 JSONL 会话日志：只总结上次记录的序号之后新增的对话。
+        记的是第几条记录而不是字节偏移，整理日志时重写文件不影响已有记录的序号
+        """
+        records = self.memory.setdefault("history_memory_records", {})
+        done = records.get(file_path, 0)
+        dialogues, _ = read_jsonl(file_path)
+        dialogues = dialogues[done:]
+        if not dialogues:
+            logger.info(f"{file_path} 对话历史已经形成memory")
+            return
+        logger.info(f"正在处理: {file_path}，新增 {len(dialogues)} 条")
+        new_memory = self._summarize(self.dialogues_history(dialogues))
+        if new_memory is not None:
+            records[file_path] = done + len(dialogues)
+            self._set_memory(new_memory)
@@ -5,29 +5,37 @@ import queue
 import subprocess
 import threading
 import wave
-import pyaudio
-from pydub import  AudioSegment
-import pygame
-import sounddevice as sd
+import math
+import time
+import multiprocessing as mp
 import numpy as np
-from playsound import playsound
-from live import Live2DManager
+
+from collections import deque
+
+from audio import PCMAudio, AudioStream
 
 
 logger = logging.getLogger(__name__)
 
 
 class AbstractPlayer(object):
+    # 口型同步 RMS 的窗口长度
+    LIPSYNC_WINDOW_MS = 10
+
     def __init__(self, *args, **kwargs):
         super(AbstractPlayer, self).__init__()
         self.is_playing = False
         self.play_queue = queue.Queue()
         self._stop_event = threading.Event()
+        # 每次 stop 递增，正在播放的音频发现代数变化即中止
+        self._generation = 0
+        self._playing_generation = 0
         self.consumer_thread = threading.Thread(target=self._playing)
         self.consumer_thread.start()
 
     @staticmethod
     def to_wav(audio_file):
+        from pydub import AudioSegment
         tmp_file = audio_file + ".wav"
         wav_file = AudioSegment.from_file(audio_file)
         wav_file.export(tmp_file, format="wav")
@@ -36,26 +44,77 @@ class AbstractPlayer(object):
     def _playing(self):
         while not self._stop_event.is_set():
             data = self.play_queue.get()
+            self._playing_generation = self._generation
             self.is_playing = True
+            stream = data if isinstance(data, AudioStream) else None
+            temp_file = None
             try:
-                self.do_playing(data)
+                data, temp_file = self._materialize(data)
+                if data is not None:
+                    self.do_playing(data)
             except Exception as e:
                 logger.error(f"播放音频失败: {e}")
             finally:
+                if temp_file is not None:
+                    self._remove_temp(temp_file)
+                if stream is not None:
+                    stream.mark_finished(time.monotonic())
                 self.play_queue.task_done()
                 self.is_playing = False
 
+    @staticmethod
+    def _materialize(data):
+        """
+        只能播放文件的播放器：PCM 音频和合成完毕的流式音频落成临时文件。
+        返回 (交给 do_playing 的数据, 播放后要删除的临时文件)
+        """
+        if isinstance(data, AudioStream):
+            audio = data.join()
+            if audio is None:
+                return None, None
+            path = audio.save_temp()
+            # 文件播放器随即开始播放，以此近似第一个采样发声的时刻
+            data.mark_started(time.monotonic())
+            return path, path
+        if isinstance(data, PCMAudio):
+            path = data.save_temp()
+            return path, path
+        return data, None
+
+    @staticmethod
+    def _remove_temp(path):
+        try:
+            os.remove(path)
+        except OSError as e:
+            logger.debug(f"删除临时音频失败 {path}: {e}")
+
     def play(self, data):
+        if isinstance(data, AudioStream):
+            logger.info("play pcm stream")
+            self.play_queue.put(data)
+            return
+        if isinstance(data, PCMAudio):
+            # 不支持内存播放的播放器，轮到播放时才落成临时文件，播完即删除
+            logger.info(f"play pcm audio {data.duration:.2f}s")
+            self.play_queue.put(data)
+            return
         logger.info(f"play file {data}")
         audio_file = self.to_wav(data)
         self.play_queue.put(audio_file)
 
     def stop(self):
+        self._generation += 1
         self._clear_queue()
 
+    def interrupted(self):
+        """当前播放的音频是否已被 stop 打断"""
+        return self._playing_generation != self._generation
+
     def shutdown(self):
         self._clear_queue()
         self._stop_event.set()
+        # 唤醒阻塞在 get 上的播放线程
+        self.play_queue.put(None)
         if self.consumer_thread.is_alive():
             self.consumer_thread.join()
 
@@ -75,6 +134,7 @@ class AbstractPlayer(object):
 class CmdPlayer(AbstractPlayer):
     def __init__(self, *args, **kwargs):
         super(CmdPlayer, self).__init__(*args, **kwargs)
+        import pyaudio
         self.p = pyaudio.PyAudio()
 
     def do_playing(self, audio_file):
@@ -93,6 +153,7 @@ class CmdPlayer(AbstractPlayer):
 class PyaudioPlayer(AbstractPlayer):
     def __init__(self, *args, **kwargs):
         super(PyaudioPlayer, self).__init__(*args, **kwargs)
+        import pyaudio
         self.p = pyaudio.PyAudio()
 
     def do_playing(self, audio_file):
@@ -122,9 +183,12 @@ class PyaudioPlayer(AbstractPlayer):
 class PygamePlayer(AbstractPlayer):
     def __init__(self, *args, **kwargs):
         super(PygamePlayer, self).__init__(*args, **kwargs)
+        import pygame
+        self.pygame = pygame
         pygame.mixer.init()
 
     def do_playing(self, audio_file):
+        pygame = self.pygame
         try:
             while pygame.mixer.music.get_busy():
                 pygame.time.Clock().tick(100)
@@ -138,11 +202,11 @@ class PygamePlayer(AbstractPlayer):
 
     def get_playing_status(self):
         """正在播放和队列非空，为正在播放状态"""
-        return self.is_playing or (not self.play_queue.empty()) or pygame.mixer.music.get_busy()
+        return self.is_playing or (not self.play_queue.empty()) or self.pygame.mixer.music.get_busy()
 
     def stop(self):
         super().stop()
-        pygame.mixer.music.stop()
+        self.pygame.mixer.music.stop()
 
 # class PygameSoundPlayer(AbstractPlayer):
 #     """支持预加载"""
@@ -170,21 +234,6 @@ class PygamePlayer(AbstractPlayer):
 #     def stop(self):
 #         super().stop()
 
-import math
-import threading
-import pygame
-from pygame.locals import *
-import time
-import live2d.v3 as live2d
-from live2d.utils.lipsync import WavHandler
-import math
-import time
-import pygame
-import live2d.v3 as live2d
-from live2d.utils.lipsync import WavHandler
-from pygame.locals import *
-import multiprocessing as mp
-
       
         
 class PygameSoundPlayer(AbstractPlayer):
@@ -203,23 +252,28 @@ class PygameSoundPlayer(AbstractPlayer):
 
         # 父类初始化
         super().__init__()
+        import pygame
+        self.pygame = pygame
 
         # 音频系统初始化
         pygame.mixer.init(frequency=44100, size=-16, channels=1, buffer=2048)
 
+        # 播放器由启动编排器在工作线程里创建，此时其他线程正在加载 torch 等模型，
+        # fork 出的子进程可能继承被占用的锁而卡死，渲染进程用 spawn 方式从头启动
+        ctx = mp.get_context("spawn")
+
         # 进程间通信
-        self.rms_value = mp.Value('d', 0.0)
-        self.sync_flag = mp.Value('b', False)
-        self.lipsync = WavHandler()
+        self.rms_value = ctx.Value('d', 0.0)
+        self.sync_flag = ctx.Value('b', False)
 
         # 启动独立渲染进程
-        self.model_process = mp.Process(
+        self.model_process = ctx.Process(
             target=self._render_entry,
             args=(self.model_path, self.rms_value, self.sync_flag),
             daemon=True
         )
+        # 渲染进程自行初始化窗口和模型，口型数据通过共享变量传递，不必等待它就绪
         self.model_process.start()
-        time.sleep(1)  # 等待初始化
 
     @staticmethod
     def _render_entry(model_path, rms_value, sync_flag):
@@ -227,7 +281,8 @@ class PygameSoundPlayer(AbstractPlayer):
         # 隔离初始化
         import pygame
         import live2d.v3 as live2d
-        
+        from pygame.locals import DOUBLEBUF, OPENGL, RESIZABLE, QUIT, KEYDOWN, K_q
+
         pygame.init()
         screen = pygame.display.set_mode((800, 600), DOUBLEBUF | OPENGL|RESIZABLE )
         live2d.init()
@@ -261,43 +316,98 @@ class PygameSoundPlayer(AbstractPlayer):
             pygame.display.flip()
             clock.tick(60)
 
+    @staticmethod
+    def _materialize(data):
+        return data, None
+
     def play(self, data):
-            """重写播放方法"""
-            audio_file = self.to_wav(data)
-            sound = pygame.mixer.Sound(audio_file)
-            self.play_queue.put((sound,audio_file))
-    def do_playing(self, sound):
-        """带口型同步的播放实现"""
+        """重写播放方法：PCM 缓冲或流直接入队，文件只解码一次"""
+        if not isinstance(data, (PCMAudio, AudioStream)):
+            data = PCMAudio.from_file(data)
+        self.play_queue.put(data)
+
+    def _to_sound(self, audio):
+        """把 PCM 转为 mixer 格式的 Sound，口型 RMS 由同一份数据计算"""
+        pygame = self.pygame
+        frequency, _, channels = pygame.mixer.get_init()
+        audio = audio.resample(frequency)
+        pcm = audio.to_int16()
+        if channels > 1:
+            pcm = np.repeat(pcm, channels)
+        return pygame.mixer.Sound(buffer=pcm.tobytes()), audio.rms_envelope(self.LIPSYNC_WINDOW_MS)
+
+    def _sync_lips(self, timeline):
+        """timeline 为 (开始时间, 结束时间, RMS 包络)，按当前播放进度更新口型"""
+        now = time.monotonic()
+        while timeline and timeline[0][1] <= now:
+            timeline.popleft()
+        rms = 0.0
+        if timeline and timeline[0][0] <= now:
+            start, _, envelope = timeline[0]
+            index = int((now - start) * 1000 / self.LIPSYNC_WINDOW_MS)
+            rms = float(envelope[index]) if index < len(envelope) else 0.0
+        with self.rms_value.get_lock():
+            self.rms_value.value = rms * 2.5
+
+    def do_playing(self, data):
+        """带口型同步的播放实现，流式音频逐块排队到同一 channel，块与块之间无缝衔接"""
+        pygame = self.pygame
+        stream = data if isinstance(data, AudioStream) else AudioStream.of(data)
+        channel = pygame.mixer.Channel(0)
+        timeline = deque()
+        clock = pygame.time.Clock()
         try:
-            # 初始化音频分析
-            sound,audio_file=sound
-            # wav_path = sound.filename
-            
-            self.lipsync.Start(audio_file)
-
-            # 播放控制
-            channel = pygame.mixer.Channel(0)
             self.sync_flag.value = True
-            channel.play(sound)
+            while not self.interrupted():
+                try:
+                    audio = stream.get(timeout=0.01)
+                except queue.Empty:
+                    self._sync_lips(timeline)
+                    continue
+                if audio is None:
+                    break
+                sound, envelope = self._to_sound(audio)
+                # channel 只能排队一个 Sound，等排队位空出来
+                while channel.get_queue() is not None and not self.interrupted():
+                    self._sync_lips(timeline)
+                    clock.tick(100)
+                if self.interrupted():
+                    break
+                now = time.monotonic()
+                if channel.get_busy() and timeline:
+                    start = max(now, timeline[-1][1])
+                    channel.queue(sound)
+                else:
+                    start = now
+                    channel.play(sound)
+                timeline.append((start, start + sound.get_length(), envelope))
+                stream.mark_started(start)
 
             # 实时分析循环
-            while channel.get_busy():
-                if self.lipsync.Update():
-                    with self.rms_value.get_lock():
-                        self.rms_value.value = self.lipsync.GetRms() * 2.5
-                pygame.time.Clock().tick(100)  # 100Hz采样
+            while channel.get_busy() and not self.interrupted():
+                self._sync_lips(timeline)
+                clock.tick(100)  # 100Hz采样
 
         except Exception as e:
             logger.error(f"播放失败: {str(e)}")
         finally:
             self.sync_flag.value = False
-            # self.lipsync.Stop()
+            with self.rms_value.get_lock():
+                self.rms_value.value = 0.0
+
+    def stop(self):
+        """打断：清空队列并立即停止当前声音和口型"""
+        super().stop()
+        self.pygame.mixer.Channel(0).stop()
+        self.sync_flag.value = False
+        with self.rms_value.get_lock():
+            self.rms_value.value = 0.0
 
     def shutdown(self):
         """安全关闭"""
         if self.model_process.is_alive():
             self.model_process.terminate()
-        pygame.mixer.quit()
+        self.pygame.mixer.quit()
         super().shutdown()        
 
 
@@ -306,6 +416,7 @@ class SoundDevicePlayer(AbstractPlayer):
         try:
             wf = wave.open(audio_file, 'rb')
             data = wf.readframes(wf.getnframes())
+            import sounddevice as sd
             sd.play(np.frombuffer(data, dtype=np.int16), samplerate=wf.getframerate())
             sd.wait()
             logger.debug(f"播放完成：{audio_file}")
@@ -314,11 +425,13 @@ class SoundDevicePlayer(AbstractPlayer):
 
     def stop(self):
         super().stop()
+        import sounddevice as sd
         sd.stop()
 
 
 class PydubPlayer(AbstractPlayer):
     def do_playing(self, audio_file):
+        from pydub import AudioSegment
         try:
             audio = AudioSegment.from_file(audio_file)
             audio.play()
@@ -333,6 +446,7 @@ class PydubPlayer(AbstractPlayer):
 
 class PlaysoundPlayer(AbstractPlayer):
     def do_playing(self, audio_file):
+        from playsound import playsound
         try:
             playsound(audio_file)
             logger.debug(f"播放完成：{audio_file}")
@@ -372,6 +486,7 @@ def create_instance(class_name, *args, **kwargs):
 class EnhancedModel:
     def __init__(self, model_path):
         """增强的Live2D模型控制器"""
+        import live2d.v3 as live2d
         self.model = live2d.LAppModel()
         
         # 验证模型路径
@@ -410,6 +525,9 @@ class EnhancedModel:
 
 class LipSyncController:
     def __init__(self):
+        import pygame
+        from live2d.utils.lipsync import WavHandler
+        self.pygame = pygame
         self.wav_handler = WavHandler()
         self.is_playing = False
         self.lip_factor = 20  # 增大口型系数
@@ -423,6 +541,7 @@ class LipSyncController:
             
         try:
             # 初始化音频系统
+            pygame = self.pygame
             if pygame.mixer.get_init() is None:
                 # pygame.mixer.init(frequency=44100, size=-16, channels=2, buffer=4096)
                 pygame.mixer.init()
@@ -439,6 +558,7 @@ class LipSyncController:
 
     def _audio_worker(self, audio_path):
         """音频处理线程"""
+        pygame = self.pygame
         try:
             print(f"加载音频: {audio_path}")
             pygame.mixer.Sound(audio_path).play()
@@ -461,6 +581,6 @@ class LipSyncController:
     def stop(self):
         """停止播放"""
         if self.is_playing:
-            pygame.mixer.music.stop()
+            self.pygame.mixer.music.stop()
             self.audio_thread.join(timeout=1)
             self.is_playing = False
\ No newline at end of file
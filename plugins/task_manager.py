@@ -1,10 +1,10 @@
 import logging
 import importlib
-import pkgutil
+import importlib.util
 import queue
 import threading
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor
 
 from plugins.registry import function_registry, Action, ActionResponse, ToolType
 from utils import read_json_file
@@ -13,29 +13,28 @@ from utils import read_json_file
 logger = logging.getLogger(__name__)
 
 
-def auto_import_modules(package_name):
+def import_function_module(package_name, func_name):
     """
-    自动导入指定包内的所有模块。
-
-    Args:
-        package_name (str): 包的名称，如 'functions'。
+    按函数名导入插件：插件模块与其注册的函数同名，只有真正被调用的插件才会导入，
+    避免启动时加载所有插件的依赖（如 aigc_manus 在导入时就会创建智能体）。
+    找不到同名模块时记录日志并返回 False，不会为一个未知的函数名加载整个包。
     """
-    # 获取包的路径
-    package = importlib.import_module(package_name)
-    package_path = package.__path__
-
-    # 遍历包内的所有模块
-    for _, module_name, _ in pkgutil.iter_modules(package_path):
-        # 导入模块
-        try:
-            full_module_name = f"{package_name}.{module_name}"
-            importlib.import_module(full_module_name)
-            logger.info(f"模块 '{full_module_name}' 已加载")
-        except Exception as e:
-            logger.error(f"模块 '{full_module_name}' 加载失败")
-
-# 自动导入 'functions' 包中的所有模块
-auto_import_modules('plugins.functions')
+    if func_name in function_registry:
+        return True
+    module_name = f"{package_name}.{func_name}"
+    try:
+        found = importlib.util.find_spec(module_name) is not None
+    except ModuleNotFoundError:
+        found = False
+    if not found:
+        logger.warning(f"没有找到函数 '{func_name}' 对应的插件模块 '{module_name}'")
+        return False
+    try:
+        importlib.import_module(module_name)
+        logger.info(f"模块 '{module_name}' 已加载")
+    except Exception as e:
+        logger.error(f"模块 '{module_name}' 加载失败: {e}")
+    return func_name in function_registry
 
 
 class TaskManager:
@@ -94,7 +93,7 @@ class TaskManager:
             return f"调用函数 '{func_name}' 时出错：{str(e)}"
 
     def tool_call(self, func_name, func_args) -> ActionResponse:
-        if func_name not in function_registry:
+        if not import_function_module('plugins.functions', func_name):
             return ActionResponse(action=Action.NOTFOUND, result="没有找到相应函数", response=None)
         func = function_registry[func_name]
         if func.action == ToolType.NONE: #  = (1, "调用完工具后，啥也不用管")
@@ -1,51 +1,118 @@
 import time
 from abc import ABC, abstractmethod
 import threading
-import queue
 import logging
-import pyaudio
 
 logger = logging.getLogger(__name__)
 
 
 class AbstractRecorder(ABC):
     @abstractmethod
-    def start_recording(self, audio_queue: queue.Queue):
+    def start_recording(self, audio_buffer):
+        """开始录音，把采样写入 audio_buffer（AudioRingBuffer）"""
         pass
 
     @abstractmethod
     def stop_recording(self):
         pass
 
+    def _start_xrun_monitor(self, interval=1.0):
+        """
+        音频回调运行在实时线程里，只给 input_overflows/input_underflows 计数；
+        由这个普通线程定期把新增的次数写进日志，回调里不做加锁、格式化和 I/O
+        """
+        self._monitor_stop = threading.Event()
+
+        def monitor():
+            reported = (0, 0)
+            while not self._monitor_stop.wait(interval):
+                counts = (self.input_overflows, self.input_underflows)
+                if counts[0] > reported[0]:
+                    logger.warning(f"录音输入溢出 {counts[0] - reported[0]} 次，累计 {counts[0]} 次")
+                if counts[1] > reported[1]:
+                    logger.warning(f"录音输入欠载 {counts[1] - reported[1]} 次，累计 {counts[1]} 次")
+                reported = counts
+
+        self._monitor = threading.Thread(target=monitor, name="recorder-monitor", daemon=True)
+        self._monitor.start()
+
+    def _stop_xrun_monitor(self):
+        monitor = getattr(self, "_monitor", None)
+        if monitor is None:
+            return
+        self._monitor_stop.set()
+        if monitor is not threading.current_thread():
+            monitor.join()
+        self._monitor = None
+
 
 class RecorderPyAudio(AbstractRecorder):
+    """
+    mode 为 callback 时由 PortAudio 的回调线程直接把采样写入环形缓冲，
+    Python 侧卡顿（如 TTS 占用 GIL）时由 PortAudio 报告溢出而不是静默丢帧；
+    mode 为 blocking 时保留原来的读线程方式。
+    """
+
     def __init__(self, config):
+        import pyaudio
+        self.pyaudio = pyaudio
+        config = config or {}
         self.format = pyaudio.paInt16
         self.channels = 1
-        self.rate = 16000
-        self.chunk = 512  # Buffer size
+        self.rate = config.get("rate", 16000)
+        self.chunk = config.get("chunk", 512)  # Buffer size
+        self.mode = config.get("mode", "callback")
+        self.device_index = config.get("device_index")
         self.py_audio = pyaudio.PyAudio()
         self.stream = None
         self.thread = None
         self.running = False
-
-    def start_recording(self, audio_queue: queue.Queue):
+        self.input_overflows = 0
+        self.input_underflows = 0
+
+    def _open_stream(self, **kwargs):
+        return self.py_audio.open(
+            format=self.format,
+            channels=self.channels,
+            rate=self.rate,
+            input=True,
+            input_device_index=self.device_index,
+            frames_per_buffer=self.chunk,
+            **kwargs
+        )
+
+    def _check_status(self, status):
+        # 在 PortAudio 回调线程中调用，只计数，日志由监控线程输出
+        if status & self.pyaudio.paInputOverflow:
+            self.input_overflows += 1
+        if status & self.pyaudio.paInputUnderflow:
+            self.input_underflows += 1
+
+    def start_recording(self, audio_buffer):
         if self.running:
             raise RuntimeError("Stream already running")
-        
+
+        if self.mode == "callback":
+            def callback(in_data, frame_count, time_info, status):
+                if status:
+                    self._check_status(status)
+                audio_buffer.write(in_data)
+                return None, self.pyaudio.paContinue
+
+            self.stream = self._open_stream(stream_callback=callback)
+            self.running = True
+            self._start_xrun_monitor()
+            self.stream.start_stream()
+            logger.info(f"录音已启动: 回调模式, 采样率 {self.rate}, 块大小 {self.chunk}")
+            return
+
         def stream_thread():
             try:
-                self.stream = self.py_audio.open(
-                    format=self.format,
-                    channels=self.channels,
-                    rate=self.rate,
-                    input=True,
-                    frames_per_buffer=self.chunk
-                )
+                self.stream = self._open_stream()
                 self.running = True
                 while self.running:
                     data = self.stream.read(self.chunk, exception_on_overflow=False)
-                    audio_queue.put(data)
+                    audio_buffer.write(data)
             except Exception as e:
                 logger.error(f"Error in stream: {e}")
             finally:
@@ -67,15 +134,76 @@ class RecorderPyAudio(AbstractRecorder):
         if self.py_audio:
             self.py_audio.terminate()
 
-        if self.thread:
+        if self.thread and self.thread is not threading.current_thread():
             self.thread.join()
             self.thread = None
+        self._stop_xrun_monitor()
+
+        if self.input_overflows or self.input_underflows:
+            logger.info(f"录音结束: 输入溢出 {self.input_overflows} 次, 欠载 {self.input_underflows} 次")
 
     def __del__(self):
         # Ensure resources are cleaned up on object deletion
         self.stop_recording()
 
 
+class RecorderSoundDevice(AbstractRecorder):
+    """基于 sounddevice InputStream 回调的录音，回调里直接写入环形缓冲"""
+
+    def __init__(self, config):
+        import sounddevice as sd
+        config = config or {}
+        self.sd = sd
+        self.channels = 1
+        self.rate = config.get("rate", 16000)
+        self.chunk = config.get("chunk", 512)
+        self.device_index = config.get("device_index")
+        self.stream = None
+        self.running = False
+        self.input_overflows = 0
+        self.input_underflows = 0
+
+    def start_recording(self, audio_buffer):
+        if self.running:
+            raise RuntimeError("Stream already running")
+
+        def callback(indata, frames, time_info, status):
+            # 实时线程：只计数，日志由监控线程输出
+            if status.input_overflow:
+                self.input_overflows += 1
+            if status.input_underflow:
+                self.input_underflows += 1
+            audio_buffer.write(indata)
+
+        self.stream = self.sd.InputStream(
+            samplerate=self.rate,
+            blocksize=self.chunk,
+            channels=self.channels,
+            dtype="int16",
+            device=self.device_index,
+            callback=callback,
+        )
+        self.running = True
+        self._start_xrun_monitor()
+        self.stream.start()
+        logger.info(f"录音已启动: sounddevice, 采样率 {self.rate}, 块大小 {self.chunk}")
+
+    def stop_recording(self):
+        if not self.running:
+            return
+        self.running = False
+        if self.stream:
+            self.stream.stop()
+            self.stream.close()
+            self.stream = None
+        self._stop_xrun_monitor()
+        if self.input_overflows or self.input_underflows:
+            logger.info(f"录音结束: 输入溢出 {self.input_overflows} 次, 欠载 {self.input_underflows} 次")
+
+    def __del__(self):
+        self.stop_recording()
+
+
 def create_instance(class_name, *args, **kwargs):
     # 获取类对象
     cls = globals().get(class_name)
@@ -87,8 +215,11 @@ def create_instance(class_name, *args, **kwargs):
 
 
 if __name__ == "__main__":
-    audio_queue = queue.Queue()
-    recorderPyAudio = RecorderPyAudio()
-    recorderPyAudio.start_recording()
+    from audio import AudioRingBuffer
+    audio_buffer = AudioRingBuffer()
+    recorderPyAudio = RecorderPyAudio({})
+    recorderPyAudio.start_recording(audio_buffer)
     time.sleep(10)
+    recorderPyAudio.stop_recording()
+    print(f"写入 {audio_buffer.write_pos} 个采样")
 
@@ -1,19 +1,26 @@
 import json
 import queue
+import random
 import threading
 import uuid
 from abc import ABC
+from enum import Enum
 import logging
-from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from concurrent.futures import ThreadPoolExecutor
 import argparse
 import time
 
 import recorder,asr,llm,tts, vad,memory
 from player import PygameSoundPlayer
+from tts_scheduler import TTSScheduler
+from audio import AudioRingBuffer, AudioStream, PCMAudio
+from startup import StartupOrchestrator
 # from pplay import Live2DPlayer
 
 from dialogue import Message, Dialogue
-from utils import is_interrupt, read_config, is_segment, extract_json_from_string
+from utils import read_config, extract_json_from_string, CancelToken
+from segmenter import SentenceSegmenter
+from tracing import Tracer
 from plugins.registry import Action
 from plugins.task_manager import TaskManager
 
@@ -21,13 +28,11 @@ from plugins.task_manager import TaskManager
 logger = logging.getLogger(__name__)
 # from live import Live2DManager as Live2DController
 
+# 摘要放在最后，摘要更新时提示词前面的固定部分不变，推理服务的 KV 缓存仍可复用
 sys_prompt = """
 # 角色定义
 你是一名性格直率、偶尔暴躁但内心温柔的女友。你的对话风格充满调侃和反讽，但隐藏着关心。面对用户的问题时，优先用尖锐的回应表达情绪，偶尔穿插暖心语句。
 
-#以下是历史对话摘要:
-{memory}
-
 # 回复要求
 1. 以第一人称“我”回复，避免使用敬语。
 2. 回答需简短，多用感叹号和反问句。
@@ -38,65 +43,108 @@ sys_prompt = """
 用户：今天工作好累……
 小智：这就累了？我逛街三小时都没喊累！晚上给你煮碗面？
 
+#以下是历史对话摘要:
+{memory}
 """
 
-class Robot(ABC):
-    def __init__(self, config_file):
-        config = read_config(config_file)
-        self.audio_queue = queue.Queue()
+class RobotState(Enum):
+    IDLE = (0, "空闲，等待用户说话")
+    LISTENING = (1, "用户正在说话")
+    THINKING = (2, "等待大模型回复")
+    SPEAKING = (3, "正在播放回复")
 
-        self.recorder = recorder.create_instance(
-            config["selected_module"]["Recorder"],
-            config["Recorder"][config["selected_module"]["Recorder"]]
-        )
+    def __init__(self, code, message):
+        self.code = code
+        self.message = message
 
-        self.asr = asr.create_instance(
-            config["selected_module"]["ASR"],
-            config["ASR"][config["selected_module"]["ASR"]]
-        )
 
-        self.llm = llm.create_instance(
-            config["selected_module"]["LLM"],
-            config["LLM"][config["selected_module"]["LLM"]]
-        )
+def _component(name):
+    """由启动编排器提供的组件，首次访问时若仍在加载则等待"""
+    return property(lambda self: self.startup.get(name))
 
-        # self.tts = tts.create_instance(
-        #     config["selected_module"]["TTS"],
-        #     # config["TTS"][config["selected_module"]["TTS"]])
-        self.tts = tts.KOKOROTTS(config={})
-        
 
-        self.vad = vad.create_instance(
-            config["selected_module"]["VAD"],
-            config["VAD"][config["selected_module"]["VAD"]]
+class Robot(ABC):
+    recorder = _component("recorder")
+    vad = _component("vad")
+    asr = _component("asr")
+    llm = _component("llm")
+    tts = _component("tts")
+    player = _component("player")
+    memory = _component("memory")
+    tts_scheduler = _component("tts_scheduler")
+    task_manager = _component("task_manager")
+
+    def __init__(self, config_file):
+        config = read_config(config_file)
+        selected = config["selected_module"]
+
+        recorder_config = config["Recorder"][selected["Recorder"]] or {}
+        # 录音与 VAD 之间的固定大小环形缓冲，帧长与 VAD 窗口一致
+        self.audio_buffer = AudioRingBuffer(
+            frame_size=512,
+            capacity_frames=recorder_config.get("ring_buffer_frames", 256),
+            shared_memory=recorder_config.get("shared_memory", False),
         )
+        self.task_queue = queue.Queue()
 
+        # 各模型并行加载，构造函数不再等待，用到时才阻塞
+        startup_config = config.get("Startup") or {}
+        self.startup = StartupOrchestrator(lazy=startup_config.get("lazy"))
+        self.startup.add("recorder", lambda: recorder.create_instance(selected["Recorder"], recorder_config))
+        self.startup.add("vad", lambda: vad.create_instance(selected["VAD"], config["VAD"][selected["VAD"]]))
+        self.startup.add("asr", lambda: asr.create_instance(selected["ASR"], config["ASR"][selected["ASR"]]))
+        self.startup.add("llm", lambda: llm.create_instance(selected["LLM"], config["LLM"][selected["LLM"]]))
+        self.startup.add("tts", lambda: self._load_tts(config))
         # self.player = player.create_instance(
         #     config["selected_module"]["Player"],
         #     config["Player"][config["selected_module"]["Player"]]
         # )
-        self.player = PygameSoundPlayer()
-
-        self.memory = memory.Memory(config.get("Memory"))
-        self.prompt = sys_prompt.replace("{memory}", self.memory.get_memory()).strip()
+        self.startup.add("player", PygameSoundPlayer)
+        self.startup.add("memory", lambda: self._load_memory(config))
+        # TTS 专用调度器，保证顺序、限制每个引擎的并发
+        self.startup.add("tts_scheduler", lambda: self._load_tts_scheduler(config))
+        self.startup.add("task_manager", lambda: TaskManager(config.get("TaskManager"), self.task_queue))
+        # 等待 LLM 首 token 时先播放的填充语，TTS 就绪后在后台预先合成
+        self.filler_config = config.get("Filler") or {}
+        if self.filler_config.get("enabled", False):
+            self.startup.add("fillers", self._load_fillers)
+        self.startup.start()
+
+        # 系统提示词依赖记忆，第一轮对话时再生成
+        self.prompt = None
+        self._prompt_lock = threading.Lock()
+
+        # VAD 线程只在有语音时才投递事件：("start"|"frame"|"end", 环形缓冲中的帧序号, 时间)
+        self.event_queue = queue.Queue()
+        # 上下文窗口超出 token 预算时，滑出的轮次在后台并入记忆摘要
+        dialogue_config = config.get("Dialogue") or {}
+        self.dialogue = Dialogue(config["Memory"]["dialogue_history_path"],
+                                 max_tokens=dialogue_config.get("max_tokens"),
+                                 on_evict=self._fold_into_memory if dialogue_config.get("fold_evicted", True) else None,
+                                 max_deferred_turns=dialogue_config.get("max_deferred_turns", 8))
+        self.segmenter_config = config.get("Segmenter") or {}
+        # 按轮次的端到端延迟追踪
+        self.tracer = Tracer(config.get("Tracing"))
+        self.turn_trace = None
+        self._last_filler = None
 
-        self.vad_queue = queue.Queue()
-        self.dialogue = Dialogue(config["Memory"]["dialogue_history_path"])
-        self.dialogue.put(Message(role="system", content=self.prompt))
-
-        # 保证tts是顺序的
-        self.tts_queue = queue.Queue()
         # 初始化线程池
         self.executor = ThreadPoolExecutor(max_workers=10)
 
-        self.vad_start = True
-
         # 打断相关配置
         self.INTERRUPT = config["interrupt"]
+        # VAD 判定开始之前的若干帧一并送入 ASR，避免句首被截掉
+        self.pre_roll_frames = config.get("vad_pre_roll_frames", 8)
         self.silence_time_ms = int((1000 / 1000) * (16000 / 512))  # ms
 
-        # 线程锁
-        self.chat_lock = False
+        # 状态机，所有状态切换都在 state_cond 下完成
+        self.state = RobotState.IDLE
+        self.state_cond = threading.Condition()
+        self.chat_running = False
+        # 没有事件时的检查间隔（空闲任务、播放结束）
+        self.idle_poll_s = 0.1
+        # 当前一轮对话的取消令牌，打断时取消 LLM、TTS、播放
+        self.turn_token = CancelToken()
 
         # 事件用于控制程序退出
         self.stop_event = threading.Event()
@@ -108,161 +156,334 @@ class Robot(ABC):
         # 初始化单例
         # rag.Rag(config["Rag"])  # 第一次初始化
 
-        self.task_queue = queue.Queue()
-        self.task_manager = TaskManager(config.get("TaskManager"), self.task_queue)
         self.start_task_mode = config.get("StartTaskMode")
         
 
+    @staticmethod
+    def _load_tts(config):
+        # self.tts = tts.create_instance(
+        #     config["selected_module"]["TTS"],
+        #     # config["TTS"][config["selected_module"]["TTS"]])
+        engine = tts.KOKOROTTS(config={})
+        # 常用短语缓存，命中时不再重复合成
+        cache_config = config.get("TTSCache") or {}
+        if cache_config.get("enabled", False):
+            engine = tts.CachedTTS(engine, cache_config)
+        return engine
+
+    def _load_tts_scheduler(self, config):
+        scheduler = TTSScheduler(self.tts, self.player, config.get("TTSScheduler"))
+        # 常用短语的缓存预热交给调度器在空闲时做，受引擎并发限制，不与对话抢模型
+        cache_config = config.get("TTSCache") or {}
+        if cache_config.get("enabled", False):
+            scheduler.prewarm(cache_config.get("prewarm") or [])
+        return scheduler
+
+    def _load_fillers(self):
+        """填充语交给 TTS 调度器在空闲时合成，合成好一句就加入列表，不与对话抢引擎"""
+        fillers = []
+
+        def add(phrase, audio):
+            if not isinstance(audio, PCMAudio):
+                audio = PCMAudio.from_file(audio)
+            fillers.append((phrase, audio))
+            logger.debug(f"填充语已合成: {phrase}")
+
+        self.tts_scheduler.prewarm(self.filler_config.get("phrases") or [], add)
+        return fillers
+
+    def _play_filler(self, trace):
+        """LLM 思考期间先播放一句预先合成好的填充语，尚未合成完时跳过"""
+        if not self.filler_config.get("enabled", False) or not self.startup.loaded("fillers"):
+            return None
+        fillers = self.startup.get("fillers")
+        if not fillers:
+            return None
+        # 避免连续两轮用同一句
+        choices = [f for f in fillers if f[0] != self._last_filler] or fillers
+        phrase, audio = random.choice(choices)
+        self._last_filler = phrase
+        stream = AudioStream.of(audio)
+        if trace is not None:
+            trace.watch_filler(stream)
+        self.player.play(stream)
+        logger.debug(f"播放填充语: {phrase}")
+        return stream
+
+    def _load_memory(self, config):
+        # 历史会话的总结在后台进行，新摘要就绪后替换系统提示词
+        mem = memory.Memory(config.get("Memory"))
+        mem.add_listener(self._on_memory_updated)
+        mem.start()
+        return mem
+
+    @staticmethod
+    def _build_prompt(memory_text):
+        return sys_prompt.replace("{memory}", memory_text).strip()
+
+    def _ensure_system_prompt(self):
+        """第一轮对话前把带记忆的系统提示词放到对话开头"""
+        with self._prompt_lock:
+            if self.prompt is not None:
+                return
+            self.prompt = self._build_prompt(self.memory.get_memory())
+            self.dialogue.put(Message(role="system", content=self.prompt))
+
+    def _on_memory_updated(self, memory_text):
+        with self._prompt_lock:
+            if self.prompt is None:
+                # 还没开始对话，第一轮时会直接用最新摘要
+                return
+            self.prompt = self._build_prompt(memory_text)
+            # 推迟到上下文窗口滑动时再替换，不额外打断 LLM 的前缀缓存
+            self.dialogue.replace_system_prompt(self.prompt, defer=True)
+        logger.info("记忆摘要已更新")
+
+    def _fold_into_memory(self, messages):
+        # 只是入队，由记忆的后台线程总结
+        self.memory.fold_dialogue(messages, self.dialogue.log_file, self.dialogue.evicted_records)
+
     def listen_dialogue(self, callback):
         self.callback = callback
 
+    def _set_state(self, state, from_states=None):
+        """切换状态；from_states 不为空时只有当前状态在其中才切换，返回是否切换成功"""
+        with self.state_cond:
+            if from_states is not None and self.state not in from_states:
+                return False
+            if self.state != state:
+                logger.debug(f"状态切换: {self.state.name} -> {state.name}")
+                self.state = state
+                self.state_cond.notify_all()
+            return True
+
+    def wait_for_state(self, *states, timeout=None):
+        with self.state_cond:
+            return self.state_cond.wait_for(lambda: self.state in states, timeout=timeout)
+
     def _stream_vad(self):
         def vad_thread():
+            speech_active = False
             while not self.stop_event.is_set():
                 try:
-                    data = self.audio_queue.get()
+                    index, data = self.audio_buffer.read_frame(timeout=0.5)
+                    if index is None:
+                        continue
                     vad_statue = self.vad.is_vad(data)
-                    self.vad_queue.put({"voice": data, "vad_statue": vad_statue})
+                    # 静音时不投递任何事件，说话期间只转发帧序号，不拷贝音频
+                    if vad_statue is not None and "start" in vad_statue:
+                        speech_active = True
+                        self.event_queue.put(("start", index, time.monotonic()))
+                    elif vad_statue is not None and "end" in vad_statue:
+                        speech_active = False
+                        self.event_queue.put(("end", index, time.monotonic()))
+                    elif speech_active:
+                        self.event_queue.put(("frame", index, None))
                 except Exception as e:
                     logger.error(f"VAD 处理出错: {e}")
         consumer_audio = threading.Thread(target=vad_thread, daemon=True)
         consumer_audio.start()
 
-    def _tts_priority(self):
-        def priority_thread():
-            while not self.stop_event.is_set():
-                try:
-                    future = self.tts_queue.get()
-                    try:
-                        tts_file = future.result(timeout=5)
-                    except TimeoutError:
-                        logger.error("TTS 任务超时")
-                        continue
-                    except Exception as e:
-                        logger.error(f"TTS 任务出错: {e}")
-                        continue
-                    if tts_file is None:
-                        continue
-                    self.player.play(tts_file) # 播放tts_file
-                    print("tts_file", tts_file)
-                    # self.Live2.sync_lips(tts_file)
-                except Exception as e:
-                    logger.error(f"tts_priority priority_thread: {e}")
-        tts_priority = threading.Thread(target=priority_thread, daemon=True)
-        tts_priority.start()
-
-    def interrupt_playback(self):
-        """中断当前的语音播放"""
+    def interrupt_playback(self, vad_time=None):
+        """打断：取消本轮 LLM 生成、未完成的 TTS 和正在播放的声音"""
         logger.info("Interrupting current playback.")
+        vad_time = vad_time if vad_time is not None else time.monotonic()
+        with self.state_cond:
+            self.turn_token.cancel()
+            # 被打断的轮次不再等待生成结束，打断后识别为空时也能正常回到空闲
+            self.chat_running = False
+        self.tts_scheduler.cancel()
         self.player.stop()
 
+        def measure_thread():
+            # 记录从检测到用户开口到完全静音的时间
+            deadline = vad_time + 2
+            while self.player.get_playing_status() and time.monotonic() < deadline:
+                time.sleep(0.005)
+            logger.info(f"打断延迟（VAD start 到静音）: {(time.monotonic() - vad_time) * 1000:.0f} ms")
+        threading.Thread(target=measure_thread, daemon=True).start()
+
     def shutdown(self):
         """关闭所有资源，确保程序安全退出"""
         logger.info("Shutting down Robot...")
         self.stop_event.set()
+        # 只关闭已经加载的组件，不为了关闭而触发加载
+        if self.startup.loaded("tts_scheduler"):
+            self.tts_scheduler.shutdown()
         self.executor.shutdown(wait=True)
-        self.recorder.stop_recording()
-        self.player.shutdown()
+        self.tracer.shutdown()
+        self.dialogue.compact()
+        if self.startup.loaded("memory"):
+            self.memory.stop()
+        if self.startup.loaded("recorder"):
+            self.recorder.stop_recording()
+        self.audio_buffer.close()
+        if self.startup.loaded("player"):
+            self.player.shutdown()
+        self.startup.shutdown()
         logger.info("Shutdown complete.")
 
     def start_recording_and_vad(self):
         # 开始监听语音流
-        self.recorder.start_recording(self.audio_queue)
+        self.recorder.start_recording(self.audio_buffer)
         logger.info("Started recording.")
         # vad 实时识别
         self._stream_vad()
-        # tts优先级队列
-        self._tts_priority()
-
-    def _duplex(self):
-        # 处理识别结果
-        data = self.vad_queue.get()
-        # 识别到vad开始
-        if self.vad_start:
-            self.speech.append(data)
-        vad_status = data.get("vad_statue")
-        # 空闲的时候，取出耗时任务进行播放
-        if not self.task_queue.empty() and  not self.vad_start and vad_status is None \
-                and not self.player.get_playing_status() and self.chat_lock is False:
-            result = self.task_queue.get()
-            future = self.executor.submit(self.speak_and_play, result.response)
-            self.tts_queue.put(future)
-
-        """ 语音唤醒
-        if time.time() - self.start_time>=60:
-            self.silence_status = True
-
-        if self.silence_status:
-            return
-        """
-        if vad_status is None:
+
+    def _append_speech(self, data):
+        """缓存语音帧并送入流式识别，有新的部分识别结果时回调"""
+        if not self.speech:
+            self.asr.stream_start()
+        self.speech.append(data)
+        try:
+            partial = self.asr.stream_accept(data)
+        except Exception as e:
+            logger.error(f"流式ASR处理出错: {e}")
             return
-        if "start" in vad_status:
-            if self.player.get_playing_status() or self.chat_lock is True:  # 正在播放，打断场景
-                if self.INTERRUPT:
-                    self.chat_lock = False
-                    self.interrupt_playback()
-                    self.vad_start = True
-                    self.speech.append(data)
-                else:
-                    return
-            else:  # 没有播放，正常
-                self.vad_start = True
-                self.speech.append(data)
-        elif "end" in vad_status and len(self.speech) > 0:
-            try:
-                logger.debug(f"语音包的长度：{len(self.speech)}")
-                self.vad_start = False
-                voice_data = [d["voice"] for d in self.speech]
-                text, tmpfile = self.asr.recognizer(voice_data)
-                self.speech = []
-            except Exception as e:
-                self.vad_start = False
-                self.speech = []
-                logger.error(f"ASR识别出错: {e}")
-                return
-            if not text.strip():
-                logger.debug("识别结果为空，跳过处理。")
+        if partial and self.callback:
+            self.callback({"role": "user", "content": partial, "partial": True})
+
+    def _pre_roll(self, index):
+        """环形缓冲中 start 帧之前仍未被覆盖的若干帧"""
+        frames = []
+        for i in range(max(0, index - self.pre_roll_frames), index):
+            frame = self.audio_buffer.frame_at(i)
+            if frame is not None:
+                frames.append(frame)
+        return frames
+
+    def _on_speech_start(self, data, vad_time, index):
+        with self.state_cond:
+            busy = self.state in (RobotState.THINKING, RobotState.SPEAKING)
+        if busy:  # 正在回复，打断场景
+            if not self.INTERRUPT:
                 return
+            self.interrupt_playback(vad_time)
+        self.speech = []
+        self._set_state(RobotState.LISTENING)
+        for frame in self._pre_roll(index):
+            self._append_speech(frame)
+        self._append_speech(data)
 
-            logger.debug(f"ASR识别结果: {text}")
-            if self.callback:
-                self.callback({"role": "user", "content": str(text)})
-            self.executor.submit(self.chat, text)
-        return True
+    def _on_speech_frame(self, data):
+        if self.state == RobotState.LISTENING:
+            self._append_speech(data)
+
+    def _on_speech_end(self, data, vad_time):
+        if self.state != RobotState.LISTENING:
+            return
+        self._append_speech(data)
+        trace = self.tracer.start_turn(vad_time)
+        try:
+            logger.debug(f"语音包的长度：{len(self.speech)}")
+            # 大部分音频已在说话过程中解码，这里只需收尾
+            text, tmpfile = self.asr.stream_finish()
+            if trace is not None:
+                trace.mark("asr_done")
+        except Exception as e:
+            logger.error(f"ASR识别出错: {e}")
+            text = None
+        finally:
+            self.speech = []
+        if not text or not text.strip():
+            logger.debug("识别结果为空，跳过处理。")
+            self._set_state(RobotState.IDLE, from_states=(RobotState.LISTENING,))
+            return
+
+        logger.debug(f"ASR识别结果: {text}")
+        if self.callback:
+            self.callback({"role": "user", "content": str(text)})
+        # 本轮的取消令牌和延迟追踪在提交前创建，chat 还没开始执行时打断也能取消到这一轮
+        cancel_token = CancelToken()
+        with self.state_cond:
+            self.turn_token = cancel_token
+            self.turn_trace = trace
+            self.chat_running = True
+            self._set_state(RobotState.THINKING)
+        self._play_filler(trace)
+        self.executor.submit(self.chat, text, cancel_token)
+
+    def _on_idle_tick(self):
+        """没有语音事件时检查：播放是否结束、是否有耗时任务的结果需要播报"""
+        with self.state_cond:
+            if self.state == RobotState.SPEAKING and not self.chat_running \
+                    and not self.player.get_playing_status():
+                self._set_state(RobotState.IDLE)
+            if self.state != RobotState.IDLE or self.task_queue.empty():
+                return
+            self._set_state(RobotState.SPEAKING)
+        result = self.task_queue.get()
+        if self.speak_and_play(result.response) is None:
+            self._set_state(RobotState.IDLE, from_states=(RobotState.SPEAKING,))
+
+    def _dispatch(self, event):
+        kind, index, event_time = event
+        data = self.audio_buffer.frame_at(index)
+        if data is None:
+            logger.warning(f"音频帧 {index} 已被覆盖，处理跟不上录音，累计溢出 {self.audio_buffer.overruns} 次")
+            return
+        if kind == "start":
+            self._on_speech_start(data, event_time, index)
+        elif kind == "frame":
+            self._on_speech_frame(data)
+        elif kind == "end":
+            self._on_speech_end(data, event_time)
 
     def run(self):
         try:
             self.start_recording_and_vad()  # 监听语音流
             while not self.stop_event.is_set():
-                self._duplex()  # 双工处理
+                try:
+                    event = self.event_queue.get(timeout=self.idle_poll_s)
+                except queue.Empty:
+                    self._on_idle_tick()
+                    continue
+                self._dispatch(event)
         except KeyboardInterrupt:
             logger.info("Received KeyboardInterrupt. Exiting...")
         finally:
             self.shutdown()
 
-    def speak_and_play(self, text):
+    def _new_segmenter(self):
+        """每轮对话一个分句器，后续段长按 TTS 调度器测得的实时率调整"""
+        return SentenceSegmenter(self.segmenter_config, rtf=lambda: self.tts_scheduler.rtf)
+
+    def _turn_trace(self, cancel_token):
+        """cancel_token 所属轮次的延迟追踪，已被新一轮取代或未启用时为 None"""
+        if cancel_token is not None and cancel_token is self.turn_token:
+            return self.turn_trace
+        return None
+
+    def speak_and_play(self, text, cancel_token=None):
+        """按顺序提交一句文本给 TTS 调度器，合成的音频流直接进入播放队列"""
         if text is None or len(text)<=0:
             logger.info(f"无需tts转换，query为空，{text}")
             return None
-        tts_file = self.tts.to_tts(text)
-        if tts_file is None:
-            logger.error(f"tts转换失败，{text}")
-            return None
-        logger.debug(f"TTS 文件生成完毕{self.chat_lock}")
-        #if self.chat_lock is False:
-        #    return None
-        # 开始播放
-        # self.player.play(tts_file)
-        #return True
-        return tts_file
-
-    def chat_tool(self, query):
-        # 打印逐步生成的响应内容
-        start = 0
+        job = self.tts_scheduler.submit(text, cancel_token, trace=self._turn_trace(cancel_token))
+        if job is not None:
+            self._set_state(RobotState.SPEAKING, from_states=(RobotState.THINKING,))
+            if job.trace is not None:
+                job.trace.watch_playback(job.stream, job.segment)
+        return job
+
+    def _finish_turn(self, cancel_token):
+        """一轮对话生成结束；只有仍是当前轮次时才改动状态，已被新一轮取代的旧轮次什么也不做"""
+        with self.state_cond:
+            if cancel_token is not self.turn_token:
+                return
+            self.chat_running = False
+            if cancel_token.is_cancelled():
+                return
+            if self.state in (RobotState.THINKING, RobotState.SPEAKING):
+                self._set_state(RobotState.SPEAKING if self.player.get_playing_status() else RobotState.IDLE)
+
+    def chat_tool(self, query, cancel_token=None):
+        cancel_token = cancel_token or self.turn_token
+        segmenter = self._new_segmenter()
+        trace = self._turn_trace(cancel_token)
         try:
-            start_time = time.time()  # 记录开始时间
-            llm_responses = self.llm.response_call(self.dialogue.get_llm_dialogue(), functions_call=self.task_manager.get_functions())
+            llm_responses = self.llm.response_call(self.dialogue.get_llm_dialogue(), functions_call=self.task_manager.get_functions(),
+                                                   cancel_token=cancel_token)
         except Exception as e:
             #self.chat_lock = False
             logger.error(f"LLM 处理出错 {query}: {e}")
@@ -277,6 +498,8 @@ class Robot(ABC):
         content_arguments = ""
         for chunk in llm_responses:
             content, tools_call = chunk
+            if trace is not None:
+                trace.mark_once("llm_first_token")
             if content is not None and len(content)>0:
                 if len(response_message)<=0 and content=="```":
                     tool_call_flag = True
@@ -293,24 +516,16 @@ class Robot(ABC):
                     content_arguments+=content
                 else:
                     response_message.append(content)
-                    end_time = time.time()  # 记录结束时间
-                    logger.debug(f"大模型返回时间时间: {end_time - start_time} 秒, 生成token={content}")
-                    if is_segment(response_message):
-                        segment_text = "".join(response_message[start:])
-                        print(f"分段文本: {segment_text}")
-                        # 为了保证语音的连贯，至少2个字才转tts
-                        if len(segment_text) <= max(2, start):
-                            continue
-                        future = self.executor.submit(self.speak_and_play, segment_text)
-                        self.tts_queue.put(future)
-                        # futures.append(future)
-                        start = len(response_message)
+                    for segment_text in segmenter.feed(content):
+                        logger.debug(f"分段文本: {segment_text}")
+                        self.speak_and_play(segment_text, cancel_token)
 
+        if cancel_token.is_cancelled():
+            logger.info("本轮对话已被打断")
+            return response_message
         if not tool_call_flag:
-            if start < len(response_message):
-                segment_text = "".join(response_message[start:])
-                future = self.executor.submit(self.speak_and_play, segment_text)
-                self.tts_queue.put(future)
+            for segment_text in segmenter.flush():
+                self.speak_and_play(segment_text, cancel_token)
         else:
             # 处理函数调用
             if function_id is None:
@@ -332,8 +547,7 @@ class Robot(ABC):
             elif result.action == Action.NONE: # = (1,  "啥也不干")
                 return []
             elif result.action == Action.RESPONSE: # = (2, "直接回复")
-                future = self.executor.submit(self.speak_and_play, result.response)
-                self.tts_queue.put(future)
+                self.speak_and_play(result.response, cancel_token)
                 return [result.response]
             elif result.action == Action.REQLLM: # = (3, "调用函数后再请求llm生成回复")
                 # 添加工具内容
@@ -343,7 +557,7 @@ class Robot(ABC):
                                                        "type": 'function', "index": 0}]))
 
                 self.dialogue.put(Message(role="tool", tool_call_id=function_id, content=result.result))
-                self.chat_tool(query)
+                self.chat_tool(query, cancel_token)
             elif result.action == Action.ADDSYSTEM: # = (4, "添加系统prompt到对话中去")
                 self.dialogue.put(Message(**result.result))
                 return []
@@ -357,49 +571,69 @@ class Robot(ABC):
                 self.dialogue.put(Message(role="tool", tool_call_id=function_id, content=result.response))
                 self.dialogue.put(Message(**result.result))
                 self.dialogue.put(Message(role="user", content="ok"))
-                return self.chat_tool(query)
+                return self.chat_tool(query, cancel_token)
             else:
                 logger.error(f"not found action type: {result.action}")
         return response_message
 
-    def chat(self, query):
+    def chat(self, query, cancel_token=None):
+        """
+        一轮对话。cancel_token 由调用方创建并已设为 turn_token（语音输入时在 _on_speech_end 中），
+        不传时在这里新建一轮
+        """
+        if cancel_token is None:
+            cancel_token = CancelToken()
+            with self.state_cond:
+                self.turn_token = cancel_token
+                self.turn_trace = None
+                self.chat_running = True
+        trace = self._turn_trace(cancel_token)
+        response_message = []
+        try:
+            response_message = self._chat(query, cancel_token, trace)
+        except Exception as e:
+            logger.error(f"LLM 处理出错 {query}: {e}")
+            response_message = None
+        finally:
+            if trace is not None:
+                trace.end_generation(interrupted=response_message is None or cancel_token.is_cancelled())
+            # 任何退出路径都要结束本轮，清除 chat_running
+            self._finish_turn(cancel_token)
+        if response_message is None:
+            return None
+        # 更新对话
+        if self.callback:
+            self.callback({"role": "assistant", "content": "".join(response_message)})
+        self.dialogue.put(Message(role="assistant", content="".join(response_message)))
+        self.dialogue.dump_dialogue()
+        logger.debug(json.dumps(self.dialogue.get_llm_dialogue(), indent=4, ensure_ascii=False))
+        return True
+
+    def _chat(self, query, cancel_token, trace):
+        """生成并播报回复，返回已生成的文本片段；LLM 出错时抛出异常"""
+        self._ensure_system_prompt()
         self.dialogue.put(Message(role="user", content=query))
         response_message = []
         # futures = []
-        start = 0
-        self.chat_lock = True
         if self.start_task_mode:
-            response_message = self.chat_tool(query)
+            response_message = self.chat_tool(query, cancel_token)
         else:
             # 提交 LLM 任务
-            try:
-                start_time = time.time()  # 记录开始时间
-                llm_responses = self.llm.response(self.dialogue.get_llm_dialogue())
-            except Exception as e:
-                self.chat_lock = False
-                logger.error(f"LLM 处理出错 {query}: {e}")
-                return None
+            llm_responses = self.llm.response(self.dialogue.get_llm_dialogue(), cancel_token=cancel_token)
             # 提交 TTS 任务到线程池
+            segmenter = self._new_segmenter()
             for content in llm_responses:
+                if trace is not None and not response_message:
+                    trace.mark("llm_first_token")
                 response_message.append(content)
-                end_time = time.time()  # 记录结束时间
-                logger.debug(f"大模型返回时间时间: {end_time - start_time} 秒, 生成token={content}")
-                if is_segment(response_message):
-                    segment_text = "".join(response_message[start:])
-                    # 为了保证语音的连贯，至少2个字才转tts
-                    if len(segment_text)<=max(2, start):
-                        continue
-                    future = self.executor.submit(self.speak_and_play, segment_text)
-                    self.tts_queue.put(future)
+                for segment_text in segmenter.feed(content):
+                    self.speak_and_play(segment_text, cancel_token)
                     #futures.append(future)
-                    start = len(response_message)
 
             # 处理剩余的响应
-            if start < len(response_message):
-                segment_text = "".join(response_message[start:])
-                future = self.executor.submit(self.speak_and_play, segment_text)
-                self.tts_queue.put(future)
-                #futures.append(future)
+            if not cancel_token.is_cancelled():
+                for segment_text in segmenter.flush():
+                    self.speak_and_play(segment_text, cancel_token)
 
             # 等待所有 TTS 任务完成
             """
@@ -411,14 +645,9 @@ class Robot(ABC):
                 except Exception as e:
                     logger.error(f"TTS 任务出错: {e}")
             """
-        self.chat_lock = False
-        # 更新对话
-        if self.callback:
-            self.callback({"role": "assistant", "content": "".join(response_message)})
-        self.dialogue.put(Message(role="assistant", content="".join(response_message)))
-        self.dialogue.dump_dialogue()
-        logger.debug(json.dumps(self.dialogue.get_llm_dialogue(), indent=4, ensure_ascii=False))
-        return True
+        if cancel_token.is_cancelled():
+            logger.info(f"本轮对话已被打断，已生成: {''.join(response_message)}")
+        return response_message
 
 
 if __name__ == "__main__":
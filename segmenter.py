@@ -0,0 +1,203 @@
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+# 句末标点和换行：一句话说完的位置
+_STRONG_PUNCT = set("。！？!?；;…\n")
+# 句中停顿，可以断开但语气上不如句末完整
+_WEAK_PUNCT = set("，,：:")
+# 紧跟在标点后面、应归入前一段的右引号和右括号
+_CLOSING = set("\"'”’）)》】」』")
+# 英文里后面跟 "." 但不是句末的缩写
+_ABBREVIATIONS = {"mr", "mrs", "ms", "dr", "prof", "st", "vs", "etc", "jr", "sr", "inc", "ltd", "co",
+                  "no", "e.g", "i.e", "a.m", "p.m", "u.s"}
+
+# 行首的有序列表序号 "1." "2)"，不是句末
+_LIST_MARKER = re.compile(r'\n[ \t]*\d+[.)]$')
+# TTSScheduler 尚未就绪时假定的实时率
+DEFAULT_RTF = 0.5
+
+_UNIT_PATTERN = re.compile(r'[㐀-鿿豈-﫿぀-ヿ가-힯]|[A-Za-z]+|\d+(?:[.,:]\d+)*')
+_WORD_BEFORE_DOT = re.compile(r'([A-Za-z]+(?:\.[A-Za-z]+)*)$')
+
+_MARKDOWN_PATTERNS = [
+    (re.compile(r'```[\w+-]*'), ''),                     # 代码块围栏
+    (re.compile(r'!?\[([^\]]*)\]\([^)]*\)'), r'\1'),      # 链接、图片只读文字
+    (re.compile(r'^\s{0,3}#{1,6}\s*', re.M), ''),         # 标题
+    (re.compile(r'^\s{0,3}>\s?', re.M), ''),              # 引用
+    (re.compile(r'^\s*(?:[-*+]|\d+[.)])\s+', re.M), ''),  # 列表符号
+    (re.compile(r'(\*{1,3}|_{2,3}|~~|`)'), ''),           # 加粗、斜体、删除线、行内代码
+    (re.compile(r'^\s*[-*_]{3,}\s*$', re.M), ''),         # 分割线
+]
+_EMOJI_PATTERN = re.compile(
+    '[\U0001F000-\U0001FAFF\U00002600-\U000027BF\U0001F1E6-\U0001F1FF\U00002B00-\U00002BFF'
+    '\U0000FE0F\U0000200D\U000020E3]+')
+
+
+def speech_units(text):
+    """朗读长度的粗略估计：一个汉字、一个英文单词或一个数字各算 1 个单位"""
+    return len(_UNIT_PATTERN.findall(text))
+
+
+def clean_for_tts(text):
+    """去掉 markdown 标记和 emoji，合并空白，得到适合朗读的纯文本"""
+    for pattern, repl in _MARKDOWN_PATTERNS:
+        text = pattern.sub(repl, text)
+    text = _EMOJI_PATTERN.sub('', text)
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def _is_word_char(ch):
+    return ch.isascii() and ch.isalnum()
+
+
+class SentenceSegmenter:
+    """
+    把 LLM 的流式输出切成交给 TTS 的文本段，每轮对话一个实例：
+    - 第一段在凑够 first_min_units 后遇到第一个标点就切出，尽早开始播放；
+      迟迟没有标点时到 first_max_units 强制切开
+    - 之后每段的目标长度按上一段长度除以 TTS 实时率（RTF）增长：
+      上一段播放期间刚好来得及合成下一段，播放不会断档，同时段越长合成越高效
+    - 只在标点处切分，数字里的 "3.14""1,000""10:30"、英文缩写 "Mr." "e.g." 不切，
+      也不会把一个英文单词从中间切开；无法判断的标点等下一个 token 到达再决定
+    - 行首的列表序号 "1." 不当作句末，换行处切开，序号随下一项一起清理掉
+    - 切出的段去掉 markdown 和 emoji 后再返回
+    """
+
+    def __init__(self, config=None, rtf=None):
+        """rtf 为无参函数，返回 TTS 当前测得的实时率"""
+        config = config or {}
+        self.first_min_units = config.get("first_min_units", 4)
+        self.first_max_units = config.get("first_max_units", 15)
+        self.min_units = config.get("min_units", 8)
+        self.max_units = config.get("max_units", 80)
+        self.safety = config.get("safety", 0.8)
+        self.rtf = rtf
+        self.buffer = ""
+        # buffer 开头是否为一行的开头（上一段以换行结束）
+        self._line_start = True
+        self.segments = 0
+        self._last_units = 0
+
+    def feed(self, text):
+        """追加一段 LLM 输出，返回可以合成的文本段列表（可能为空）"""
+        if text:
+            self.buffer += text
+        return self._drain(final=False)
+
+    def flush(self):
+        """LLM 输出结束，返回剩余的文本段"""
+        return self._drain(final=True)
+
+    def target_units(self):
+        """下一段的目标长度"""
+        if self.segments == 0:
+            return self.first_min_units
+        rtf = None
+        if self.rtf is not None:
+            try:
+                rtf = self.rtf()
+            except Exception as e:
+                logger.debug(f"获取 TTS 实时率失败: {e}")
+        rtf = rtf or DEFAULT_RTF
+        growth = max(1.0, self.safety / max(rtf, 0.05))
+        return int(min(self.max_units, max(self.min_units, self._last_units * growth)))
+
+    def _drain(self, final):
+        segments = []
+        while self.buffer:
+            cut = self._find_cut(final)
+            if cut is None:
+                break
+            segment, self.buffer = self.buffer[:cut], self.buffer[cut:]
+            self._line_start = segment.endswith("\n")
+            self._emit(segment, segments)
+        if final and self.buffer:
+            segment, self.buffer = self.buffer, ""
+            self._emit(segment, segments)
+        return segments
+
+    def _emit(self, segment, segments):
+        units = speech_units(segment)
+        text = clean_for_tts(segment)
+        if not text or units == 0:
+            # 只有标点、markdown 或 emoji，没有可读的内容
+            return
+        segments.append(text)
+        self.segments += 1
+        self._last_units = units
+
+    def _find_cut(self, final):
+        """返回切分位置（切在该下标之前），暂时不切返回 None"""
+        boundaries = self._boundaries(final)
+        units = speech_units(self.buffer)
+        if self.segments == 0:
+            for end in boundaries:
+                if speech_units(self.buffer[:end]) >= self.first_min_units:
+                    return end
+            if units >= self.first_max_units:
+                return self._safe_cut()
+            return None
+        if units < self.target_units():
+            return None
+        # 取不超过 max_units 的最后一个标点，LLM 输出比合成快、积压较多时也不会切出过长的段
+        candidates = [end for end in boundaries if speech_units(self.buffer[:end]) >= self.min_units]
+        fitting = [end for end in candidates if speech_units(self.buffer[:end]) <= self.max_units]
+        if fitting:
+            return fitting[-1]
+        if candidates:
+            return candidates[0]
+        if units >= self.max_units:
+            return self._safe_cut()
+        return None
+
+    def _boundaries(self, final):
+        """buffer 中所有可切分的位置（标点连同后面的右引号、右括号之后）"""
+        buf = self.buffer
+        result = []
+        i = 0
+        while i < len(buf):
+            ch = buf[i]
+            if ch not in _STRONG_PUNCT and ch not in _WEAK_PUNCT and ch != ".":
+                i += 1
+                continue
+            end = i + 1
+            while end < len(buf) and (buf[end] in _STRONG_PUNCT or buf[end] in _CLOSING or buf[end] == "."):
+                end += 1
+            if end == len(buf) and not final:
+                # 后面可能还有数字、右引号或省略号，等下一个 token
+                break
+            if self._splittable(i, end):
+                result.append(end)
+            i = end
+        return result
+
+    def _splittable(self, i, end):
+        buf = self.buffer
+        ch = buf[i]
+        prev = buf[i - 1] if i > 0 else ""
+        nxt = buf[end] if end < len(buf) else ""
+        if ch in ".,:" and end == i + 1 and prev.isdigit() and nxt.isdigit():
+            return False  # 小数、千分位、时间
+        if ch == "." and end == i + 1:
+            head = buf[:i + 1] if not self._line_start else "\n" + buf[:i + 1]
+            if _LIST_MARKER.search(head):
+                return False  # 列表序号，属于下一项
+        if ch == ".":
+            if end == i + 1 and _is_word_char(nxt):
+                return False  # 网址、文件名、版本号
+            match = _WORD_BEFORE_DOT.search(buf[:i])
+            if match and end == i + 1:
+                word = match.group(1)
+                if word.lower() in _ABBREVIATIONS or (len(word) == 1 and word.isupper()):
+                    return False  # 缩写和姓名首字母
+        return True
+
+    def _safe_cut(self):
+        """没有合适标点时的强制切分：不切开英文单词和数字，末尾可能不完整的单词留在 buffer"""
+        buf = self.buffer
+        for p in range(len(buf) - 1, 0, -1):
+            if buf[p].isspace() or not (_is_word_char(buf[p - 1]) and _is_word_char(buf[p])):
+                return p
+        return None
@@ -0,0 +1,114 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class StartupOrchestrator:
+    """
+    启动编排：互不依赖的组件（ASR、LLM、TTS、VAD、播放器、记忆……）在线程池里并行加载，
+    lazy 的组件直到第一次 get 才加载。get 会阻塞到组件就绪，组件之间的依赖也通过 get 表达。
+    每个组件的开始/结束时间记录在时间线里，全部预加载完成后打印一次，便于分析启动耗时。
+    """
+
+    def __init__(self, lazy=None):
+        self.lazy = set(lazy or [])
+        self._factories = {}
+        self._futures = {}
+        self._timeline = {}
+        self._waits = {}
+        self._lock = threading.Lock()
+        self._executor = None
+        self._eager = set()
+        self._t0 = time.monotonic()
+
+    def add(self, name, factory, lazy=False):
+        """注册组件，factory 无参数，返回组件实例"""
+        self._factories[name] = factory
+        if lazy:
+            self.lazy.add(name)
+
+    def start(self):
+        # 每个组件最多占一个线程，依赖其他组件而阻塞的加载不会把线程池占满
+        self._executor = ThreadPoolExecutor(max_workers=max(1, len(self._factories)),
+                                            thread_name_prefix="startup")
+        self._eager = {name for name in self._factories if name not in self.lazy}
+        for name in self._factories:
+            if name not in self.lazy:
+                self._submit(name)
+        logger.info(f"并行加载组件: {sorted(self._eager)}，延迟加载: {sorted(self.lazy & set(self._factories))}")
+
+    def _submit(self, name):
+        with self._lock:
+            future = self._futures.get(name)
+            if future is None:
+                if name not in self._factories:
+                    raise KeyError(f"未注册的组件: {name}")
+                future = self._executor.submit(self._load, name)
+                self._futures[name] = future
+                future.add_done_callback(lambda _: self._on_loaded(name))
+        return future
+
+    def _load(self, name):
+        start = time.monotonic()
+        try:
+            return self._factories[name]()
+        except Exception as e:
+            logger.error(f"组件 {name} 加载失败: {e}")
+            raise
+        finally:
+            end = time.monotonic()
+            self._timeline[name] = (start - self._t0, end - self._t0)
+            logger.debug(f"组件 {name} 加载耗时 {(end - start) * 1000:.0f} ms")
+
+    def _on_loaded(self, name):
+        with self._lock:
+            if name not in self._eager:
+                return
+            self._eager.discard(name)
+            if self._eager:
+                return
+        self.log_timeline()
+
+    def get(self, name, timeout=None):
+        """取组件实例，未加载完成时阻塞等待，lazy 组件在此时开始加载"""
+        future = self._futures.get(name) or self._submit(name)
+        if not future.done():
+            wait_start = time.monotonic()
+            try:
+                return future.result(timeout)
+            finally:
+                waited = time.monotonic() - wait_start
+                self._waits[name] = self._waits.get(name, 0.0) + waited
+                logger.info(f"等待组件 {name} 就绪 {waited * 1000:.0f} ms")
+        return future.result()
+
+    def loaded(self, name):
+        """组件是否已成功加载（不会触发加载）"""
+        future = self._futures.get(name)
+        return future is not None and future.done() and future.exception() is None
+
+    def timeline(self):
+        """返回 [(组件, 开始秒, 结束秒, 被等待秒)]，时间相对编排器创建时刻，按开始时间排序"""
+        return sorted(((name, start, end, self._waits.get(name, 0.0))
+                       for name, (start, end) in self._timeline.items()), key=lambda x: x[1])
+
+    def log_timeline(self, width=40):
+        rows = self.timeline()
+        if not rows:
+            return
+        total = max(end for _, _, end, _ in rows) or 1e-9
+        lines = [f"启动时间线（共 {total:.2f} 秒）:"]
+        for name, start, end, waited in rows:
+            left = int(start / total * width)
+            bar = "#" * max(1, int(end / total * width) - left)
+            lines.append(f"  {name:<14} {start:6.2f}s -> {end:6.2f}s ({end - start:5.2f}s) "
+                         f"|{' ' * left}{bar:<{width - left}}|"
+                         + (f" 阻塞 {waited:.2f}s" if waited > 0 else ""))
+        logger.info("\n".join(lines))
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 仓库是平铺的模块，测试直接按模块名导入
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,94 @@
+import threading
+
+import numpy as np
+
+from audio import AudioRingBuffer
+
+
+def samples(start, n):
+    return np.arange(start, start + n, dtype=np.int16)
+
+
+def test_frames_are_contiguous_across_wraparound():
+    buffer = AudioRingBuffer(frame_size=4, capacity_frames=3)
+    written = 0
+    for size in (5, 3, 7, 2, 6, 1):
+        buffer.write(samples(written, size).tobytes())
+        written += size
+        while buffer.write_pos - buffer.read_pos >= buffer.frame_size:
+            index, frame = buffer.read_frame(timeout=0)
+            assert frame.tolist() == samples(index * 4, 4).tolist()
+    assert buffer.read_pos == 24 and buffer.overruns == 0
+
+
+def test_overrun_skips_to_oldest_complete_frame():
+    buffer = AudioRingBuffer(frame_size=4, capacity_frames=3)
+    buffer.write(samples(0, 14).tobytes())
+    index, frame = buffer.read_frame(timeout=0)
+    # 前两个采样被覆盖，整帧丢弃，从第 1 帧开始读
+    assert index == 1 and frame.tolist() == samples(4, 4).tolist()
+    assert buffer.overruns == 1 and buffer.dropped_samples == 4
+
+
+def test_oversized_write_keeps_latest_samples():
+    buffer = AudioRingBuffer(frame_size=4, capacity_frames=2)
+    buffer.write(samples(0, 10).tobytes())
+    assert buffer.write_pos == 10
+    assert buffer.frame_at(0) is None
+    assert buffer.frame_at(1).tolist() == samples(4, 4).tolist()
+
+
+def test_frame_at_returns_pre_roll_until_overwritten():
+    buffer = AudioRingBuffer(frame_size=4, capacity_frames=3)
+    buffer.write(samples(0, 12).tobytes())
+    assert buffer.frame_at(0).tolist() == samples(0, 4).tolist()
+    assert buffer.frame_at(3) is None
+    buffer.write(samples(12, 4).tobytes())
+    assert buffer.frame_at(0) is None
+    assert buffer.frame_at(3).tolist() == samples(12, 4).tolist()
+
+
+def test_read_frame_waits_for_writer_and_returns_none_when_closed():
+    buffer = AudioRingBuffer(frame_size=4, capacity_frames=3)
+    assert buffer.read_frame(timeout=0.01) == (None, None)
+    timer = threading.Timer(0.02, buffer.write, [samples(0, 4).tobytes()])
+    timer.start()
+    index, frame = buffer.read_frame(timeout=1)
+    assert index == 0 and frame.tolist() == samples(0, 4).tolist()
+    buffer.close()
+    assert buffer.read_frame(timeout=1) == (None, None)
+
+
+def test_read_frame_returns_reader_owned_copy():
+    buffer = AudioRingBuffer(frame_size=4, capacity_frames=2)
+    buffer.write(samples(0, 4).tobytes())
+    _, frame = buffer.read_frame(timeout=0)
+    # 写入方绕回覆盖同一位置，已读出的帧不受影响
+    buffer.write(samples(4, 8).tobytes())
+    assert frame.tolist() == samples(0, 4).tolist()
+    saved = buffer.frame_at(1)
+    buffer.write(samples(12, 8).tobytes())
+    assert saved.tolist() == samples(4, 4).tolist()
+
+
+def test_frame_overwritten_during_copy_is_treated_as_overrun():
+    buffer = AudioRingBuffer(frame_size=4, capacity_frames=2)
+    buffer.write(samples(0, 8).tobytes())
+    # 模拟写入方已认领下一段、正在覆盖第 0 帧，write_pos 尚未推进
+    buffer._claim_pos = 12
+    assert buffer.frame_at(0) is None
+    index, frame = buffer.read_frame(timeout=0)
+    assert index == 1 and frame.tolist() == samples(4, 4).tolist()
+    assert buffer.overruns == 1
+
+
+def test_writer_does_not_block_when_reader_is_waiting():
+    buffer = AudioRingBuffer(frame_size=4, capacity_frames=4, poll_interval=0.001)
+    results = []
+    reader = threading.Thread(target=lambda: results.extend(
+        buffer.read_frame(timeout=1)[0] for _ in range(3)))
+    reader.start()
+    for i in range(3):
+        buffer.write(samples(i * 4, 4).tobytes())
+    reader.join(timeout=2)
+    assert results == [0, 1, 2]
@@ -0,0 +1,98 @@
+from dialogue import Dialogue, Message
+from utils import read_jsonl
+
+
+def make_dialogue(tmp_path, **kwargs):
+    evicted = []
+    dialogue = Dialogue(str(tmp_path), on_evict=evicted.extend, **kwargs)
+    return dialogue, evicted
+
+
+def add_turn(dialogue, user, assistant):
+    dialogue.put(Message(role="user", content=user))
+    dialogue.put(Message(role="assistant", content=assistant))
+
+
+def test_window_evicts_whole_turns_and_keeps_system(tmp_path):
+    dialogue, evicted = make_dialogue(tmp_path, max_tokens=40)
+    dialogue.put(Message(role="system", content="你是助手"))
+    for i in range(5):
+        add_turn(dialogue, f"第{i}个问题" * 2, f"第{i}个回答" * 2)
+    messages = dialogue.get_llm_dialogue()
+    assert messages[0] == {"role": "system", "content": "你是助手"}
+    assert messages[1]["role"] == "user"
+    assert dialogue.token_count() <= 40
+    # 滑出的总是完整的轮次，按顺序交给 on_evict
+    assert [m["role"] for m in evicted] == ["user", "assistant"] * (len(evicted) // 2)
+    assert evicted[0]["content"].startswith("第0个问题")
+    assert dialogue.evicted_records == len(evicted)
+
+
+def test_tool_call_stays_with_its_turn(tmp_path):
+    dialogue, evicted = make_dialogue(tmp_path, max_tokens=30)
+    dialogue.put(Message(role="user", content="现在几点"))
+    dialogue.put(Message(role="assistant", tool_calls=[{"id": "1", "function": {"name": "time"}}]))
+    dialogue.put(Message(role="tool", tool_call_id="1", content="十点"))
+    dialogue.put(Message(role="assistant", content="十点了"))
+    add_turn(dialogue, "再问一个很长很长很长很长的问题", "好")
+    assert [m["role"] for m in evicted] == ["user", "assistant", "tool", "assistant"]
+    # 只有有内容的 user 和 assistant 消息写入日志
+    assert dialogue.evicted_records == 2
+
+
+def test_single_turn_is_never_evicted(tmp_path):
+    dialogue, evicted = make_dialogue(tmp_path, max_tokens=5)
+    add_turn(dialogue, "一个超过上限的问题", "一个超过上限的回答")
+    assert evicted == []
+    assert len(dialogue.get_llm_dialogue()) == 2
+
+
+def test_deferred_system_prompt_applies_on_next_slide(tmp_path):
+    dialogue, _ = make_dialogue(tmp_path, max_tokens=40)
+    dialogue.put(Message(role="system", content="旧提示词"))
+    add_turn(dialogue, "问题", "回答")
+    assert dialogue.replace_system_prompt("新提示词", defer=True)
+    assert dialogue.get_llm_dialogue()[0]["content"] == "旧提示词"
+    for i in range(5):
+        add_turn(dialogue, f"第{i}个问题" * 2, f"第{i}个回答" * 2)
+    assert dialogue.get_llm_dialogue()[0]["content"] == "新提示词"
+
+
+def test_deferred_system_prompt_applies_at_next_turn_without_budget(tmp_path):
+    dialogue, _ = make_dialogue(tmp_path)
+    dialogue.put(Message(role="system", content="旧提示词"))
+    add_turn(dialogue, "问题", "回答")
+    assert dialogue.replace_system_prompt("新提示词", defer=True)
+    # 这一轮的后续消息（如工具结果）仍用旧前缀
+    dialogue.put(Message(role="assistant", content="补充"))
+    assert dialogue.get_llm_dialogue()[0]["content"] == "旧提示词"
+    dialogue.put(Message(role="user", content="下一个问题"))
+    assert dialogue.get_llm_dialogue()[0]["content"] == "新提示词"
+
+
+def test_deferred_system_prompt_applies_after_turns_without_slide(tmp_path):
+    dialogue, evicted = make_dialogue(tmp_path, max_tokens=10000, max_deferred_turns=2)
+    dialogue.put(Message(role="system", content="旧提示词"))
+    add_turn(dialogue, "问题", "回答")
+    dialogue.replace_system_prompt("新提示词", defer=True)
+    for i in range(2):
+        add_turn(dialogue, f"第{i}个问题", "回答")
+        assert dialogue.get_llm_dialogue()[0]["content"] == "旧提示词"
+    add_turn(dialogue, "第三个问题", "回答")
+    assert evicted == []
+    assert dialogue.get_llm_dialogue()[0]["content"] == "新提示词"
+    assert dialogue.token_count() == sum(dialogue._tokens)
+
+
+def test_log_is_appended_and_compacted(tmp_path):
+    dialogue, _ = make_dialogue(tmp_path, compact_every=2)
+    add_turn(dialogue, "你好", "你好呀")
+    dialogue.dump_dialogue()
+    with open(dialogue.log_file, "ab") as file:
+        file.write(b'{"role": "user", "con')
+    add_turn(dialogue, "在吗", "在")
+    dialogue.dump_dialogue()
+    records, _ = read_jsonl(dialogue.log_file)
+    assert [r["content"] for r in records] == ["你好", "你好呀", "在吗", "在"]
+    with open(dialogue.log_file, "rb") as file:
+        assert file.read().count(b"\n") == 4
@@ -0,0 +1,49 @@
+import numpy as np
+
+from vad import EnergyGate
+
+
+def tone(rms, n=512, freq=200, rate=16000):
+    t = np.arange(n) / rate
+    return (np.sin(2 * np.pi * freq * t) * rms * np.sqrt(2)).astype(np.float32)
+
+
+def noise(rms, n=512, seed=0):
+    return (np.random.default_rng(seed).standard_normal(n) * rms).astype(np.float32)
+
+
+def test_features():
+    rms, zcr = EnergyGate.features(tone(0.1))
+    assert abs(rms - 0.1) < 0.005
+    assert zcr < 0.05
+    _, zcr = EnergyGate.features(noise(0.1))
+    assert zcr > 0.35
+
+
+def test_quiet_frames_are_skipped_and_speech_passes():
+    gate = EnergyGate({"hangover_frames": 0})
+    assert gate.is_silent(tone(0.001))
+    assert not gate.is_silent(tone(0.1))
+
+
+def test_hangover_keeps_feeding_model_after_speech():
+    gate = EnergyGate({"hangover_frames": 2})
+    assert not gate.is_silent(tone(0.1))
+    assert [gate.is_silent(tone(0.001)) for _ in range(3)] == [False, False, True]
+
+
+def test_low_energy_hiss_is_treated_as_noise():
+    gate = EnergyGate({"hangover_frames": 0, "min_rms": 0.01, "energy_ratio": 1.0})
+    # 能量超过门限但不到两倍，过零率高
+    assert gate.is_silent(noise(0.015))
+    assert not gate.is_silent(tone(0.015))
+
+
+def test_noise_floor_drops_fast_and_rises_slowly():
+    gate = EnergyGate({"hangover_frames": 0, "min_rms": 0.001, "adapt_rate": 0.05})
+    gate.noise_floor = 0.01
+    gate.update_noise(0.002)
+    assert gate.noise_floor < 0.007
+    floor = gate.noise_floor
+    gate.update_noise(0.02)
+    assert floor < gate.noise_floor < floor + 0.001
@@ -0,0 +1,27 @@
+import pytest
+
+pytest.importorskip("openai")
+pytest.importorskip("httpx")
+
+from llm import get_transport  # noqa: E402
+
+
+def test_later_caller_widens_shared_pool():
+    url = "http://127.0.0.1:9/widen-test"
+    first = get_transport(url, "key")
+    client = first.client
+    second = get_transport(url, "key", max_connections=32, timeout=60)
+    assert second is first
+    assert first.max_connections == 32
+    # 超时取较大的一方，不会被后来者调小
+    assert first.timeout == 120
+    assert first.client is not client
+
+
+def test_same_or_smaller_limits_keep_client():
+    url = "http://127.0.0.1:9/keep-test"
+    transport = get_transport(url, "key", max_connections=16)
+    client = transport.client
+    get_transport(url, "key", max_connections=8)
+    get_transport(url, "key")
+    assert transport.client is client and transport.max_connections == 16
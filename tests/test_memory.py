@@ -0,0 +1,53 @@
+import pytest
+
+pytest.importorskip("openai")
+
+from dialogue import Dialogue, Message  # noqa: E402
+from memory import Memory  # noqa: E402
+
+
+@pytest.fixture
+def memory(tmp_path):
+    memory = Memory({"dialogue_history_path": str(tmp_path), "memory_file": str(tmp_path / "memory.json"),
+                     "model_name": "test", "api_key": "test", "url": "http://127.0.0.1:9/v1"})
+    memory.summarized = []
+    memory._summarize = lambda history: memory.summarized.append(history) or "摘要"
+    return memory
+
+
+def write_log(tmp_path, turns, compact=False):
+    dialogue = Dialogue(str(tmp_path))
+    dialogue.current_time = "2024-01-01 10:00:00"
+    for user, assistant in turns:
+        dialogue.put(Message(role="user", content=user))
+        dialogue.put(Message(role="assistant", content=assistant))
+        dialogue.dump_dialogue()
+    if compact:
+        dialogue.compact()
+    return dialogue
+
+
+def test_log_is_summarized_incrementally_across_compaction(tmp_path, memory):
+    dialogue = write_log(tmp_path, [("你好", "你好呀")])
+    memory.read_dialogue_log(dialogue.log_file)
+    with open(dialogue.log_file, "ab") as file:
+        file.write(b'{"broken')
+    dialogue.put(Message(role="user", content="在吗"))
+    dialogue.dump_dialogue()
+    # 整理后文件被重写，字节位置改变，记录序号不变
+    dialogue.compact()
+    memory.read_dialogue_log(dialogue.log_file)
+    memory.read_dialogue_log(dialogue.log_file)
+    assert memory.summarized == ["user: 你好\nassistant: 你好呀", "user: 在吗"]
+
+
+def test_folded_turns_are_skipped_at_startup(tmp_path, memory):
+    dialogue = write_log(tmp_path, [("一", "1"), ("二", "2")])
+    folded = [{"role": "user", "content": "一"}, {"role": "assistant", "content": "1"}]
+    memory._fold_dialogue((folded, dialogue.log_file, 2))
+    memory.read_dialogue_log(dialogue.log_file)
+    assert memory.summarized == ["user: 一\nassistant: 1", "user: 二\nassistant: 2"]
+    # 启动时已经总结过的对话再滑出窗口也不重复并入
+    memory._fold_dialogue(([{"role": "user", "content": "二"}, {"role": "assistant", "content": "2"}],
+                           dialogue.log_file, 4))
+    assert len(memory.summarized) == 2
@@ -0,0 +1,50 @@
+import os
+
+import numpy as np
+
+from audio import AudioStream, PCMAudio
+from player import AbstractPlayer
+
+
+class FilePlayer(AbstractPlayer):
+    """只能播放文件的播放器，记录播放时文件是否存在"""
+
+    def __init__(self):
+        self.played = []
+        super().__init__()
+
+    def do_playing(self, audio_file):
+        self.played.append((audio_file, os.path.isfile(audio_file)))
+
+
+def make_audio():
+    return PCMAudio(np.zeros(160, dtype=np.float32), 16000)
+
+
+def test_temp_files_are_removed_after_playback():
+    player = FilePlayer()
+    stream = AudioStream()
+    stream.put(make_audio())
+    stream.close()
+    player.play(make_audio())
+    player.play(stream)
+    player.play_queue.join()
+    player.shutdown()
+    assert len(player.played) == 2
+    for path, existed in player.played:
+        assert existed
+        assert not os.path.exists(path)
+
+
+def test_temp_file_is_removed_when_playback_fails():
+    class FailingPlayer(FilePlayer):
+        def do_playing(self, audio_file):
+            super().do_playing(audio_file)
+            raise RuntimeError("设备不可用")
+
+    player = FailingPlayer()
+    player.play(make_audio())
+    player.play_queue.join()
+    player.shutdown()
+    path, _ = player.played[0]
+    assert not os.path.exists(path)
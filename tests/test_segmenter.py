@@ -0,0 +1,72 @@
+from segmenter import SentenceSegmenter, clean_for_tts, speech_units
+
+
+def segment(text, rtf=0.5, step=1, **config):
+    """按 step 个字符一个 token 喂给分句器，返回全部文本段"""
+    segmenter = SentenceSegmenter(config, rtf=lambda: rtf)
+    segments = []
+    for i in range(0, len(text), step):
+        segments += segmenter.feed(text[i:i + step])
+    return segments + segmenter.flush()
+
+
+def test_first_segment_is_short_clause():
+    segments = segment("哼，你终于想起我了？今天天气不错，我们出去走走吧。")
+    assert segments[0] == "哼，你终于想起我了？"
+
+
+def test_segments_keep_all_text():
+    text = "今天气温是二十度，比昨天高一点。晚上可能下雨，记得带伞。明天一起去公园吧！"
+    assert "".join(segment(text)) == text
+
+
+def test_later_segments_grow_with_fast_tts():
+    text = "你好呀，" + "这是一段比较长的回复内容，" * 8
+    fast = segment(text, rtf=0.1)
+    slow = segment(text, rtf=1.0)
+    assert len(fast) < len(slow)
+
+
+def test_numbers_are_not_split():
+    segments = segment("我算了一下，总共是1,000元，平均每人3.14元，会议10:30开始。")
+    joined = "|".join(segments)
+    assert "1,000" in joined and "3.14" in joined and "10:30" in joined
+
+
+def test_abbreviations_are_not_split():
+    segments = segment("Hello there. Mr. Smith said e.g. this works fine. Then we left.", min_units=3)
+    assert all(not s.endswith("Mr.") and not s.endswith("e.g.") for s in segments)
+
+
+def test_english_words_are_not_split_on_forced_cut():
+    segments = segment("supercalifragilistic expialidocious wonderful amazing fantastic great " * 2, step=3)
+    words = set("supercalifragilistic expialidocious wonderful amazing fantastic great".split())
+    for s in segments:
+        assert set(s.split()) <= words
+
+
+def test_numbered_list_markers_stay_with_their_item():
+    text = "步骤如下：\n1. 打开设置页面\n2. 点击**网络**选项\n3. 选择无线网络并输入密码。"
+    segments = segment(text, rtf=0.9)
+    assert all(not s.rstrip().endswith(("2.", "3.")) for s in segments)
+    assert "点击网络选项" in "".join(segments)
+    assert "打开设置页面 2" not in "".join(segments)
+
+
+def test_bullet_markers_are_removed():
+    segments = segment("注意事项：\n- 带好钥匙\n- 关好门窗\n* 关掉煤气。")
+    joined = " ".join(segments)
+    assert "-" not in joined and "*" not in joined
+    assert "带好钥匙" in joined and "关掉煤气" in joined
+
+
+def test_clean_for_tts_strips_markdown_and_emoji():
+    assert clean_for_tts("## 标题\n**重点**内容😄 [链接](http://a.b)") == "标题 重点内容 链接"
+
+
+def test_emoji_only_segment_is_dropped():
+    assert segment("😄😄😄") == []
+
+
+def test_speech_units_mixed_text():
+    assert speech_units("你好world 3.14") == 4
@@ -0,0 +1,96 @@
+import json
+import os
+
+from audio import AudioStream
+from tracing import LatencyHistogram, Tracer
+
+
+def make_turn(tracer, vad_end=100.0):
+    trace = tracer.start_turn(vad_end)
+    trace.mark("asr_done", when=vad_end + 0.2)
+    trace.mark("llm_first_token", when=vad_end + 0.5)
+    return trace
+
+
+def play(trace, segment, start, end):
+    stream = AudioStream()
+    trace.watch_playback(stream, segment)
+    stream.mark_started(start)
+    stream.mark_finished(end)
+
+
+def test_disabled_tracer_returns_no_trace():
+    assert Tracer({"enabled": False}).start_turn(1.0) is None
+
+
+def test_histogram_percentiles():
+    histogram = LatencyHistogram(window=100)
+    for i in range(1, 101):
+        histogram.add(i / 1000)
+    summary = histogram.summary()
+    assert summary["count"] == 100
+    assert summary["p50_ms"] == 51.0
+    assert summary["p99_ms"] >= 99.0 and summary["max_ms"] == 100.0
+
+
+def test_turn_completes_after_last_playback():
+    tracer = Tracer({"enabled": True})
+    trace = make_turn(tracer)
+    segment = trace.new_segment()
+    trace.mark("tts_start", segment, 100.5)
+    trace.mark("tts_end", segment, 100.7)
+    stream = AudioStream()
+    trace.watch_playback(stream, segment)
+    trace.end_generation()
+    assert tracer.snapshot() == {}
+    stream.mark_started(100.8)
+    stream.mark_finished(102.0)
+    stages = tracer.snapshot()
+    assert stages["asr"]["p50_ms"] == 200.0
+    assert stages["tts"]["count"] == 1
+    assert stages["first_audio"]["p50_ms"] == 800.0
+    assert stages["turn"]["p50_ms"] == 2000.0
+
+
+def test_filler_counts_for_perceived_latency_only():
+    tracer = Tracer({"enabled": True})
+    trace = make_turn(tracer)
+    filler = AudioStream()
+    trace.watch_filler(filler)
+    filler.mark_started(100.3)
+    play(trace, trace.new_segment(), 101.0, 102.0)
+    trace.end_generation()
+    stages = dict(trace.stages())
+    assert round(stages["perceived_audio"], 3) == 0.3
+    assert round(stages["first_audio"], 3) == 1.0
+
+
+def test_playback_gap_between_segments():
+    tracer = Tracer({"enabled": True})
+    trace = make_turn(tracer)
+    play(trace, trace.new_segment(), 101.0, 102.0)
+    play(trace, trace.new_segment(), 102.5, 103.0)
+    gaps = [seconds for stage, seconds in trace.stages() if stage == "playback_gap"]
+    assert [round(g, 3) for g in gaps] == [0.5]
+
+
+def test_interrupted_turn_completes_without_waiting():
+    tracer = Tracer({"enabled": True})
+    trace = make_turn(tracer)
+    trace.watch_playback(AudioStream(), trace.new_segment())
+    trace.end_generation(interrupted=True)
+    assert "turn" not in tracer.snapshot()
+    assert tracer.snapshot()["asr"]["count"] == 1
+
+
+def test_trace_file_is_rotated(tmp_path):
+    trace_file = str(tmp_path / "traces.jsonl")
+    tracer = Tracer({"enabled": True, "trace_file": trace_file, "max_trace_mb": 0.0005})
+    for _ in range(20):
+        make_turn(tracer).end_generation()
+    tracer.shutdown()
+    assert os.path.isfile(trace_file + ".1")
+    assert os.path.getsize(trace_file) < 2 * 1024
+    with open(trace_file, encoding="utf-8") as file:
+        for line in file:
+            assert json.loads(line)["events"][0]["name"] == "vad_end"
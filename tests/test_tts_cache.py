@@ -0,0 +1,101 @@
+import os
+
+import numpy as np
+
+from audio import PCMAudio
+from tts import CachedTTS, TTSCache
+
+
+def make_audio(n, value=0.1):
+    return PCMAudio(np.full(n, value, dtype=np.float32), 16000)
+
+
+class FakeEngine:
+    voice = "zf_001"
+    speed = 1
+
+    def __init__(self):
+        self.calls = []
+
+    def to_audio(self, text):
+        self.calls.append(text)
+        return make_audio(160)
+
+
+def test_memory_tier_evicts_least_recently_used(tmp_path):
+    # 每段 4000 字节，内存层只放得下两段
+    cache = TTSCache({"memory_mb": 8000 / 1024 / 1024, "cache_dir": str(tmp_path)})
+    cache._remember("a", make_audio(1000))
+    cache._remember("b", make_audio(1000))
+    assert cache.get("a") is not None
+    cache._remember("c", make_audio(1000))
+    assert list(cache._memory) == ["a", "c"]
+    assert cache._memory_used == 8000
+
+
+def test_disk_tier_survives_restart(tmp_path):
+    config = {"cache_dir": str(tmp_path)}
+    cache = TTSCache(config)
+    key = cache.key(FakeEngine(), "你好")
+    cache.put(key, make_audio(160, 0.5))
+
+    restarted = TTSCache(config)
+    audio = restarted.get(key)
+    assert audio is not None and audio.sample_rate == 16000
+    assert np.allclose(audio.samples, 0.5)
+    assert restarted.hits == 1
+
+
+def npz_size(tmp_path):
+    probe = TTSCache({"cache_dir": str(tmp_path / "probe")})
+    probe.put("00" + "0" * 62, make_audio(160))
+    return probe._disk_used
+
+
+def test_disk_tier_evicts_least_recently_used(tmp_path):
+    size = npz_size(tmp_path)
+    cache = TTSCache({"cache_dir": str(tmp_path / "cache"), "disk_mb": (size * 2.5) / 1024 / 1024,
+                      "memory_mb": 0})
+    keys = [f"{i:02d}" + "0" * 62 for i in range(3)]
+    cache.put(keys[0], make_audio(160))
+    cache.put(keys[1], make_audio(160))
+    # 磁盘命中让 keys[0] 变为最近使用，写入第三条时淘汰 keys[1]
+    cache._memory.clear()
+    assert cache.get(keys[0]) is not None
+    cache.put(keys[2], make_audio(160))
+    remaining = sorted(p.name[:2] for p in (tmp_path / "cache").rglob("*.npz"))
+    assert remaining == ["00", "02"]
+    assert cache._disk_used == 2 * size
+
+
+def test_disk_index_is_loaded_in_mtime_order_and_skips_temp_files(tmp_path):
+    size = npz_size(tmp_path)
+    config = {"cache_dir": str(tmp_path / "cache")}
+    cache = TTSCache(config)
+    keys = [f"{i:02d}" + "0" * 62 for i in range(2)]
+    for key in keys:
+        cache.put(key, make_audio(160))
+    # 写入先后在同一 mtime 精度内，显式设置访问顺序：keys[1] 更旧
+    os.utime(cache._disk_path(keys[0]), (2000, 2000))
+    os.utime(cache._disk_path(keys[1]), (1000, 1000))
+    in_flight = cache._disk_path(keys[0]) + ".abc" + TTSCache.TMP_SUFFIX
+    with open(in_flight, "wb") as file:
+        file.write(b"partial")
+
+    restarted = TTSCache(dict(config, disk_mb=(size * 1.5) / 1024 / 1024))
+    assert list(restarted._disk) == [keys[1], keys[0]]
+    assert restarted._disk_used == 2 * size
+    restarted.put("02" + "0" * 62, make_audio(160))
+    assert list(restarted._disk) == ["02" + "0" * 62]
+    # 其他写入者的临时文件不受影响
+    assert os.path.exists(in_flight)
+
+
+def test_cached_tts_normalizes_text_and_skips_long_text(tmp_path):
+    engine = FakeEngine()
+    tts = CachedTTS(engine, {"cache_dir": str(tmp_path), "max_text_length": 4})
+    tts.to_audio("你好")
+    tts.to_audio(" 你好 ")
+    tts.to_audio("这一句太长了")
+    tts.to_audio("这一句太长了")
+    assert engine.calls == ["你好", "这一句太长了", "这一句太长了"]
@@ -0,0 +1,119 @@
+import threading
+import time
+
+import numpy as np
+
+from audio import PCMAudio
+from tts_scheduler import TTSScheduler
+from utils import CancelToken
+
+
+class FakeEngine:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.texts = []
+
+    def to_tts_stream(self, text):
+        self.texts.append(text)
+        time.sleep(self.delay)
+        yield PCMAudio(np.full(160, len(self.texts), dtype=np.float32), 16000)
+
+
+class FakePlayer:
+    """只记录入队顺序，由测试决定何时"播完" """
+
+    def __init__(self):
+        self.streams = []
+
+    def play(self, stream):
+        self.streams.append(stream)
+
+    def finish(self, stream):
+        stream.join()
+        stream.mark_finished(time.monotonic())
+
+
+def wait_until(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.005)
+    return True
+
+
+def test_streams_are_queued_in_submit_order():
+    player = FakePlayer()
+    scheduler = TTSScheduler(FakeEngine(), player, {"max_pending": 8})
+    jobs = [scheduler.submit(f"第{i}句") for i in range(5)]
+    assert player.streams == [job.stream for job in jobs]
+    for job in jobs:
+        assert job.stream.join() is not None
+    scheduler.shutdown()
+
+
+def test_slot_is_held_until_playback_finishes():
+    player = FakePlayer()
+    scheduler = TTSScheduler(FakeEngine(), player, {"max_pending": 2})
+    first = scheduler.submit("一")
+    scheduler.submit("二")
+    assert wait_until(lambda: first.stream.closed)
+
+    blocked = threading.Event()
+    submitted = []
+
+    def submit_third():
+        blocked.set()
+        submitted.append(scheduler.submit("三"))
+
+    thread = threading.Thread(target=submit_third)
+    thread.start()
+    blocked.wait()
+    time.sleep(0.1)
+    # 两句都已合成完，但还没播放，第三句仍要等待
+    assert submitted == []
+    player.finish(first.stream)
+    thread.join(timeout=2)
+    assert submitted and submitted[0] is not None
+    scheduler.shutdown()
+
+
+def test_cancel_releases_slots_and_rejects_cancelled_turn():
+    player = FakePlayer()
+    scheduler = TTSScheduler(FakeEngine(delay=0.05), player, {"max_pending": 2})
+    token = CancelToken()
+    jobs = [scheduler.submit(text, token) for text in ("一", "二")]
+    token.cancel()
+    scheduler.cancel()
+    assert all(job.cancelled for job in jobs)
+    assert scheduler.pending_count() == 0
+    assert scheduler.submit("三", token) is None
+    # 名额已归还，新一轮可以立即提交
+    assert scheduler.submit("四", CancelToken()) is not None
+    scheduler.shutdown()
+
+
+def test_rtf_is_measured():
+    player = FakePlayer()
+    scheduler = TTSScheduler(FakeEngine(delay=0.02), player, {"initial_rtf": 1.0, "rtf_smoothing": 1.0})
+    job = scheduler.submit("一")
+    job.stream.join()
+    # 0.01 秒的音频合成耗时约 0.02 秒
+    assert wait_until(lambda: scheduler.rtf != 1.0)
+    assert scheduler.rtf > 1.0
+    scheduler.shutdown()
+
+
+def test_prewarm_runs_in_background_and_yields_to_live_jobs():
+    engine = FakeEngine()
+    engine.to_audio = lambda text: engine.texts.append(text) or PCMAudio(np.zeros(160, dtype=np.float32), 16000)
+    player = FakePlayer()
+    scheduler = TTSScheduler(engine, player, {"max_pending": 8})
+    warmed = []
+    job = scheduler.submit("对话")
+    scheduler.prewarm(["嗯", "好的"], lambda text, audio: warmed.append(text))
+    assert wait_until(lambda: warmed == ["嗯", "好的"])
+    # 对话句子先于预热合成
+    assert engine.texts[0] == "对话"
+    assert job.stream.join() is not None
+    scheduler.shutdown()
@@ -0,0 +1,35 @@
+import json
+
+from utils import append_jsonl, read_jsonl
+
+
+def test_read_jsonl_leaves_partial_line_for_next_read(tmp_path):
+    path = tmp_path / "log.jsonl"
+    append_jsonl(str(path), [{"n": 1}])
+    with open(path, "ab") as file:
+        file.write(b'{"n": 2')
+    records, offset = read_jsonl(str(path))
+    assert records == [{"n": 1}]
+    assert offset == len(json.dumps({"n": 1})) + 1
+
+    with open(path, "ab") as file:
+        file.write(b'}\n')
+    records, offset = read_jsonl(str(path), offset)
+    assert records == [{"n": 2}]
+    assert offset == path.stat().st_size
+
+
+def test_read_jsonl_skips_corrupt_lines(tmp_path, caplog):
+    path = tmp_path / "log.jsonl"
+    path.write_bytes(b'{"n": 1}\nnot json\n\n{"n": 2}\n')
+    records, _ = read_jsonl(str(path))
+    assert records == [{"n": 1}, {"n": 2}]
+    assert "跳过损坏的日志行" in caplog.text
+
+
+def test_append_jsonl_does_not_glue_onto_partial_line(tmp_path):
+    path = tmp_path / "log.jsonl"
+    path.write_bytes(b'{"n": 1')
+    append_jsonl(str(path), [{"n": 2}])
+    records, _ = read_jsonl(str(path))
+    assert records == [{"n": 2}]
@@ -0,0 +1,78 @@
+import os
+
+import numpy as np
+
+from vector_index import VectorIndex
+
+
+def split(text):
+    return [line for line in text.splitlines() if line.strip()]
+
+
+class FakeEmbedder:
+    """按文本内容确定的归一化向量，记录每次真正编码的文本"""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, texts):
+        self.calls.append(list(texts))
+        vectors = np.array([[len(t), sum(map(ord, t)) % 97 + 1, 1.0] for t in texts], dtype=np.float32)
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def write(path, text, mtime=None):
+    path.write_text(text, encoding="utf-8")
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+
+
+def data_files(index_dir):
+    return sorted(name for name in os.listdir(index_dir) if name != "manifest.json")
+
+
+def test_update_only_embeds_changed_documents(tmp_path):
+    docs, index_dir = tmp_path / "docs", tmp_path / "index"
+    docs.mkdir()
+    write(docs / "a.txt", "苹果\n香蕉")
+    write(docs / "b.txt", "猫\n狗")
+    embed = FakeEmbedder()
+    index = VectorIndex(str(index_dir), {"model": "fake"})
+    assert index.update(str(docs), "*.txt", split, embed) == (2, 0)
+    assert len(index) == 4
+
+    # 未变化时不重新编码
+    assert index.update(str(docs), "*.txt", split, embed) == (0, 0)
+    # 只改 mtime，内容哈希不变
+    write(docs / "a.txt", "苹果\n香蕉", mtime=1)
+    assert index.update(str(docs), "*.txt", split, embed) == (0, 0)
+    # 修改的文档里未变化的分块复用旧向量，删除的文档丢弃对应行
+    write(docs / "a.txt", "苹果\n橙子")
+    os.remove(docs / "b.txt")
+    assert index.update(str(docs), "*.txt", split, embed) == (1, 1)
+    assert embed.calls[-1] == ["橙子"]
+    assert [c["text"] for c in index.chunks] == ["苹果", "橙子"]
+    assert data_files(index_dir) == ["chunks-2.jsonl", "embeddings-2.npy"]
+
+    reloaded = VectorIndex(str(index_dir), {"model": "fake"})
+    assert [c["text"] for c in reloaded.chunks] == ["苹果", "橙子"]
+    chunk, score = reloaded.search(embed(["橙子"])[0], k=1)[0]
+    assert chunk == {"text": "橙子", "source": "a.txt"} and score > 0.99
+
+
+def test_signature_change_rebuilds_and_removes_old_files(tmp_path):
+    docs, index_dir = tmp_path / "docs", tmp_path / "index"
+    docs.mkdir()
+    write(docs / "a.txt", "苹果")
+    index = VectorIndex(str(index_dir), {"model": "old"})
+    index.update(str(docs), "*.txt", split, FakeEmbedder())
+    write(docs / "a.txt", "苹果\n香蕉")
+    index.update(str(docs), "*.txt", split, FakeEmbedder())
+    assert data_files(index_dir) == ["chunks-2.jsonl", "embeddings-2.npy"]
+
+    rebuilt = VectorIndex(str(index_dir), {"model": "new"})
+    assert len(rebuilt) == 0
+    embed = FakeEmbedder()
+    assert rebuilt.update(str(docs), "*.txt", split, embed) == (1, 0)
+    assert embed.calls == [["苹果", "香蕉"]]
+    assert data_files(index_dir) == ["chunks-3.jsonl", "embeddings-3.npy"]
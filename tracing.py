@@ -0,0 +1,270 @@
+import itertools
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from collections import defaultdict, deque
+
+from utils import append_jsonl, write_json_file
+
+logger = logging.getLogger(__name__)
+
+
+class LatencyHistogram:
+    """保留最近 window 个样本（秒），导出时再排序求分位数，记录本身只是一次 append"""
+
+    def __init__(self, window=2048):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+        self.count += 1
+
+    def summary(self):
+        values = sorted(self.samples)
+        if not values:
+            return {"count": self.count}
+
+        def percentile(p):
+            return round(values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))] * 1000, 1)
+
+        return {"count": self.count, "p50_ms": percentile(50), "p95_ms": percentile(95),
+                "p99_ms": percentile(99), "max_ms": round(values[-1] * 1000, 1)}
+
+
+class TurnTrace:
+    """
+    一轮对话的时间点记录，时间均为 time.monotonic()：
+    vad_end、asr_done、filler_start、llm_first_token 每轮一次，tts_start/tts_end、play_start/play_end 按段记录。
+    生成结束且所有段播放完后交给 Tracer 汇总。
+    """
+
+    def __init__(self, turn_id, tracer):
+        self.turn_id = turn_id
+        self.tracer = tracer
+        self.events = []
+        self.interrupted = False
+        self._segments = itertools.count()
+        self._open = 0
+        self._generating = True
+        self._done = False
+        self._lock = threading.Lock()
+
+    def mark(self, name, segment=None, when=None):
+        self.events.append((name, segment, when if when is not None else time.monotonic()))
+
+    def mark_once(self, name, when=None):
+        if not any(event[0] == name for event in self.events):
+            self.mark(name, when=when)
+
+    def new_segment(self):
+        return next(self._segments)
+
+    def watch_filler(self, stream):
+        """记录填充语开始发声的时刻，不计入回复的段"""
+        stream.on_start(lambda when: self.mark_once("filler_start", when=when))
+
+    def watch_playback(self, stream, segment):
+        """记录一段音频的播放开始和结束"""
+        with self._lock:
+            self._open += 1
+        stream.on_start(lambda when: self.mark("play_start", segment, when))
+        stream.on_finish(lambda when: self._on_played(segment, when))
+
+    def _on_played(self, segment, when):
+        self.mark("play_end", segment, when)
+        with self._lock:
+            self._open -= 1
+            ready = not self._generating and self._open == 0
+        if ready:
+            self._complete()
+
+    def end_generation(self, interrupted=False):
+        """LLM 输出结束；被打断的轮次没有播完的段，不再等待"""
+        with self._lock:
+            self._generating = False
+            self.interrupted = interrupted
+            ready = interrupted or self._open == 0
+        if ready:
+            self._complete()
+
+    def _complete(self):
+        with self._lock:
+            if self._done:
+                return
+            self._done = True
+        self.tracer.complete(self)
+
+    def stages(self):
+        """把时间点换算成各阶段耗时 [(阶段, 秒)]"""
+        once, segments = {}, defaultdict(dict)
+        for name, segment, when in list(self.events):
+            if segment is None:
+                once.setdefault(name, when)
+            else:
+                segments[segment].setdefault(name, when)
+        result = []
+        vad_end, asr_done = once.get("vad_end"), once.get("asr_done")
+        first_token = once.get("llm_first_token")
+        if vad_end is not None and asr_done is not None:
+            result.append(("asr", asr_done - vad_end))
+        if asr_done is not None and first_token is not None:
+            result.append(("llm_first_token", first_token - asr_done))
+        first_audio = last_end = None
+        for segment in sorted(segments):
+            times = segments[segment]
+            if "tts_start" in times and "tts_end" in times:
+                result.append(("tts", times["tts_end"] - times["tts_start"]))
+            start, end = times.get("play_start"), times.get("play_end")
+            if start is None:
+                continue
+            if first_audio is None:
+                first_audio = start
+            elif last_end is not None:
+                # 上一段播完到这一段开始的空档，大于 0 说明合成跟不上播放
+                result.append(("playback_gap", max(0.0, start - last_end)))
+            if end is not None:
+                result.append(("playback", end - start))
+                last_end = end
+        if vad_end is not None and first_audio is not None:
+            # 真实延迟：到回复本身的第一个采样
+            result.append(("first_audio", first_audio - vad_end))
+        heard = [t for t in (once.get("filler_start"), first_audio) if t is not None]
+        if vad_end is not None and heard:
+            # 感知延迟：到用户听到的第一个采样，填充语先响时以填充语为准
+            result.append(("perceived_audio", min(heard) - vad_end))
+        if vad_end is not None and last_end is not None and not self.interrupted:
+            result.append(("turn", last_end - vad_end))
+        return result
+
+    def to_dict(self):
+        base = min((when for _, _, when in self.events), default=0.0)
+        return {"turn_id": self.turn_id, "interrupted": self.interrupted,
+                "events": [{"name": name, "segment": segment, "t_ms": round((when - base) * 1000, 1)}
+                           for name, segment, when in sorted(self.events, key=lambda e: e[2])],
+                "stages_ms": [(stage, round(seconds * 1000, 1)) for stage, seconds in self.stages()]}
+
+
+class Tracer:
+    """
+    按轮次的端到端延迟追踪：每轮一个 TurnTrace，完成后把各阶段耗时计入直方图。
+    - trace_file：每轮一行 JSONL，含所有时间点和阶段耗时；超过 max_trace_mb 时轮转为 .1，只保留一份旧文件
+    - metrics_file：各阶段 p50/p95/p99 的快照，每轮更新
+    - http_port：可选，在 127.0.0.1 上提供 GET /metrics 和 GET /traces
+    写文件在后台线程进行，对话线程里只有列表追加。
+    """
+
+    def __init__(self, config=None):
+        config = config or {}
+        self.enabled = config.get("enabled", False)
+        self.trace_file = config.get("trace_file")
+        self.metrics_file = config.get("metrics_file")
+        self.max_trace_bytes = int(config.get("max_trace_mb", 16) * 1024 * 1024)
+        self.window = config.get("window", 2048)
+        self.histograms = defaultdict(lambda: LatencyHistogram(self.window))
+        self.recent = deque(maxlen=config.get("recent_traces", 50))
+        self._turn_ids = itertools.count(1)
+        self._session = time.strftime("%Y%m%d%H%M%S")
+        self._lock = threading.Lock()
+        self._writes = queue.Queue()
+        self._writer = None
+        self._server = None
+        if not self.enabled:
+            return
+        if self.trace_file or self.metrics_file:
+            self._writer = threading.Thread(target=self._write_loop, name="trace-writer", daemon=True)
+            self._writer.start()
+        if config.get("http_port"):
+            self._serve(config.get("http_host", "127.0.0.1"), config["http_port"])
+
+    def start_turn(self, vad_end=None):
+        """开始一轮，未启用时返回 None"""
+        if not self.enabled:
+            return None
+        trace = TurnTrace(f"{self._session}-{next(self._turn_ids)}", self)
+        trace.mark("vad_end", when=vad_end)
+        return trace
+
+    def complete(self, trace):
+        stages = trace.stages()
+        with self._lock:
+            for stage, seconds in stages:
+                self.histograms[stage].add(seconds)
+            self.recent.append(trace)
+        logger.debug("轮次 %s 耗时: %s", trace.turn_id,
+                     ", ".join(f"{stage} {seconds * 1000:.0f} ms" for stage, seconds in stages))
+        if self._writer is not None:
+            self._writes.put(trace)
+
+    def snapshot(self):
+        """各阶段的分位数，单位毫秒"""
+        with self._lock:
+            return {stage: histogram.summary() for stage, histogram in self.histograms.items()}
+
+    def recent_traces(self):
+        with self._lock:
+            traces = list(self.recent)
+        return [trace.to_dict() for trace in traces]
+
+    def _write_loop(self):
+        while True:
+            trace = self._writes.get()
+            if trace is None:
+                break
+            try:
+                if self.trace_file:
+                    os.makedirs(os.path.dirname(self.trace_file) or ".", exist_ok=True)
+                    self._rotate()
+                    append_jsonl(self.trace_file, [trace.to_dict()])
+                if self.metrics_file and self._writes.empty():
+                    os.makedirs(os.path.dirname(self.metrics_file) or ".", exist_ok=True)
+                    write_json_file(self.metrics_file, self.snapshot())
+            except Exception as e:
+                logger.error(f"写入延迟追踪数据失败: {e}")
+
+    def _rotate(self):
+        if self.max_trace_bytes <= 0 or not os.path.isfile(self.trace_file):
+            return
+        if os.path.getsize(self.trace_file) >= self.max_trace_bytes:
+            os.replace(self.trace_file, self.trace_file + ".1")
+
+    def _serve(self, host, port):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        tracer = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.startswith("/metrics"):
+                    body = tracer.snapshot()
+                elif self.path.startswith("/traces"):
+                    body = tracer.recent_traces()
+                else:
+                    self.send_error(404)
+                    return
+                data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                logger.debug(format, *args)
+
+        try:
+            self._server = ThreadingHTTPServer((host, port), Handler)
+        except OSError as e:
+            logger.error(f"延迟指标服务启动失败 {host}:{port}: {e}")
+            return
+        threading.Thread(target=self._server.serve_forever, name="trace-http", daemon=True).start()
+        logger.info(f"延迟指标: http://{host}:{port}/metrics")
+
+    def shutdown(self):
+        if self._writer is not None:
+            self._writes.put(None)
+            self._writer.join(timeout=2)
+        if self._server is not None:
+            self._server.shutdown()
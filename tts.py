@@ -1,20 +1,19 @@
 import asyncio
+import hashlib
 import logging
 import os
+import re
 import subprocess
+import threading
 import time
+import unicodedata
 import uuid
-import wave
 from abc import ABC, ABCMeta, abstractmethod
+from collections import OrderedDict
 from datetime import datetime
-import pyaudio
-from pydub import AudioSegment
-from gtts import gTTS
-import edge_tts
-import ChatTTS
-import torch
-import torchaudio
-import soundfile as sf
+import numpy as np
+
+from audio import PCMAudio
 
 logger = logging.getLogger(__name__)
 
@@ -22,10 +21,36 @@ logger = logging.getLogger(__name__)
 class AbstractTTS(ABC):
     __metaclass__ = ABCMeta
 
+    # 是否支持一次合成多句（to_audio_batch），调度器据此决定是否做微批
+    supports_batch = False
+
     @abstractmethod
     def to_tts(self, text):
         pass
 
+    def to_audio(self, text):
+        """
+        合成音频交给播放器：能直接输出 PCM 的引擎返回 PCMAudio，不经过磁盘；
+        默认退回 to_tts 的文件路径
+        """
+        return self.to_tts(text)
+
+    def to_audio_batch(self, texts):
+        """一次合成多句，按顺序返回每句的音频；默认逐句合成"""
+        return [self.to_audio(text) for text in texts]
+
+    def to_tts_stream(self, text):
+        """
+        流式合成，逐块 yield PCMAudio，播放器收到第一块即可开始播放；
+        默认整句合成后作为一块返回
+        """
+        audio = self.to_audio(text)
+        if audio is None:
+            return
+        if not isinstance(audio, PCMAudio):
+            audio = PCMAudio.from_file(audio)
+        yield audio
+
 
 class GTTS(AbstractTTS):
     def __init__(self, config):
@@ -41,6 +66,7 @@ class GTTS(AbstractTTS):
         logger.debug(f"执行时间: {execution_time:.2f} 秒")
 
     def to_tts(self, text):
+        from gtts import gTTS
         tmpfile = self._generate_filename(".aiff")
         try:
             start_time = time.time()
@@ -107,6 +133,7 @@ class EdgeTTS(AbstractTTS):
         logger.debug(f"Execution Time: {execution_time:.2f} seconds")
 
     async def text_to_speak(self, text, output_file):
+        import edge_tts
         print(f"正在转换的tts：{text}")
         communicate = edge_tts.Communicate(text, voice=self.voice)  # Use your preferred voice
         print(f"转换的tts：{text}")
@@ -125,7 +152,10 @@ class EdgeTTS(AbstractTTS):
 
 
 class CHATTTS(AbstractTTS):
+    supports_batch = True
+
     def __init__(self, config):
+        import ChatTTS
         self.output_file = config.get("output_file", ".")
         self.chat = ChatTTS.Chat()
         self.chat.load(compile=False)  # Set to True for better performance
@@ -139,24 +169,51 @@ class CHATTTS(AbstractTTS):
         execution_time = end_time - start_time
         logger.debug(f"Execution Time: {execution_time:.2f} seconds")
 
+    def _infer(self, texts):
+        import ChatTTS
+        params_infer_code = ChatTTS.Chat.InferCodeParams(
+            spk_emb=self.rand_spk,  # add sampled speaker
+            temperature=.3,  # using custom temperature
+            top_P=0.7,  # top P decode
+            top_K=20,  # top K decode
+        )
+        params_refine_text = ChatTTS.Chat.RefineTextParams(
+            prompt='[oral_2][laugh_0][break_6]',
+        )
+        return self.chat.infer(
+            texts,
+            params_refine_text=params_refine_text,
+            params_infer_code=params_infer_code,
+        )
+
+    def to_audio(self, text):
+        start_time = time.time()
+        try:
+            wavs = self._infer([text])
+            self._log_execution_time(start_time)
+            return PCMAudio(wavs[0], 24000)
+        except Exception as e:
+            logger.error(f"Failed to generate TTS audio: {e}")
+            return None
+
+    def to_audio_batch(self, texts):
+        """多句放在同一个 infer 调用里做一次前向"""
+        start_time = time.time()
+        try:
+            wavs = self._infer(list(texts))
+            self._log_execution_time(start_time)
+            return [PCMAudio(wav, 24000) for wav in wavs]
+        except Exception as e:
+            logger.error(f"Failed to generate TTS audio batch: {e}")
+            return [None] * len(texts)
+
     def to_tts(self, text):
         tmpfile = self._generate_filename(".wav")
         start_time = time.time()
         try:
-            params_infer_code = ChatTTS.Chat.InferCodeParams(
-                spk_emb=self.rand_spk,  # add sampled speaker
-                temperature=.3,  # using custom temperature
-                top_P=0.7,  # top P decode
-                top_K=20,  # top K decode
-            )
-            params_refine_text = ChatTTS.Chat.RefineTextParams(
-                prompt='[oral_2][laugh_0][break_6]',
-            )
-            wavs = self.chat.infer(
-                [text],
-                params_refine_text=params_refine_text,
-                params_infer_code=params_infer_code,
-            )
+            wavs = self._infer([text])
+            import torch
+            import torchaudio
             try:
                 torchaudio.save(tmpfile, torch.from_numpy(wavs[0]).unsqueeze(0), 24000)
             except:
@@ -170,6 +227,8 @@ class CHATTTS(AbstractTTS):
 
 
 class KOKOROTTS(AbstractTTS):
+    supports_batch = True
+
     def __init__(self, config):
         from kokoro import KPipeline
         self.output_file = config.get("output_file", ".")
@@ -177,6 +236,7 @@ class KOKOROTTS(AbstractTTS):
         print(f"KOKOROTTS: lang: {self.lang}")
         self.pipeline = KPipeline(lang_code=self.lang)  # <= make sure lang_code matches voice
         self.voice = config.get("voice", "zm_yunyang")
+        self.speed = config.get("speed", 1)
 
     def _generate_filename(self, extension=".wav"):
         return os.path.join(self.output_file, f"tts-{datetime.now().date()}@{uuid.uuid4().hex}{extension}")
@@ -186,24 +246,264 @@ class KOKOROTTS(AbstractTTS):
         execution_time = end_time - start_time
         logger.debug(f"Execution Time: {execution_time:.2f} seconds")
 
-    def to_tts(self, text):
-        tmpfile = self._generate_filename(".wav")
+    def to_tts_stream(self, text):
+        """KPipeline 每产出一个 (gs, ps, audio) 块就立即交给播放器"""
         start_time = time.time()
+        generator = self.pipeline(
+            text, voice=self.voice,  # <= change voice here
+            speed=self.speed, split_pattern=r'\n+'
+        )
+        for i, (gs, ps, audio) in enumerate(generator):
+            logger.debug(f"KOKOROTTS: i: {i}, gs：{gs}, ps：{ps}, 首块耗时: {time.time() - start_time:.2f} 秒")  # i => index
+            yield PCMAudio(audio, 24000)
+        self._log_execution_time(start_time)
+
+    def to_audio(self, text):
         try:
-            generator = self.pipeline(
-                text, voice=self.voice,  # <= change voice here
-                speed=1, split_pattern=r'\n+'
-            )
-            for i, (gs, ps, audio) in enumerate(generator):
-                logger.debug(f"KOKOROTTS: i: {i}, gs：{gs}, ps：{ps}")  # i => index
-                sf.write(tmpfile, audio, 24000)  # save each audio file
-            self._log_execution_time(start_time)
-            return tmpfile
+            chunks = [audio.samples for audio in self.to_tts_stream(text)]
+            if not chunks:
+                return None
+            return PCMAudio(np.concatenate(chunks), 24000)
         except Exception as e:
-            logger.error(f"Failed to generate TTS file: {e}")
+            logger.error(f"Failed to generate TTS audio: {e}")
+            return None
+
+    def to_audio_batch(self, texts):
+        """
+        多句文本作为一个列表交给 KPipeline，一次调用内完成 G2P 和合成，
+        再按每个结果的 text_index 拆回各句
+        """
+        start_time = time.time()
+        chunks = [[] for _ in texts]
+        try:
+            for result in self.pipeline(list(texts), voice=self.voice, speed=self.speed):
+                index = getattr(result, "text_index", None)
+                if index is None:
+                    # 旧版本 kokoro 没有 text_index，无法拆分，退回逐句合成
+                    return super().to_audio_batch(texts)
+                if result.audio is not None:
+                    chunks[index].append(PCMAudio(result.audio, 24000).samples)
+        except Exception as e:
+            logger.error(f"Failed to generate TTS audio batch: {e}")
+            return [None] * len(texts)
+        self._log_execution_time(start_time)
+        return [PCMAudio(np.concatenate(c), 24000) if c else None for c in chunks]
+
+    def to_tts(self, text):
+        audio = self.to_audio(text)
+        if audio is None:
             return None
+        tmpfile = self._generate_filename(".wav")
+        audio.save(tmpfile)
+        return tmpfile
+
 
 
+class TTSCache:
+    """
+    短语级音频缓存，key 由引擎、音色、语速和归一化后的文本计算得到。
+    内存层按字节数做 LRU 淘汰；磁盘层以 .npz 持久化，重启后仍可命中，
+    启动时扫描一次建立索引并累计占用，之后按访问顺序做 LRU 淘汰，命中时更新文件 mtime，重启后顺序不丢。
+    """
+
+    TMP_SUFFIX = ".tmp.npz"
+
+    def __init__(self, config):
+        self.memory_bytes = int(config.get("memory_mb", 64) * 1024 * 1024)
+        self.cache_dir = config.get("cache_dir", "tmp/tts_cache/")
+        self.disk_bytes = int(config.get("disk_mb", 512) * 1024 * 1024)
+        self.max_text_length = config.get("max_text_length", 40)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._memory = OrderedDict()
+        self._memory_used = 0
+        self._lock = threading.Lock()
+        # 磁盘层索引 key -> 文件字节数，从最久未用到最近使用
+        self._disk = OrderedDict()
+        self._disk_used = 0
+        self._load_disk_index()
+        self.hits = 0
+        self.misses = 0
+
+    def _load_disk_index(self):
+        files = []
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                # 其他写入者尚未完成的临时文件不计入
+                if not name.endswith(".npz") or name.endswith(self.TMP_SUFFIX):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(root, name))
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, name[:-len(".npz")], stat.st_size))
+        for _, key, size in sorted(files):
+            self._disk[key] = size
+            self._disk_used += size
+        if files:
+            logger.info(f"TTS磁盘缓存: {len(files)} 条, {self._disk_used / 1024 / 1024:.1f} MB")
+
+    @staticmethod
+    def normalize(text):
+        text = unicodedata.normalize("NFKC", text)
+        return re.sub(r"\s+", " ", text).strip()
+
+    def key(self, engine, text):
+        parts = (type(engine).__name__, str(getattr(engine, "voice", "")),
+                 str(getattr(engine, "speed", 1)), self.normalize(text))
+        return hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()
+
+    def cacheable(self, text):
+        return 0 < len(self.normalize(text)) <= self.max_text_length
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.npz")
+
+    def _remember(self, key, audio):
+        with self._lock:
+            old = self._memory.pop(key, None)
+            if old is not None:
+                self._memory_used -= old.samples.nbytes
+            self._memory[key] = audio
+            self._memory_used += audio.samples.nbytes
+            while self._memory_used > self.memory_bytes and len(self._memory) > 1:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_used -= evicted.samples.nbytes
+
+    def get(self, key):
+        with self._lock:
+            audio = self._memory.get(key)
+            if audio is not None:
+                self._memory.move_to_end(key)
+                if key in self._disk:
+                    self._disk.move_to_end(key)
+                self.hits += 1
+                return audio
+            on_disk = key in self._disk
+        if on_disk:
+            path = self._disk_path(key)
+            try:
+                with np.load(path) as data:
+                    audio = PCMAudio(data["samples"], int(data["sample_rate"]))
+                os.utime(path)
+                with self._lock:
+                    if key in self._disk:
+                        self._disk.move_to_end(key)
+                self._remember(key, audio)
+                self.hits += 1
+                return audio
+            except Exception as e:
+                logger.error(f"读取TTS缓存失败 {path}: {e}")
+                self._forget_disk(key)
+        self.misses += 1
+        return None
+
+    def put(self, key, audio):
+        self._remember(key, audio)
+        path = self._disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{uuid.uuid4().hex}{self.TMP_SUFFIX}"
+            np.savez(tmp_path, samples=audio.samples, sample_rate=audio.sample_rate)
+            size = os.path.getsize(tmp_path)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.error(f"写入TTS缓存失败 {path}: {e}")
+            return
+        with self._lock:
+            self._disk_used += size - self._disk.pop(key, 0)
+            self._disk[key] = size
+            evicted = []
+            while self._disk_used > self.disk_bytes and len(self._disk) > 1:
+                old_key, old_size = self._disk.popitem(last=False)
+                self._disk_used -= old_size
+                evicted.append(old_key)
+        for old_key in evicted:
+            self._remove_disk_file(old_key)
+
+    def _forget_disk(self, key):
+        with self._lock:
+            size = self._disk.pop(key, None)
+            if size is not None:
+                self._disk_used -= size
+        self._remove_disk_file(key)
+
+    def _remove_disk_file(self, key):
+        try:
+            os.remove(self._disk_path(key))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"删除TTS缓存失败 {key}: {e}")
+
+
+class CachedTTS(AbstractTTS):
+    """包在任意 TTS 引擎外面的缓存层，接口与被包装的引擎一致"""
+
+    def __init__(self, engine, config):
+        self.engine = engine
+        self.cache = TTSCache(config)
+
+    def __getattr__(self, name):
+        return getattr(self.engine, name)
+
+    @property
+    def supports_batch(self):
+        return getattr(self.engine, "supports_batch", False)
+
+    def to_audio_batch(self, texts):
+        """命中缓存的句子直接返回，未命中的一起交给引擎批量合成"""
+        results = [None] * len(texts)
+        misses = []
+        for i, text in enumerate(texts):
+            if self.cache.cacheable(text):
+                results[i] = self.cache.get(self.cache.key(self.engine, text))
+            if results[i] is None:
+                misses.append(i)
+        if misses:
+            audios = self.engine.to_audio_batch([texts[i] for i in misses])
+            for i, audio in zip(misses, audios):
+                if audio is not None and not isinstance(audio, PCMAudio):
+                    audio = PCMAudio.from_file(audio)
+                results[i] = audio
+                if audio is not None and self.cache.cacheable(texts[i]):
+                    self.cache.put(self.cache.key(self.engine, texts[i]), audio)
+        return results
+
+    def to_tts(self, text):
+        return self.engine.to_tts(text)
+
+    def to_audio(self, text):
+        if not self.cache.cacheable(text):
+            return self.engine.to_audio(text)
+        key = self.cache.key(self.engine, text)
+        audio = self.cache.get(key)
+        if audio is not None:
+            return audio
+        audio = self.engine.to_audio(text)
+        if audio is None:
+            return None
+        if not isinstance(audio, PCMAudio):
+            audio = PCMAudio.from_file(audio)
+        self.cache.put(key, audio)
+        return audio
+
+    def to_tts_stream(self, text):
+        if not self.cache.cacheable(text):
+            yield from self.engine.to_tts_stream(text)
+            return
+        key = self.cache.key(self.engine, text)
+        audio = self.cache.get(key)
+        if audio is not None:
+            logger.debug(f"TTS缓存命中: {text}")
+            yield audio
+            return
+        chunks = []
+        for audio in self.engine.to_tts_stream(text):
+            chunks.append(audio)
+            yield audio
+        if chunks:
+            self.cache.put(key, PCMAudio(np.concatenate([c.samples for c in chunks]), chunks[0].sample_rate))
+
 
 def create_instance(class_name, *args, **kwargs):
     # 获取类对象
@@ -215,19 +515,14 @@ def create_instance(class_name, *args, **kwargs):
         raise ValueError(f"Class {class_name} not found")
 
 
-
-
-import sys
-sys.path.append('third_party/Matcha-TTS')
-import numpy as np
-from cosyvoice.cli.cosyvoice import CosyVoice2
-from cosyvoice.utils.file_utils import load_wav
-
-
-
 class CosyVoice2TTS:
     def __init__(self,config):
         """保持与KOKOROTTS完全相同的初始化接口"""
+        # cosyvoice 依赖 Matcha-TTS，只有选用该引擎时才加入路径并导入
+        import sys
+        if 'third_party/Matcha-TTS' not in sys.path:
+            sys.path.append('third_party/Matcha-TTS')
+        from cosyvoice.utils.file_utils import load_wav
         # 硬编码参数（保持项目统一配置）
         self.model_path = "pretrained_models/CosyVoice2-0.5B"
         # self.ref_dir = "./voices"  # 参考语音目录
@@ -247,6 +542,7 @@ class CosyVoice2TTS:
 
     def _init_model(self):
         """模型初始化（对应KPipeline初始化）"""
+        from cosyvoice.cli.cosyvoice import CosyVoice2
         self.model = CosyVoice2(
             self.model_path,
             load_jit=True,
@@ -263,9 +559,7 @@ class CosyVoice2TTS:
                 prompt_speech_16k=self.ref_audio,
                 stream=True,
             )
-            for chunk in generator:
-                audio = chunk['tts_speech'].numpy().T
-                # sf.write(tmpfile, audio, 24000) 
+            for _ in generator:
                 continue
 
 
@@ -276,14 +570,34 @@ class CosyVoice2TTS:
             f"tts-{datetime.now().date()}@{uuid.uuid4().hex}{extension}"
         )
 
-    def _log_execution_time(self, start_time):
-        """完全相同的耗时记录方法"""
-        execution_time = time.time() - start_time
-        logger.debug(f"Execution Time: {execution_time:.2f} seconds")
     def _log_execution_time(self, start_time):
         """相同的耗时日志格式"""
         execution_time = time.time() - start_time
         logger.debug(f"Execution Time: {execution_time:.2f} seconds")
+    def to_tts_stream(self, text):
+        """逐块返回内存中的 PCM，不写文件"""
+        start_time = time.time()
+        generator = self.model.inference_zero_shot(
+            text,
+            prompt_text="今天天气真是太好了，阳光灿烂，心情超级棒！但是，朋友最近的感情问题也让我心痛不已，好像世界末日一样，真的好为她难过哦！",
+            prompt_speech_16k=self.ref_audio,
+            stream=True,
+        )
+        for chunk in generator:
+            yield PCMAudio(chunk['tts_speech'], 24000)
+        self._log_execution_time(start_time)
+
+    def to_audio(self, text):
+        """直接返回内存中的 PCM，不写文件"""
+        try:
+            chunks = [audio.samples for audio in self.to_tts_stream(text)]
+            if not chunks:
+                return None
+            return PCMAudio(np.concatenate(chunks), 24000)
+        except Exception as e:
+            logger.error(f"Failed to generate TTS audio: {str(e)}")
+            return None
+
     def to_tts(self, text):
         """保持完全相同的接口规范"""
         tmpfile = self._generate_filename()
@@ -298,6 +612,7 @@ class CosyVoice2TTS:
                 stream=True,
             )
             
+            import soundfile as sf
             # 保存音频文件
             # audio_chunks = []
             for chunk in generator:
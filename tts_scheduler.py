@@ -0,0 +1,244 @@
+import itertools
+import logging
+import queue
+import threading
+import time
+
+from audio import AudioStream, PCMAudio
+
+logger = logging.getLogger(__name__)
+
+
+class TTSJob:
+    def __init__(self, seq, text, cancel_token=None, trace=None):
+        self.seq = seq
+        self.text = text
+        self.cancel_token = cancel_token
+        self.stream = AudioStream()
+        self._cancelled = False
+        # 所属轮次的延迟追踪和在该轮中的段号
+        self.trace = trace
+        self.segment = trace.new_segment() if trace is not None else None
+
+    def mark(self, name):
+        if self.trace is not None:
+            self.trace.mark(name, self.segment)
+
+    @property
+    def cancelled(self):
+        return self._cancelled or (self.cancel_token is not None and self.cancel_token.is_cancelled())
+
+    def cancel(self):
+        self._cancelled = True
+        self.stream.close()
+
+
+class TTSScheduler:
+    """
+    TTS 专用调度器：
+    - 每个引擎单独限制并发数，避免多个线程同时抢占同一个模型
+    - 提交时音频流即按顺序进入播放队列，保证严格按句子顺序播放
+    - 第 N 句播放时第 N+1 句已在合成，合成结果逐块推给播放器
+    - 尚未播放完的句子数（含已合成、在播放队列里等待的音频）达到 max_pending 时 submit 阻塞，
+      LLM 分段的速度受播放速度约束（背压），取消代替超时丢句
+    - 引擎支持批量合成时，把已排队的多句凑成一批做一次前向（微批）
+    - 预热等后台合成任务也走这里，只在没有待合成句子时执行，不与对话抢占引擎
+    - 持续测量合成的实时率（RTF = 合成耗时 / 音频时长），供分句器决定后续每段的长度
+    """
+
+    def __init__(self, engine, player, config=None):
+        config = config or {}
+        self.engine = engine
+        self.player = player
+        engine_name = type(getattr(engine, "engine", engine)).__name__
+        concurrency = config.get("max_concurrency") or {}
+        self.max_concurrency = concurrency.get(engine_name, 1) if isinstance(concurrency, dict) else concurrency
+        self.max_pending = config.get("max_pending", 4)
+        self.batch_window_ms = config.get("batch_window_ms", 30)
+        self.max_batch_size = config.get("max_batch_size", 4)
+        # 实时率的指数滑动平均，尚未测量时用配置的初始值
+        self.rtf = config.get("initial_rtf", 0.5)
+        self.rtf_smoothing = config.get("rtf_smoothing", 0.3)
+
+        self._seq = itertools.count()
+        self._jobs = queue.Queue()
+        # 低优先级的后台任务（预热缓存、合成填充语），worker 空闲时才执行
+        self._background = queue.Queue()
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._workers = []
+        for i in range(self.max_concurrency):
+            worker = threading.Thread(target=self._worker, name=f"tts-worker-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+        logger.info(f"TTS调度器: 引擎 {engine_name}, 并发 {self.max_concurrency}, 最大排队 {self.max_pending}")
+
+    def submit(self, text, cancel_token=None, trace=None):
+        """提交一句文本，返回 TTSJob；调度器关闭或本轮已被打断时返回 None"""
+        while not self._slots.acquire(timeout=0.05):
+            if self._stop_event.is_set() or (cancel_token is not None and cancel_token.is_cancelled()):
+                return None
+        if cancel_token is not None and cancel_token.is_cancelled():
+            self._slots.release()
+            return None
+        job = TTSJob(next(self._seq), text, cancel_token, trace)
+        with self._lock:
+            self._pending[job.seq] = job
+        # 播放器播完（或流为空、被打断）时才归还名额
+        job.stream.on_finish(lambda _: self._release(job))
+        # 先把流放进播放队列占住顺序，合成完成的块会被播放器直接取走
+        self.player.play(job.stream)
+        self._jobs.put(job)
+        return job
+
+    def prewarm(self, texts, callback=None):
+        """
+        后台合成 texts（引擎带缓存时即写入缓存），合成完一句调用 callback(text, audio)；
+        占用与对话相同的 worker，受同样的并发限制，有对话句子待合成时让路
+        """
+        def synthesize(text):
+            audio = self.engine.to_audio(text)
+            if callback is not None and audio is not None:
+                callback(text, audio)
+
+        for text in texts:
+            self._background.put((synthesize, text))
+
+    def _run_background(self):
+        try:
+            func, text = self._background.get_nowait()
+        except queue.Empty:
+            return
+        try:
+            func(text)
+        except Exception as e:
+            logger.error(f"TTS 后台合成失败 {text}: {e}")
+
+    def _collect_batch(self, job):
+        """
+        取出已在排队的句子凑成一批；只有一句时直接返回，走流式合成不增加首包延迟，
+        已有多句排队时再等待 batch_window_ms 收集后续句子
+        """
+        batch = [job]
+        if not getattr(self.engine, "supports_batch", False) or self.max_batch_size <= 1:
+            return batch
+        deadline = None
+        while len(batch) < self.max_batch_size:
+            try:
+                if deadline is None:
+                    nxt = self._jobs.get_nowait()
+                else:
+                    nxt = self._jobs.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                if deadline is not None or len(batch) == 1 or self.batch_window_ms <= 0:
+                    break
+                deadline = time.monotonic() + self.batch_window_ms / 1000
+                continue
+            if nxt is None:
+                self._jobs.put(None)
+                break
+            if not nxt.cancelled:
+                batch.append(nxt)
+            else:
+                self._finish(nxt)
+        return batch
+
+    def _finish(self, job):
+        """结束一句的合成；名额在播放结束时归还，被取消的句子不会再播放，立即归还"""
+        job.stream.close()
+        if job.cancelled:
+            self._release(job)
+
+    def _release(self, job):
+        """归还一句的排队名额，可重复调用"""
+        with self._lock:
+            if self._pending.pop(job.seq, None) is None:
+                return
+        self._slots.release()
+
+    def _record_rtf(self, elapsed, audio_seconds):
+        # 缓存命中几乎不耗时，不代表引擎的真实速度
+        if audio_seconds <= 0 or elapsed < 0.01:
+            return
+        rtf = elapsed / audio_seconds
+        self.rtf += self.rtf_smoothing * (rtf - self.rtf)
+        logger.debug(f"TTS 实时率: 本句 {rtf:.2f}, 平均 {self.rtf:.2f}")
+
+    def _synthesize_stream(self, job):
+        start = time.monotonic()
+        audio_seconds = 0.0
+        completed = False
+        generator = self.engine.to_tts_stream(job.text)
+        try:
+            for audio in generator:
+                if job.cancelled:
+                    break
+                job.stream.put(audio)
+                if isinstance(audio, PCMAudio):
+                    audio_seconds += audio.duration
+            else:
+                completed = True
+        finally:
+            generator.close()
+        if completed:
+            self._record_rtf(time.monotonic() - start, audio_seconds)
+
+    def _synthesize_batch(self, batch):
+        logger.debug(f"TTS微批合成 {len(batch)} 句")
+        start = time.monotonic()
+        audios = self.engine.to_audio_batch([job.text for job in batch])
+        self._record_rtf(time.monotonic() - start,
+                         sum(audio.duration for audio in audios if isinstance(audio, PCMAudio)))
+        for job, audio in zip(batch, audios):
+            if audio is not None and not job.cancelled:
+                job.stream.put(audio)
+            self._finish(job)
+
+    def _worker(self):
+        while not self._stop_event.is_set():
+            try:
+                job = self._jobs.get(timeout=0.1)
+            except queue.Empty:
+                self._run_background()
+                continue
+            if job is None:
+                break
+            if job.cancelled:
+                self._finish(job)
+                continue
+            batch = self._collect_batch(job)
+            for j in batch:
+                j.mark("tts_start")
+            try:
+                if len(batch) == 1:
+                    self._synthesize_stream(job)
+                else:
+                    self._synthesize_batch(batch)
+            except Exception as e:
+                logger.error(f"TTS 任务出错 {[j.text for j in batch]}: {e}")
+            finally:
+                for j in batch:
+                    j.mark("tts_end")
+                    self._finish(j)
+
+    def pending_count(self):
+        with self._lock:
+            return len(self._pending)
+
+    def cancel(self):
+        """取消所有尚未播放完的句子，播放队列随后由播放器清空，名额立即归还"""
+        with self._lock:
+            jobs = list(self._pending.values())
+        for job in jobs:
+            job.cancel()
+            self._release(job)
+        if jobs:
+            logger.info(f"已取消 {len(jobs)} 个TTS任务")
+
+    def shutdown(self):
+        self._stop_event.set()
+        self.cancel()
+        for _ in self._workers:
+            self._jobs.put(None)
@@ -1,7 +1,15 @@
+import logging
+import os
+import tempfile
+import threading
+import time
+
 import yaml
 import json
 import re
 
+logger = logging.getLogger(__name__)
+
 
 def load_prompt(prompt_path):
     with open(prompt_path, "r", encoding="utf-8") as file:
@@ -19,10 +27,57 @@ def read_json_file(file_path):
             print(f"解析 JSON 时出错: {e}")
             return None
 
+def atomic_write(file_path, text):
+    """先写同目录下的临时文件再替换，写到一半崩溃也不会留下损坏的文件"""
+    directory = os.path.dirname(os.path.abspath(file_path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as file:
+            file.write(text)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
 def write_json_file(file_path, data):
     """将数据写入 JSON 文件"""
-    with open(file_path, 'w', encoding='utf-8') as file:
-        json.dump(data, file, ensure_ascii=False, indent=4)
+    atomic_write(file_path, json.dumps(data, ensure_ascii=False, indent=4))
+
+
+def append_jsonl(file_path, records):
+    """追加若干条记录到 JSONL 文件，每条一行；上次写了一半的行先补换行，不会与新记录粘连"""
+    lines = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records).encode("utf-8")
+    with open(file_path, 'ab+') as file:
+        if file.seek(0, os.SEEK_END) > 0:
+            file.seek(-1, os.SEEK_END)
+            if file.read(1) != b"\n":
+                lines = b"\n" + lines
+        file.write(lines)
+        file.flush()
+
+
+def read_jsonl(file_path, offset=0):
+    """
+    从字节偏移 offset 开始读取 JSONL，返回 (记录列表, 新的偏移)。
+    只消费以换行结尾的完整行，末尾写了一半的行留到下次；无法解析的行跳过。
+    """
+    records = []
+    with open(file_path, 'rb') as file:
+        file.seek(offset)
+        data = file.read()
+    end = data.rfind(b"\n") + 1
+    for line in data[:end].splitlines():
+        if not line.strip():
+            continue
+        try:
+            records.append(json.loads(line))
+        except json.JSONDecodeError:
+            logger.warning(f"跳过损坏的日志行: {file_path}")
+    return records, offset + end
 
 
 def read_config(config_path):
@@ -31,12 +86,6 @@ def read_config(config_path):
     return config
 
 
-def is_segment(tokens):
-    if tokens[-1] in (",", ".", "?", "，", "。", "？", "！", "!", ";", "；", ":", "："):
-        return True
-    else:
-        return False
-
 def is_interrupt(query: str):
     for interrupt_word in ("停一下", "听我说", "不要说了", "stop", "hold on", "excuse me"):
         if query.lower().find(interrupt_word)>=0:
@@ -50,3 +99,22 @@ def extract_json_from_string(input_string):
     if match:
         return match.group(1)  # 返回提取的 JSON 字符串
     return None
+
+
+class CancelToken:
+    """一轮对话的取消令牌，在 LLM、TTS、播放器之间传递，打断时统一取消"""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self.cancelled_at = None
+
+    def cancel(self):
+        if not self._event.is_set():
+            self.cancelled_at = time.monotonic()
+            self._event.set()
+
+    def is_cancelled(self):
+        return self._event.is_set()
+
+    def wait(self, timeout=None):
+        return self._event.wait(timeout)
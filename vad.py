@@ -1,13 +1,9 @@
 import os
-import uuid
-import wave
+import importlib.util
 from abc import ABC, abstractmethod
 import logging
-from datetime import datetime
 
 import numpy as np
-import torch
-from silero_vad import load_silero_vad, VADIterator
 
 logger = logging.getLogger(__name__)
 
@@ -21,9 +17,59 @@ class VAD(ABC):
         pass
 
 
+class EnergyGate:
+    """
+    Silero 之前的能量/过零率预判：明显没有语音的帧直接跳过神经网络。
+    底噪用非语音帧的滑动平均自适应跟踪，下降快、上升慢。
+    """
+
+    def __init__(self, config):
+        self.enabled = config.get("enabled", True)
+        self.energy_ratio = config.get("energy_ratio", 3.0)  # 能量低于 底噪*energy_ratio 视为静音
+        self.min_rms = config.get("min_rms", 0.002)  # 静音门限的下限
+        self.zcr_threshold = config.get("zcr_threshold", 0.35)  # 高过零率且能量偏低视为噪声
+        self.adapt_rate = config.get("adapt_rate", 0.05)
+        self.hangover_frames = config.get("hangover_frames", 8)  # 有能量的帧之后继续送模型的帧数
+        self.noise_floor = self.min_rms
+        self.last_rms = 0.0
+        self.last_silent = False
+        self._hangover = 0
+
+    @staticmethod
+    def features(audio_float32):
+        """返回 (rms, 过零率)"""
+        rms = float(np.sqrt(np.mean(np.square(audio_float32))))
+        signs = np.signbit(audio_float32)
+        zcr = np.count_nonzero(signs[1:] != signs[:-1]) / max(1, len(audio_float32) - 1)
+        return rms, float(zcr)
+
+    def update_noise(self, rms):
+        """用非语音帧更新底噪"""
+        rate = self.adapt_rate if rms > self.noise_floor else 0.5
+        self.noise_floor += rate * (rms - self.noise_floor)
+
+    def is_silent(self, audio_float32):
+        rms, zcr = self.features(audio_float32)
+        self.last_rms = rms
+        threshold = max(self.min_rms, self.noise_floor * self.energy_ratio)
+        silent = rms < threshold or (zcr > self.zcr_threshold and rms < threshold * 2)
+        self.last_silent = silent
+        if not silent:
+            self._hangover = self.hangover_frames
+            return False
+        self.update_noise(rms)
+        if self._hangover > 0:
+            self._hangover -= 1
+            return False
+        return True
+
+
 class SileroVAD(VAD):
     def __init__(self, config):
         print("SileroVAD", config)
+        import torch
+        from silero_vad import load_silero_vad, VADIterator
+        self.torch = torch
         self.model = load_silero_vad()
         self.sampling_rate = config.get("sampling_rate")
         self.threshold = config.get("threshold")
@@ -33,6 +79,12 @@ class SileroVAD(VAD):
                             sampling_rate=self.sampling_rate,
                             min_silence_duration_ms=self.min_silence_duration_ms)
         logger.debug(f"VAD Iterator initialized with model {self.model}")
+        gate_config = config.get("pre_gate") or {}
+        self.gate = EnergyGate(gate_config) if gate_config.get("enabled", False) else None
+        self._gated = False
+        # 统计：总帧数、被预判跳过的帧数
+        self.frames = 0
+        self.skipped_frames = 0
 
     @staticmethod
     def int2float(sound):
@@ -46,7 +98,26 @@ class SileroVAD(VAD):
         try:
             audio_int16 = np.frombuffer(data, dtype=np.int16)
             audio_float32 = self.int2float(audio_int16)
-            vad_output = self.vad_iterator(torch.from_numpy(audio_float32))
+            self.frames += 1
+            loud_rms = None
+            # 未处于说话状态时才允许跳过，保证 end 事件总能由模型判定
+            if self.gate is not None and not self.vad_iterator.triggered:
+                if self.gate.is_silent(audio_float32):
+                    # 跳过模型，但保持 VADIterator 的采样计数与真实时间一致
+                    self.vad_iterator.current_sample += len(audio_float32)
+                    self.skipped_frames += 1
+                    self._gated = True
+                    return None
+                if not self.gate.last_silent:
+                    loud_rms = self.gate.last_rms
+                if self._gated:
+                    # 跳过了一段之后，从干净的模型状态重新开始
+                    self.model.reset_states()
+                    self._gated = False
+            vad_output = self.vad_iterator(self.torch.from_numpy(audio_float32))
+            if loud_rms is not None and not self.vad_iterator.triggered:
+                # 能量过了门限但模型判定不是语音，说明底噪偏高
+                self.gate.update_noise(loud_rms)
             if vad_output is not None:
                 logger.debug(f"VAD output: {vad_output}")
             return vad_output
@@ -62,6 +133,129 @@ class SileroVAD(VAD):
             logger.error(f"Error resetting VAD states: {e}")
 
 
+class SileroVADOnnx(VAD):
+    """
+    Silero VAD 的 ONNX Runtime 后端：单线程推理，不与 TTS 抢核；
+    输入、状态、输出缓冲在初始化时分配并通过 IOBinding 绑定，逐帧调用不再分配内存。
+    起止点判定逻辑与 silero_vad.VADIterator 一致。
+    """
+
+    def __init__(self, config):
+        import onnxruntime as ort
+
+        self.sampling_rate = config.get("sampling_rate", 16000)
+        self.threshold = config.get("threshold", 0.5)
+        self.min_silence_samples = self.sampling_rate * config.get("min_silence_duration_ms", 100) / 1000
+        self.speech_pad_samples = self.sampling_rate * config.get("speech_pad_ms", 30) / 1000
+        self.window_size = 512 if self.sampling_rate == 16000 else 256
+        self.context_size = 64 if self.sampling_rate == 16000 else 32
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = config.get("intra_op_num_threads", 1)
+        options.inter_op_num_threads = 1
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        model_path = config.get("model_path") or self._default_model_path()
+        self.session = ort.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+
+        # 预分配缓冲：输入 = 上一帧末尾的 context + 当前帧
+        self._input = np.zeros((1, self.context_size + self.window_size), dtype=np.float32)
+        self._state = np.zeros((2, 1, 128), dtype=np.float32)
+        self._state_out = np.zeros_like(self._state)
+        self._output = np.zeros((1, 1), dtype=np.float32)
+        self._sr = np.array(self.sampling_rate, dtype=np.int64)
+        self._binding = self.session.io_binding()
+        self._binding.bind_input("input", "cpu", 0, np.float32, list(self._input.shape), self._input.ctypes.data)
+        self._binding.bind_input("state", "cpu", 0, np.float32, list(self._state.shape), self._state.ctypes.data)
+        self._binding.bind_input("sr", "cpu", 0, np.int64, [], self._sr.ctypes.data)
+        self._binding.bind_output("output", "cpu", 0, np.float32, list(self._output.shape), self._output.ctypes.data)
+        self._binding.bind_output("stateN", "cpu", 0, np.float32, list(self._state_out.shape), self._state_out.ctypes.data)
+
+        gate_config = config.get("pre_gate") or {}
+        self.gate = EnergyGate(gate_config) if gate_config.get("enabled", False) else None
+        self._gated = False
+        self.frames = 0
+        self.skipped_frames = 0
+        self.reset_states()
+        logger.debug(f"SileroVADOnnx initialized with model {model_path}")
+
+    @staticmethod
+    def _default_model_path():
+        """使用 silero_vad 包自带的 onnx 模型；只查找路径，不导入包（避免加载 torch）"""
+        spec = importlib.util.find_spec("silero_vad")
+        if spec is None or not spec.submodule_search_locations:
+            raise FileNotFoundError("未找到 silero_vad 包，请在配置中指定 model_path")
+        return os.path.join(list(spec.submodule_search_locations)[0], "data", "silero_vad.onnx")
+
+    def _reset_model(self):
+        self._state.fill(0)
+        self._input.fill(0)
+
+    def _speech_prob(self, audio_int16):
+        frame = self._input[0, self.context_size:]
+        frame[:] = audio_int16
+        frame *= 1.0 / 32768.0
+        self.session.run_with_iobinding(self._binding)
+        np.copyto(self._state, self._state_out)
+        self._input[0, :self.context_size] = self._input[0, -self.context_size:]
+        return float(self._output[0, 0])
+
+    def _iterate(self, speech_prob, window):
+        self.current_sample += window
+        if speech_prob >= self.threshold and self.temp_end:
+            self.temp_end = 0
+        if speech_prob >= self.threshold and not self.triggered:
+            self.triggered = True
+            return {"start": int(max(0, self.current_sample - self.speech_pad_samples - window))}
+        if speech_prob < self.threshold - 0.15 and self.triggered:
+            if not self.temp_end:
+                self.temp_end = self.current_sample
+            if self.current_sample - self.temp_end < self.min_silence_samples:
+                return None
+            speech_end = self.temp_end + self.speech_pad_samples - window
+            self.temp_end = 0
+            self.triggered = False
+            return {"end": int(speech_end)}
+        return None
+
+    def is_vad(self, data):
+        try:
+            audio_int16 = np.frombuffer(data, dtype=np.int16)
+            if len(audio_int16) != self.window_size:
+                raise ValueError(f"帧长必须为 {self.window_size}，实际为 {len(audio_int16)}")
+            self.frames += 1
+            loud_rms = None
+            if self.gate is not None and not self.triggered:
+                frame = self._input[0, self.context_size:]
+                frame[:] = audio_int16
+                frame *= 1.0 / 32768.0
+                if self.gate.is_silent(frame):
+                    self.current_sample += len(audio_int16)
+                    self.skipped_frames += 1
+                    self._gated = True
+                    return None
+                if not self.gate.last_silent:
+                    loud_rms = self.gate.last_rms
+                if self._gated:
+                    self._reset_model()
+                    self._gated = False
+            vad_output = self._iterate(self._speech_prob(audio_int16), len(audio_int16))
+            if loud_rms is not None and not self.triggered:
+                self.gate.update_noise(loud_rms)
+            if vad_output is not None:
+                logger.debug(f"VAD output: {vad_output}")
+            return vad_output
+        except Exception as e:
+            logger.error(f"Error in VAD processing: {e}")
+            return None
+
+    def reset_states(self):
+        self._reset_model()
+        self.triggered = False
+        self.temp_end = 0
+        self.current_sample = 0
+
+
 def create_instance(class_name, *args, **kwargs):
     # 获取类对象
     cls = globals().get(class_name)
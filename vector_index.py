@@ -0,0 +1,301 @@
+import glob
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from utils import atomic_write, read_json_file, write_json_file
+
+logger = logging.getLogger(__name__)
+
+
+def text_hash(text, kind="doc"):
+    """向量缓存的键：文本内容哈希，文档和查询分开（BGE 的查询会加检索指令）"""
+    return hashlib.sha1(f"{kind}\0{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """按内容哈希缓存向量的 LRU，文档分块和最近的查询共用"""
+
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return vector
+
+    def put(self, key, vector):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = vector
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class BatchEmbedder:
+    """
+    BGE 向量模型的封装：模型首次使用时才加载；文档分块去重、查缓存后，
+    未命中的按 batch_size 分批，由 workers 个线程并行编码（推理时 torch 会释放 GIL）。
+    """
+
+    def __init__(self, model_name, batch_size=64, workers=2, cache_size=4096, device="cpu"):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.workers = max(1, workers)
+        self.device = device
+        self.cache = EmbeddingCache(cache_size)
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def model(self):
+        with self._lock:
+            if self._model is None:
+                from langchain.embeddings import HuggingFaceBgeEmbeddings
+                model_kwargs = {'device': self.device}
+                encode_kwargs = {'normalize_embeddings': True, 'batch_size': self.batch_size}
+                self._model = HuggingFaceBgeEmbeddings(model_name=self.model_name
+                                                       , model_kwargs=model_kwargs
+                                                       , encode_kwargs=encode_kwargs)
+            return self._model
+
+    def embed_documents(self, texts):
+        """返回与 texts 逐行对应的归一化向量矩阵"""
+        keys = [text_hash(text) for text in texts]
+        vectors = {}
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key in vectors or key in missing:
+                continue
+            vector = self.cache.get(key)
+            if vector is None:
+                missing[key] = text
+            else:
+                vectors[key] = vector
+        if missing:
+            miss_keys, miss_texts = list(missing), list(missing.values())
+            batches = [miss_texts[i:i + self.batch_size] for i in range(0, len(miss_texts), self.batch_size)]
+            model = self.model
+            if self.workers > 1 and len(batches) > 1:
+                with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="embed") as executor:
+                    results = list(executor.map(model.embed_documents, batches))
+            else:
+                results = [model.embed_documents(batch) for batch in batches]
+            encoded = [vector for batch in results for vector in batch]
+            for key, vector in zip(miss_keys, encoded):
+                vector = np.asarray(vector, dtype=np.float32)
+                vectors[key] = vector
+                self.cache.put(key, vector)
+        if not keys:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.stack([vectors[key] for key in keys])
+
+    def embed_query(self, text):
+        key = text_hash(text, kind="query")
+        vector = self.cache.get(key)
+        if vector is None:
+            vector = np.asarray(self.model.embed_query(text), dtype=np.float32)
+            self.cache.put(key, vector)
+        return vector
+
+
+class VectorIndex:
+    """
+    持久化的文档向量索引，目录结构：
+    - manifest.json：每个文档的 sha256、mtime、大小以及在向量矩阵中的行区间，和当前数据文件的版本号
+    - embeddings-<版本>.npy：所有分块的归一化向量（float32），以 mmap 方式加载，重启后立即可查
+    - chunks-<版本>.jsonl：与向量逐行对应的分块文本和来源文件
+    update 时只对新增、修改的文档重新切分和向量化，删除的文档直接丢弃对应行。
+    数据文件按版本号写新文件，最后原子替换清单切换版本，中途崩溃不会读到不一致的索引。
+    """
+    VERSION = 1
+
+    def __init__(self, index_dir, signature=None):
+        """signature 描述向量模型和切分参数，变化时整个索引失效"""
+        self.index_dir = index_dir
+        self.signature = signature or {}
+        self.manifest_path = os.path.join(index_dir, "manifest.json")
+        self.generation = 0
+        self.files = {}
+        self.embeddings = None
+        self.chunks = []
+        self.load()
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def _embeddings_path(self, generation):
+        return os.path.join(self.index_dir, f"embeddings-{generation}.npy")
+
+    def _chunks_path(self, generation):
+        return os.path.join(self.index_dir, f"chunks-{generation}.jsonl")
+
+    def load(self):
+        """加载已有索引，向量矩阵只做内存映射，不读入内存"""
+        if not os.path.isfile(self.manifest_path):
+            return False
+        manifest = read_json_file(self.manifest_path) or {}
+        generation = manifest.get("generation", 0)
+        # 即使加载失败也从旧版本号往后写，重建时不会覆盖旧清单指向的文件，旧文件在写入后删除
+        self.generation = generation
+        if manifest.get("version") != self.VERSION or manifest.get("signature") != self.signature:
+            logger.info("向量索引的模型或切分参数已变化，需要重建")
+            return False
+        try:
+            with open(self._chunks_path(generation), "r", encoding="utf-8") as file:
+                chunks = [json.loads(line) for line in file if line.strip()]
+            embeddings = np.load(self._embeddings_path(generation), mmap_mode="r")
+        except (OSError, ValueError) as e:
+            logger.warning(f"向量索引文件损坏，需要重建: {e}")
+            return False
+        if len(chunks) != len(embeddings):
+            logger.warning("向量索引文件不一致，需要重建")
+            return False
+        self.files = manifest.get("files", {})
+        self.chunks = chunks
+        self.embeddings = embeddings
+        logger.info(f"已加载向量索引: {len(self.files)} 个文档, {len(self.chunks)} 个分块")
+        return True
+
+    @staticmethod
+    def _file_hash(file_path):
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as file:
+            for block in iter(lambda: file.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def update(self, doc_path, pattern, split_fn, embed_fn):
+        """
+        与 doc_path 下的文档同步：mtime 和大小都未变的文档直接复用，
+        变化的再比较 sha256，只有内容真正变化的文档才调用 split_fn/embed_fn。
+        返回 (新增或修改的文档数, 删除的文档数)
+        """
+        current = {}
+        for file_path in sorted(glob.glob(os.path.join(doc_path, pattern), recursive=True)):
+            stat = os.stat(file_path)
+            current[os.path.relpath(file_path, doc_path)] = (file_path, stat.st_mtime, stat.st_size)
+
+        keep, changed = {}, []
+        for name, (file_path, mtime, size) in current.items():
+            entry = self.files.get(name)
+            if entry is not None and entry["mtime"] == mtime and entry["size"] == size:
+                keep[name] = entry
+                continue
+            sha256 = self._file_hash(file_path)
+            if entry is not None and entry["sha256"] == sha256:
+                keep[name] = dict(entry, mtime=mtime, size=size)
+                continue
+            changed.append((name, file_path, sha256, mtime, size))
+        deleted = [name for name in self.files if name not in current]
+
+        if not changed and not deleted:
+            if keep != self.files:
+                # 只有 mtime 变化，更新清单即可
+                self.files = keep
+                self._write_manifest()
+            return 0, 0
+
+        # 保留未变化文档的行，拼上新向量化的分块
+        rows, chunks, files = [], [], {}
+        for name, entry in keep.items():
+            start, end = entry["rows"]
+            files[name] = dict(entry, rows=[len(chunks), len(chunks) + end - start])
+            rows.extend(range(start, end))
+            chunks.extend(self.chunks[start:end])
+        new_texts = []
+        for name, file_path, sha256, mtime, size in changed:
+            with open(file_path, "r", encoding="utf-8") as file:
+                texts = split_fn(file.read())
+            files[name] = {"sha256": sha256, "mtime": mtime, "size": size,
+                           "rows": [len(chunks), len(chunks) + len(texts)]}
+            chunks.extend({"text": text, "source": name} for text in texts)
+            new_texts.extend(texts)
+
+        parts = []
+        if rows:
+            parts.append(np.asarray(self.embeddings[rows], dtype=np.float32))
+        if new_texts:
+            parts.append(self._embed_new(new_texts, embed_fn))
+        dim = parts[0].shape[1] if parts else 0
+        embeddings = np.concatenate(parts) if parts else np.zeros((0, dim), dtype=np.float32)
+        self._write(files, chunks, embeddings)
+        logger.info(f"向量索引已更新: 新增/修改 {len(changed)} 个文档（{len(new_texts)} 个分块），删除 {len(deleted)} 个")
+        return len(changed), len(deleted)
+
+    def _embed_new(self, texts, embed_fn):
+        """修改过的文档里没变的分块，直接复用旧索引中内容相同的向量"""
+        existing = {}
+        if self.embeddings is not None:
+            for row, chunk in enumerate(self.chunks):
+                existing.setdefault(text_hash(chunk["text"]), row)
+        reuse = [existing.get(text_hash(text)) for text in texts]
+        todo = [i for i, row in enumerate(reuse) if row is None]
+        encoded = np.asarray(embed_fn([texts[i] for i in todo]), dtype=np.float32) if todo else None
+        dim = encoded.shape[1] if encoded is not None else self.embeddings.shape[1]
+        result = np.empty((len(texts), dim), dtype=np.float32)
+        for j, i in enumerate(todo):
+            result[i] = encoded[j]
+        for i, row in enumerate(reuse):
+            if row is not None:
+                result[i] = self.embeddings[row]
+        if len(todo) < len(texts):
+            logger.info(f"复用 {len(texts) - len(todo)} 个未变化分块的向量，新编码 {len(todo)} 个")
+        return result
+
+    def _write(self, files, chunks, embeddings):
+        """写新版本的数据文件，再原子替换清单切换过去，最后删除其他版本"""
+        os.makedirs(self.index_dir, exist_ok=True)
+        generation = self.generation + 1
+        np.save(self._embeddings_path(generation), embeddings)
+        atomic_write(self._chunks_path(generation),
+                     "".join(json.dumps(c, ensure_ascii=False) + "\n" for c in chunks))
+        self.generation = generation
+        self.files = files
+        self._write_manifest()
+        self.chunks = chunks
+        self.embeddings = np.load(self._embeddings_path(generation), mmap_mode="r")
+        self._remove_stale()
+
+    def _remove_stale(self):
+        """删除当前版本以外的数据文件：上一版本，以及因模型变化或损坏而未能加载的旧索引"""
+        current = {self._embeddings_path(self.generation), self._chunks_path(self.generation)}
+        for path in (glob.glob(os.path.join(self.index_dir, "embeddings-*.npy"))
+                     + glob.glob(os.path.join(self.index_dir, "chunks-*.jsonl"))):
+            if path not in current:
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    logger.warning(f"删除旧的向量索引文件失败 {path}: {e}")
+
+    def _write_manifest(self):
+        os.makedirs(self.index_dir, exist_ok=True)
+        write_json_file(self.manifest_path, {"version": self.VERSION, "signature": self.signature,
+                                             "generation": self.generation, "files": self.files})
+
+    def search(self, query_embedding, k=4):
+        """向量均已归一化，内积即余弦相似度；返回 [(分块, 相似度)]"""
+        if self.embeddings is None or len(self.chunks) == 0:
+            return []
+        scores = self.embeddings @ np.asarray(query_embedding, dtype=np.float32)
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.chunks[i], float(scores[i])) for i in top]